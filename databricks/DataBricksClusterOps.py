@@ -6,7 +6,6 @@ try:
     from databricks_cli.clusters.api import ClusterApi
     #from databricks_cli.dbfs.api import DbfsApi
     #from databricks_cli.dbfs.dbfs_path import DbfsPath
-    from databricks_cli.sdk.api_client import ApiClient
 except ModuleNotFoundError:
     print("Did you remember to 'source venv/bin/activate'?\n\n")
     raise
@@ -14,6 +13,8 @@ except ModuleNotFoundError:
 
 
 from .DataBricksGroups import DataBricksGroups
+from .resource_manager.cluster_cache import ClusterCache
+from .resilience import resilient_request, cli_api_client, cli_call
 
 dry_run = False
 
@@ -38,26 +39,48 @@ class DataBricksClusterOps:
         RESTART = 2
         ATTACH = 3
 
-    def __init__(self, host_: str, token_: str):
-        self.api_client = ApiClient(host=host_, token=token_)
+    def __init__(self, host_: str, token_: str, cache: ClusterCache | None = None):
+        self.api_client = cli_api_client(host_, token_)
         self.token = token_
         self.host = host_
-        self.cached_clusters = None
+        self.cache = cache or ClusterCache(host_)
 
-    def get_clusters(self):
+    def get_clusters(self, max_age: float | None = None):
         """ get the list of currently defined clusters (both online and offline)
+        The list is served from the shared cluster cache if it is younger than max_age seconds.
+        Clusters that were changed since the listing are refreshed one by one.
+        :param max_age: None - use the cache TTL. 0 - always fetch a fresh list (and refresh the cache)
         :return list( dict( cluster parameters))
         """
-        if self.cached_clusters is not None:
-            return self.cached_clusters
+        state = self.cache.read(max_age)
+        if state is not None:
+            for cluster_id in list(state['stale']):
+                cluster = self.get_cluster(cluster_id)
+                if cluster is None:
+                    state['clusters'].pop(cluster_id, None)
+                else:
+                    state['clusters'][cluster_id] = cluster
+            return list(state['clusters'].values())
 
         clusters_api = ClusterApi(self.api_client)
-        clusters_list = clusters_api.list_clusters()
+        clusters_list = cli_call(self.host, 'clusters/list', clusters_api.list_clusters)
+        clusters = clusters_list.get('clusters', [])
+        self.cache.store_all(clusters)
+        return clusters
+
+    def get_cluster(self, cluster_id: str) -> dict | None:
+        """Fetch a single cluster (clusters/get) and update it in the cache.
+        :return: the cluster, or None if it does not exist anymore"""
         try:
-            self.cached_clusters = clusters_list['clusters']
-        except KeyError:
-            return []
-        return self.cached_clusters
+            cluster = cli_call(self.host, 'clusters/get', lambda: ClusterApi(self.api_client).get_cluster(cluster_id))
+        except requests.exceptions.HTTPError as ex:
+            # a deleted cluster is reported as 400 INVALID_PARAMETER_VALUE, not 404
+            if ex.response is not None and ex.response.status_code in (400, 404):
+                self.cache.forget(cluster_id)
+                return None
+            raise
+        self.cache.update_one(cluster)
+        return cluster
 
     def print_clusters(self):
         """ will print something like
@@ -75,9 +98,10 @@ class DataBricksClusterOps:
         Create a new cluster
         :param json_spec:  json doc that defines the cluster
         """
-        new_cluster = ClusterApi(self.api_client).create_cluster(json_spec)
+        new_cluster = cli_call(self.host, 'clusters/create', lambda: ClusterApi(self.api_client).create_cluster(json_spec),
+                               idempotent=False)
         if new_cluster:
-            self.cached_clusters = None
+            self.cache.mark_stale(new_cluster['cluster_id'])
         return new_cluster
 
     def create_cluster(self, name: str, policy_id: str):
@@ -92,7 +116,11 @@ class DataBricksClusterOps:
 
         if name in set([c['cluster_name'] for c in self.get_clusters()]):
             raise AttributeError(f'cluster {name} already exists. Refusing to create another one')
+        return self.create_cluster_from_spec(self.cluster_spec(name, policy_id))
 
+    @staticmethod
+    def cluster_spec(name: str, policy_id: str = '', autotermination_minutes: int = 14) -> dict:
+        """:return: the json spec (as a dict) of a student cluster"""
         from string import Template
         import json
         # good luck using f"..." with json docs.
@@ -130,7 +158,8 @@ class DataBricksClusterOps:
         }""")
         tmp = template.substitute(cluster_name=name, policy_id=policy_id)
         json_spec = json.loads(tmp)
-        return self.create_cluster_from_spec(json_spec)
+        json_spec['autotermination_minutes'] = autotermination_minutes
+        return json_spec
 
     def cluster_from_name(self, name: str):
         clusters = self.get_clusters()
@@ -152,12 +181,19 @@ class DataBricksClusterOps:
             print(f"FAKE: delete cluster {name}")
             return
         r = self.cluster_from_name(name)
-        ClusterApi(self.api_client).delete_cluster(cluster_id=r['cluster_id'])
+        self.terminate_cluster(r['cluster_id'])
+
+    def terminate_cluster(self, cluster_id: str):
+        """Terminate (turn off) a cluster by its ID. Also valid while the cluster is still PENDING."""
+        cli_call(self.host, 'clusters/delete', lambda: ClusterApi(self.api_client).delete_cluster(cluster_id=cluster_id))
+        self.cache.mark_stale(cluster_id)
 
     def permanent_delete_cluster(self, cluster_id: str, verbose: bool = False):
         if verbose:
             print(f"permanent delete cluster {cluster_id}")
-        ClusterApi(self.api_client).permanent_delete(cluster_id=cluster_id)
+        cli_call(self.host, 'clusters/permanent-delete',
+                 lambda: ClusterApi(self.api_client).permanent_delete(cluster_id=cluster_id))
+        self.cache.forget(cluster_id)
 
     def permanent_delete_all_clusters(self, verbose: bool = False, unsafe: bool = False):
         """Delete forever all the clusters in this workspace"""
@@ -166,9 +202,10 @@ class DataBricksClusterOps:
             if ok != 'yes':
                 print("Cancelled.")
                 return
-        clusters = self.get_clusters()
-        for cluster in clusters:
-            self.permanent_delete_cluster(cluster['cluster_id'], verbose)
+        from .fleet_ops import run_fleet_operation, permanent_delete, format_results
+        results = run_fleet_operation(self, permanent_delete, progress=verbose)
+        if verbose:
+            print(format_results(results))
 
     def edit_cluster_permissions(self, cluster_id, config: dict) -> None:
         """
@@ -180,7 +217,7 @@ class DataBricksClusterOps:
         """
         headers = {"Authorization": f"Bearer {self.token}"}
         url = f'{self.host}/api/2.0/permissions/clusters/{cluster_id}'
-        response = requests.api.put(url=url, headers=headers, data=json.dumps(config))
+        response = resilient_request('PUT', url=url, headers=headers, data=json.dumps(config))
         response.raise_for_status()
 
     def set_cluster_permission(self, cluster_id: str, group_name: str, permission: ClusterPermission) -> None:
@@ -188,39 +225,53 @@ class DataBricksClusterOps:
         if dry_run:
             print(f"FAKE:  set_cluster_permission {cluster_id} {group_name} {permission}")
             return
-        if permission == self.ClusterPermission.ATTACH:
-            s = "CAN_ATTACH_TO"
-        elif permission == self.ClusterPermission.RESTART:
-            s = "CAN_RESTART"
-        elif permission == self.ClusterPermission.MANAGE:
-            s = "CAN_MANAGE"
-        else:
-            raise ValueError('impossible permission')
-        config = {"access_control_list": [{"group_name": group_name, "permission_level": s}]}
+        config = {"access_control_list": [{"group_name": group_name,
+                                           "permission_level": self.permission_level(permission)}]}
         self.edit_cluster_permissions(cluster_id, config)
 
+    @classmethod
+    def permission_level(cls, permission: ClusterPermission) -> str:
+        """:return: the name the permissions API uses for this permission"""
+        if permission == cls.ClusterPermission.ATTACH:
+            return "CAN_ATTACH_TO"
+        elif permission == cls.ClusterPermission.RESTART:
+            return "CAN_RESTART"
+        elif permission == cls.ClusterPermission.MANAGE:
+            return "CAN_MANAGE"
+        raise ValueError('impossible permission')
+
     def get_cluster_permission(self, cluster_id: str):
         headers = {"Authorization": f"Bearer {self.token}"}
         url = f'{self.host}/api/2.0/permissions/clusters/{cluster_id}'
-        response = requests.api.get(url=url, headers=headers)
+        response = resilient_request('GET', url=url, headers=headers)
         response.raise_for_status()
         return response.json()
 
     def attach_groups_to_clusters(self, groups: list, verbose: bool = False) -> None:
         """
-        For each group (in the format gNUMBER), attach it to a cluster with the name cluster_NUMBER
+        Let each group restart its cluster. The cluster of a group is looked up in the roster index
+        (cluster_NN for group_NN if the group is not indexed).
         :param: groups . list of group names.
         """
+        from .roster_index import cluster_for_group
         for gname in groups:
-            gid = int(gname[1:])
-            cluster_name = f"cluster_{gid}"
+            binding = cluster_for_group(gname)
+            if binding is None:
+                logging.error(f"Attaching group {gname} Failed: no cluster for this group.")
+                continue
+            cluster_name = binding.cluster_name
             if verbose:
-                print(f"attaching group {gid} to {cluster_name}")
-                try:
-                    self.set_cluster_permission(self.cluster_from_name(cluster_name)['cluster_id'], gname, self.ClusterPermission.RESTART)
-                except requests.exceptions.HTTPError as ex:
-                    if ex.response.status_code == 404:
-                        logging.error(f"Attaching group {gid} to {cluster_name} Failed: group not found.")
+                print(f"attaching group {gname} to {cluster_name}")
+            try:
+                cluster_id = binding.cluster_id or self.cluster_from_name(cluster_name)['cluster_id']
+                self.set_cluster_permission(cluster_id, gname, self.ClusterPermission.RESTART)
+            except requests.exceptions.HTTPError as ex:
+                if ex.response.status_code == 404:
+                    logging.error(f"Attaching group {gname} to {cluster_name} Failed: group not found.")
+                else:
+                    logging.error(f"Attaching group {gname} to {cluster_name} Failed: {ex}")
+            except requests.exceptions.RequestException as ex:
+                logging.error(f"Attaching group {gname} to {cluster_name} Failed: {ex}")
 
     def install_libraries(self, cluster_id: str, libraries: list[dict]) -> requests.Response:
         """
@@ -259,7 +310,19 @@ class DataBricksClusterOps:
         headers = {"Authorization": f"Bearer {self.token}"}
         url = f'{self.host}/api/2.0/libraries/install'
         data = json.dumps({"cluster_id": cluster_id, "libraries": libraries})
-        return requests.api.post(url=url, headers=headers, data=data)
+        return resilient_request('POST', url=url, headers=headers, data=data)
+
+    def get_all_library_statuses(self) -> list[dict]:
+        """
+        The status of the libraries on all the clusters, in one call.
+        https://docs.databricks.com/api/workspace/libraries/allclusterlibrarystatuses
+        :return: list of {'cluster_id': ..., 'library_statuses': [{'library': {...}, 'status': ..., 'messages': [...]}]}
+        """
+        headers = {"Authorization": f"Bearer {self.token}"}
+        url = f'{self.host}/api/2.0/libraries/all-cluster-statuses'
+        response = resilient_request('GET', url=url, headers=headers)
+        response.raise_for_status()
+        return response.json().get('statuses', [])
 
     def update_configuration(self, cluster: dict, config: dict) -> requests.Response:
         """
@@ -273,7 +336,9 @@ class DataBricksClusterOps:
         headers = {"Authorization": f"Bearer {self.token}"}
         url = f'{self.host}/api/2.0/clusters/edit'
         data = json.dumps(config)
-        return requests.api.post(url=url, headers=headers, data=data)
+        response = resilient_request('POST', url=url, headers=headers, data=data)
+        self.cache.mark_stale(config.get('cluster_id', cluster['cluster_id']))
+        return response
 
     def update_auto_termination(self, cluster: dict, minutes: int) -> requests.Response:
         """
@@ -316,5 +381,6 @@ class DataBricksClusterOps:
             _data['cluster_id'] = cluster_id
         headers = {"Authorization": f"Bearer {self.token}"}
         url = f'{self.host}/api/2.0/clusters/pin'
-        response = requests.post(url,json.dumps(_data), headers=headers)
+        response = resilient_request('POST', url, data=json.dumps(_data), headers=headers)
+        self.cache.mark_stale(cluster_id)
         response.raise_for_status()
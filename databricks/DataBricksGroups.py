@@ -1,7 +1,9 @@
+import json
 import requests
-from databricks_cli.sdk.api_client import ApiClient
 from databricks_cli.groups.api import GroupsApi
 
+from .resilience import resilient_request, cli_api_client, cli_call
+
 
 class DataBricksGroups:
     """
@@ -14,36 +16,98 @@ class DataBricksGroups:
     """
 
     def __init__(self, host: str, token: str):
-        self.api_client = ApiClient(host=host, token=token)
+        self.api_client = cli_api_client(host, token)
         self.token = token
         self.host = host
         self.groups_api = GroupsApi(self.api_client)
 
     def get_group_members(self, groupname: str) -> list:
         try:
-            return self.groups_api.list_members(groupname)['members']
+            return cli_call(self.host, 'groups/list-members', lambda: self.groups_api.list_members(groupname))['members']
         except KeyError:
             return []
 
     def list_groups(self) -> list[str]:
-        return self.groups_api.list_all()['group_names']
+        return cli_call(self.host, 'groups/list', self.groups_api.list_all)['group_names']
 
     def list_users(self):
-        """Get a dictionary of all users in the workspace
-        See the docs how to filter the returned list by attributes or filtering. """
+        """Get a dictionary of all users in the workspace, in the SCIM response format {'Resources': [...]}
+        Prefer iter_users() - it does not hold the whole workspace in memory."""
+        return {'Resources': list(self.iter_users())}
+
+    def _get_scim_page(self, resource: str, start_index: int, count: int,
+                       attributes: str | None, filter_: str | None) -> dict:
         headers = {"Authorization": f"Bearer {self.token}"}
-        response = requests.get(url=f"{self.host}/api/2.0/preview/scim/v2/Users?&count=10000", headers=headers)
+        params = {'startIndex': start_index, 'count': count}
+        if attributes:
+            params['attributes'] = attributes
+        if filter_:
+            params['filter'] = filter_
+        response = resilient_request('GET', url=f"{self.host}/api/2.0/preview/scim/v2/{resource}", headers=headers, params=params)
         response.raise_for_status()
         return response.json()
 
-    def create_group(self, group_name: str):
-        import json
-        import requests
+    def iter_scim(self, resource: str, attributes: str | None = None, filter_: str | None = None,
+                  page_size: int = 100, prefetch: int = 2):
+        """
+        Generator over all the objects of a SCIM resource ('Users', 'Groups', 'ServicePrincipals').
+        Pages are requested with startIndex/count; up to 'prefetch' pages are fetched
+        concurrently ahead of the consumer, so memory stays at a few pages regardless of workspace size.
 
+        :param attributes: projection, e.g. "userName,id"
+        :param filter_: SCIM filter, e.g. 'userName sw "group"'
+        see https://docs.databricks.com/api/azure/workspace/users/list
+        """
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+
+        first = self._get_scim_page(resource, 1, page_size, attributes, filter_)
+        resources = first.get('Resources', [])
+        yield from resources
+        total = int(first.get('totalResults', 0))
+        # the server may cap the page size: the stride is what it actually returned
+        stride = len(resources)
+        expected = 1 + stride
+        if expected > total or not stride:
+            return
+
+        with ThreadPoolExecutor(max_workers=max(1, prefetch)) as executor:
+            pending = deque()
+            next_index = expected
+            while expected <= total:
+                while next_index <= total and len(pending) < max(1, prefetch):
+                    pending.append(executor.submit(self._get_scim_page, resource, next_index, page_size,
+                                                   attributes, filter_))
+                    next_index += stride
+                page = pending.popleft().result().get('Resources', [])
+                if not page:
+                    # the workspace shrank while we were paging
+                    break
+                yield from page
+                expected += len(page)
+                if len(page) != stride:
+                    # a short page: the prefetched pages are misaligned, request again from here
+                    for f in pending:
+                        f.cancel()
+                    pending.clear()
+                    next_index = expected
+            for f in pending:
+                f.cancel()
+
+    def iter_users(self, attributes: str | None = None, filter_: str | None = None, **kwargs):
+        return self.iter_scim('Users', attributes, filter_, **kwargs)
+
+    def iter_groups(self, attributes: str | None = None, filter_: str | None = None, **kwargs):
+        return self.iter_scim('Groups', attributes, filter_, **kwargs)
+
+    def iter_service_principals(self, attributes: str | None = None, filter_: str | None = None, **kwargs):
+        return self.iter_scim('ServicePrincipals', attributes, filter_, **kwargs)
+
+    def create_group(self, group_name: str):
         headers = {"Authorization": f"Bearer {self.token}"}
         url = f'{self.host}/api/2.0/preview/scim/v2/Groups'
         j = json.dumps({"displayName": group_name})
-        resp = requests.post(url, headers=headers, data=j)
+        resp = resilient_request('POST', url, headers=headers, data=j)
         # return self.groups_api.create(group_name) #  as of 2024-06-25, this api is broken
         return resp
 
@@ -51,7 +115,7 @@ class DataBricksGroups:
         """delete a group.
         :return: HTTP status code 200, 403, 404"""
         try:
-            self.groups_api.delete(group_name)
+            cli_call(self.host, 'groups/delete', lambda: self.groups_api.delete(group_name))
         except requests.exceptions.HTTPError as ex:
             return ex.response.status_code
         return 200
@@ -69,7 +133,18 @@ class DataBricksGroups:
         url = f'{self.host}/api/2.0/groups/add-member'
         attr = 'user_name' if is_user else 'group_name'
         data = '{ "%s": "%s", "parent_name": "%s" }' % (attr, member_name, group_name)
-        return requests.api.post(url=url, headers=headers, data=data)
+        return resilient_request('POST', url=url, headers=headers, data=data)
+
+    def remove_member_from_group(self, member_name: str, group_name: str, is_user: bool):
+        """
+        Remove a user or a group from a group. The user itself is not deleted.
+        :return: the http response
+        """
+        headers = {"Authorization": f"Bearer {self.token}"}
+        url = f'{self.host}/api/2.0/groups/remove-member'
+        attr = 'user_name' if is_user else 'group_name'
+        data = json.dumps({attr: member_name, "parent_name": group_name})
+        return resilient_request('POST', url=url, headers=headers, data=data)
 
     def create_users(self, users: list) -> int:
         """
@@ -95,7 +170,7 @@ class DataBricksGroups:
         """given user ID (as a string containing integer), return the user details"""
         # https://docs.databricks.com/api/latest/scim/index.html#operation/getUser
         headers = {"Authorization": f"Bearer {self.token}"}
-        response = requests.get(url=f"{self.host}/api/2.0/preview/scim/v2/Users/{id_}", headers=headers)
+        response = resilient_request('GET', url=f"{self.host}/api/2.0/preview/scim/v2/Users/{id_}", headers=headers)
         response.raise_for_status()
         return response.json()
 
@@ -111,13 +186,13 @@ class DataBricksGroups:
             if delete_user:
                 id = user
                 url = f"{self.host}/api/2.0/preview/scim/v2/Users/{id}"
-                response = requests.api.delete(url, headers=headers)
+                response = resilient_request('DELETE', url, headers=headers)
                 response.raise_for_status()
             else:
                 url = f'{self.host}/api/2.0/preview/scim/v2/Users'
                 data = """{{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"userName":"{user}"}}""".format(
                     user=user)
-                response = requests.api.post(url=url, headers=headers, data=data)
+                response = resilient_request('POST', url=url, headers=headers, data=data)
             if response:  # this format of checking will cover also 201, 304 etc.
                 num_ok += 1
         return num_ok
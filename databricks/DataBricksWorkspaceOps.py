@@ -1,12 +1,27 @@
 # Purpose: delete all user folders except for a list of users
+#
+# The folders under /Users are indexed with concurrent listing (folders, objects, size, last modified),
+# and the deletion is driven by the index: exclusions, inactivity, dry-run, concurrency and a rate limit.
+#
+#   python DataBricksWorkspaceOps.py --index
+#   python DataBricksWorkspaceOps.py --delete --exclude cnoam@technion.ac.il --dry-run
 
-from databricks.sdk import WorkspaceClient
+import concurrent.futures
+import threading
+import time
+from dataclasses import dataclass
 
 
-def list_users_dirs(token, host):
+def workspace_client(token, host):
     """ This works fine with a token generated in the workspace GUI"""
+    from databricks.sdk import WorkspaceClient
+    return WorkspaceClient(token=token, host=host)
 
-    w = WorkspaceClient(token=token, host=host)
+
+def list_users_dirs(token, host, w=None):
+    """ This works fine with a token generated in the workspace GUI"""
+
+    w = w or workspace_client(token, host)
     names = []
     for i in w.workspace.list(f'/Users/', recursive=False):
         if i.object_type.name == 'DIRECTORY':
@@ -15,31 +30,161 @@ def list_users_dirs(token, host):
     return names
 
 
-def delete_user_folders(token, host, exclusion_list):
+@dataclass
+class FolderStats:
+    path: str
+    folders: int = 0
+    objects: int = 0            # notebooks, files, libraries...
+    size: int = 0               # bytes, of the objects that report a size (files)
+    last_modified: int = 0      # milliseconds since epoch, 0 if unknown
+
+    def add(self, info):
+        if info.object_type.name == 'DIRECTORY':
+            self.folders += 1
+        else:
+            self.objects += 1
+            self.size += getattr(info, 'size', None) or 0
+        self.last_modified = max(self.last_modified, getattr(info, 'modified_at', None) or 0)
+
+
+def build_tree_index(w, root='/Users', max_workers=8) -> dict:
+    """
+    Index the folders directly under root, with the totals of their whole subtree.
+    Many directories are listed concurrently, with one WorkspaceClient.
+    :return: dict {folder path: FolderStats}
+    """
+    index = {}
+
+    def list_dir(path):
+        return list(w.workspace.list(path, recursive=False))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        top = list_dir(root)
+        pending = {}
+        for info in top:
+            if info.object_type.name == 'DIRECTORY':
+                index[info.path] = FolderStats(info.path)
+                pending[executor.submit(list_dir, info.path)] = info.path
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                owner = pending.pop(future)   # the user folder this directory is in
+                for info in future.result():
+                    index[owner].add(info)
+                    if info.object_type.name == 'DIRECTORY':
+                        pending[executor.submit(list_dir, info.path)] = owner
+    return index
+
+
+def select_folders(index: dict, exclusion_list=(), inactive_days=None, now=None) -> list:
+    """
+    :param exclusion_list: user names (e.g. 'cnoam@technion.ac.il') whose folders are kept
+    :param inactive_days: select only folders not modified in this many days
+    :return: the folder paths to delete
+    """
+    excluded = {'/Users/' + i for i in exclusion_list}
+    now_ms = (now or time.time()) * 1000
+    selected = []
+    for path, stats in sorted(index.items()):
+        if path in excluded:
+            continue
+        if inactive_days is not None and stats.last_modified > now_ms - inactive_days * 86400 * 1000:
+            continue
+        selected.append(path)
+    return selected
+
+
+class RateLimiter:
+    """Let at most 'rate' calls per second through, across threads"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def delete_folders(w, folders, dry_run=False, max_workers=4, rate=5.0) -> list:
+    """
+    Delete the folders (recursively) concurrently, at most 'rate' deletions per second.
+    :return: list of (folder, 'deleted' | 'dry-run' | 'failed', error message)
+    """
+    limiter = RateLimiter(rate)
+
+    def delete(folder):
+        if dry_run:
+            return folder, 'dry-run', ''
+        limiter.wait()
+        try:
+            w.workspace.delete(folder, recursive=True)
+            return folder, 'deleted', ''
+        except Exception as ex:  # the sdk raises DatabricksError subclasses, e.g. "Folder ... is protected"
+            return folder, 'failed', str(ex)
+
+    if not folders:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(folders))) as executor:
+        results = list(executor.map(delete, folders))
+    for folder, status, error in results:
+        print(f'{status:8} {folder} {error}')
+    return results
+
+
+def delete_user_folders(token, host, exclusion_list, dry_run=False, inactive_days=None, max_workers=4, rate=5.0, w=None):
     """ Delete the workspace folders of all users except for the ones in the exclusion list.
     NOTE: if you get an error such as:
     "databricks.sdk.core.DatabricksError: Folder dds.cloud@technion.ac.il is protected"
     it means that the user still exists. You need to first delete the user (from UI or script) and then run this script.
     """
-    w = WorkspaceClient(token=token, host=host)
-    exclusion_list = ['/Users/' +i for i in exclusion_list]
-    user_folders = list_users_dirs(token, host)
-    for folder in user_folders:
-        if folder not in exclusion_list:
-            print(f'deleting {folder}')
-            w.workspace.delete(folder, recursive=True)
+    w = w or workspace_client(token, host)
+    index = build_tree_index(w, '/Users', max_workers=max_workers * 2)
+    folders = select_folders(index, exclusion_list, inactive_days)
+    return delete_folders(w, folders, dry_run=dry_run, max_workers=max_workers, rate=rate)
+
+
+def format_index(index: dict) -> str:
+    from tabulate import tabulate
+    import datetime
+
+    rows = [[s.path, s.folders, s.objects, s.size,
+             datetime.datetime.fromtimestamp(s.last_modified / 1000).strftime('%Y-%m-%d') if s.last_modified else '']
+            for s in sorted(index.values(), key=lambda s: s.path)]
+    return tabulate(rows, headers=['folder', 'folders', 'objects', 'bytes', 'last modified'])
 
 
 import os
 if __name__ == "__main__":
     from dotenv import load_dotenv
+    import argparse
     load_dotenv()
     host = os.getenv('DATABRICKS_HOST')
     token = os.getenv('DATABRICKS_WS_TOKEN')
     if host is None or token is None:
         raise RuntimeError('must set the env vars!')
 
-    delete_folders = False
-    if delete_folders:
-        delete_user_folders(token, host, ['cnoam@technion.ac.il','efrat.maimon@technion.ac.il',
-                                      'test@technion.ac.il'])
+    parser = argparse.ArgumentParser(description="Index and delete the user folders of the workspace")
+    parser.add_argument("--index", action="store_true", default=False, help="print the index of /Users")
+    parser.add_argument("--delete", action="store_true", default=False, help="delete the user folders")
+    parser.add_argument("--dry-run", action="store_true", default=False, help="with --delete: only print what would be deleted")
+    parser.add_argument("--exclude", nargs='*', default=['cnoam@technion.ac.il', 'efrat.maimon@technion.ac.il',
+                                                         'test@technion.ac.il'], help="user names whose folders are kept")
+    parser.add_argument("--inactive-days", type=int, help="with --delete: only folders not modified in this many days")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent deletions")
+    parser.add_argument("--rate", type=float, default=5.0, help="max deletions per second")
+    args = parser.parse_args()
+
+    w = workspace_client(token, host)
+    if args.index:
+        print(format_index(build_tree_index(w)))
+    if args.delete:
+        if not args.dry_run and input("About to delete user folders. If this is ok, type 'yes': ") != 'yes':
+            raise SystemExit("Cancelled.")
+        delete_user_folders(token, host, args.exclude, dry_run=args.dry_run, inactive_days=args.inactive_days,
+                            max_workers=args.workers, rate=args.rate, w=w)
@@ -1,5 +1,3 @@
-import logging
-
 class MoodleFileParser:
     """this class has helper methods to parse files created by Moodle
     The parsed data can then be used by external script
@@ -9,48 +7,16 @@ class MoodleFileParser:
     def __init__(self):
         pass
 
-    @classmethod
+    @staticmethod
     def parse_moodle_csv(filename: str):
         """
         read a CSV file containing Group assignment in Moodle.
-        Currently limited to 3 members in each group.
-        :return: dict { id:integer -> [user_email] }
+        Any number of members per group ('Member N Email' columns); invalid rows are skipped.
+        see roster.py. The groups keep their number of the last sync (roster_index.numbered_roster())
+        :return: dict { id:integer -> [user_email] }, where id is the number of the group (group_NN)
         """
-        import csv
-        out = {}
-        rowcount = 0
-
-        with open(filename) as csv_file:
-            csv_reader = csv.reader(csv_file, delimiter=',')
-            for row in csv_reader:
-                user3 = ''
-
-                if rowcount == 0:
-                    if row[0] != 'Group ID':
-                        raise Exception('unexpected CSV format. First line MUST start with "Group ID"')
-                    col_names = row
-                    index_email1 = col_names.index('Member 1 Email')
-                    index_email2 = col_names.index('Member 2 Email')
-                    index_email3 =  col_names.index('Member 3 Email')
-                    rowcount = 1
-                    continue  # skip header
-                if len(row) == 0:
-                    continue
-                if len(row) >= 23:
-                    user3 = row[index_email3]
-                rowcount += 1
-                if len(row) < index_email1:
-                    logging.error(f"skipping invalid row in CSV file: {row}")
-                    continue
-                out[rowcount] = []
-                user1 = row[index_email1]
-                if len(row) > index_email1+1:
-                    user2 = row[index_email2]
-                else: user2 = ''
-                if user1 != '': out[rowcount].append(user1)
-                if user2 != '': out[rowcount].append(user2)
-                if user3 != '': out[rowcount].append(user3)
-        return out
+        from .roster_index import numbered_roster
+        return {g.ordinal: list(g.members) for g in numbered_roster(filename).values()}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,5 @@
+# databricks-sql-connector and databricks-sdk install into a 'databricks' namespace package, which this package
+# shadows: extend the search path so that 'from databricks import sql' and 'databricks.sdk' are still found.
+from pkgutil import extend_path
+
+__path__ = extend_path(__path__, __name__)
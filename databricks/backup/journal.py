@@ -0,0 +1,93 @@
+"""
+Journal of a backup run, so an interrupted run (expired token, network loss) can resume.
+
+journal.jsonl in the backup folder has one json record per line:
+    {"event": "start", "root": "/Users", "time": ...}
+    {"event": "listed", "path": <directory>, "objects": [...]}     the listing of one directory
+    {"event": "exported", "entry": {<ManifestEntry>}}
+    {"event": "failed", "path": <object>, "error": "..."}
+    {"event": "done", "time": ...}
+
+A resumed run reuses the listings, keeps what was exported, and retries only what failed or was not done.
+Lines are appended and flushed one by one, so a crash loses at most the last record.
+"""
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+JOURNAL_NAME = "journal.jsonl"
+
+
+@dataclass
+class JournalState:
+    """What an unfinished run did"""
+    root: str
+    listed: dict = field(default_factory=dict)     # directory -> objects
+    exported: dict = field(default_factory=dict)   # path -> manifest entry (dict)
+    failed: dict = field(default_factory=dict)     # path -> error
+
+
+class BackupJournal:
+
+    def __init__(self, backup_dir: str):
+        self.filename = os.path.join(backup_dir, JOURNAL_NAME)
+        self._lock = threading.Lock()
+        self._file = None
+
+    def unfinished(self) -> JournalState | None:
+        """:return: the state of the last run, if it did not finish"""
+        if not os.path.exists(self.filename):
+            return None
+        state = None
+        with open(self.filename) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # the last line of a crashed run may be cut
+                event = record['event']
+                if event == 'start':
+                    state = JournalState(root=record['root'])
+                elif state is None:
+                    continue
+                elif event == 'listed':
+                    state.listed[record['path']] = record['objects']
+                elif event == 'exported':
+                    state.exported[record['entry']['path']] = record['entry']
+                    state.failed.pop(record['entry']['path'], None)
+                elif event == 'failed':
+                    state.failed[record['path']] = record['error']
+                elif event == 'done':
+                    state = None
+        return state
+
+    def start(self, root: str, resume: bool = False):
+        """Start a new journal, or (resume=True) continue appending to the current one"""
+        self._file = open(self.filename, 'a' if resume else 'w')
+        if not resume:
+            self._write({'event': 'start', 'root': root, 'time': time.time()})
+
+    def _write(self, record: dict):
+        with self._lock:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+
+    def listed(self, path: str, objects: list[dict]):
+        self._write({'event': 'listed', 'path': path, 'objects': objects})
+
+    def exported(self, entry: dict):
+        self._write({'event': 'exported', 'entry': entry})
+
+    def failed(self, path: str, error: str):
+        self._write({'event': 'failed', 'path': path, 'error': error})
+
+    def finish(self):
+        self._write({'event': 'done', 'time': time.time()})
+        self.close()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
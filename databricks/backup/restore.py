@@ -0,0 +1,271 @@
+"""
+Restore (or seed) workspace folders from a backup.
+
+    items = items_from_directory("./databricks_94290_backup_2024w", prefix="cnoam@technion.ac.il/starter")
+    results = WorkspaceRestore(host, token).run(items, ["/Groups/group_01", "/Groups/group_02"], policy='skip')
+
+The source is a backup folder (with or without manifest.json) or a snapshot of a BackupStore.
+Every item has a path relative to the backup root, e.g. 'a@x.com/hw1' (a notebook) or
+'a@x.com/data/x.csv' (a file). It is imported under each target folder.
+
+* all the parent folders are created first, once each (workspace/mkdirs creates the missing parents)
+* the objects are imported with a bounded worker pool
+* policy: 'overwrite' replaces existing objects, 'skip' keeps them, 'fail' reports them as failed
+* the content is streamed from the backup copy in a multipart/form-data import (no base64 json doc in memory,
+  no size limit of the json import)
+"""
+import argparse
+import concurrent.futures
+import io
+import json
+import logging
+import os
+import posixpath
+import tempfile
+import uuid
+from dataclasses import dataclass
+
+import requests
+
+from ..resilience import resilient_request
+from .store import BackupStore, CorruptBlobError
+from .workspace_backup import MANIFEST_NAME, NOTEBOOK_EXTENSIONS
+
+LANGUAGE_OF_EXTENSION = {ext: lang for lang, ext in NOTEBOOK_EXTENSIONS.items()}
+NOTEBOOK_HEADERS = (b'# Databricks notebook source', b'-- Databricks notebook source',
+                    b'// Databricks notebook source')
+POLICIES = ('overwrite', 'skip', 'fail')
+SPOOL_SIZE = 8 * 1024 * 1024
+
+
+class MultipartBody:
+    """
+    A multipart/form-data body made of form fields and one streamed file part.
+    requests sends it with read(), block by block; seek(0) rewinds it for a retry.
+    """
+
+    def __init__(self, fields: dict, file_field: str, filename: str, fileobj):
+        self.boundary = uuid.uuid4().hex
+        head = b''.join(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode()
+                        for k, v in fields.items())
+        head += (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n').encode()
+        self._head, self._tail = head, f'\r\n--{self.boundary}--\r\n'.encode()
+        self._file = fileobj
+        self._file_size = fileobj.seek(0, os.SEEK_END)
+        self.seek(0)
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return len(self._head) + self._file_size + len(self._tail)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET):
+        if (offset, whence) != (0, os.SEEK_SET):
+            raise io.UnsupportedOperation("can only rewind")
+        self._file.seek(0)
+        self._parts = [io.BytesIO(self._head), self._file, io.BytesIO(self._tail)]
+        return 0
+
+    def read(self, size: int = -1) -> bytes:
+        out = b''
+        while self._parts and (size < 0 or len(out) < size):
+            data = self._parts[0].read(-1 if size < 0 else size - len(out))
+            if data:
+                out += data
+            else:
+                self._parts.pop(0)
+        return out
+
+
+@dataclass
+class RestoreItem:
+    rel_path: str           # workspace path relative to the backup root, without the notebook extension
+    language: str | None    # PYTHON / SQL / ... for notebooks. None for files
+    open: callable          # () -> binary file object with the content (the caller closes it)
+
+
+@dataclass
+class RestoreResult:
+    path: str               # workspace path
+    status: str             # imported / skipped / failed
+    error: str = ''
+
+
+def _notebook_language(local_path: str, workspace_path: str | None, head: bytes | None) -> str | None:
+    """A backup copy is a notebook if its workspace path lacks the extension, or (no manifest) by its header"""
+    root, ext = os.path.splitext(local_path)
+    language = LANGUAGE_OF_EXTENSION.get(ext.lower())
+    if language is None:
+        return None
+    if workspace_path is not None:
+        return language if not workspace_path.endswith(ext) else None
+    return language if head is not None and head.startswith(NOTEBOOK_HEADERS) else None
+
+
+def _item(local_path: str, workspace_path: str | None, open_, head: bytes | None = None) -> RestoreItem:
+    language = _notebook_language(local_path, workspace_path, head)
+    rel = local_path.replace(os.sep, '/')
+    if language:
+        rel = os.path.splitext(rel)[0]
+    return RestoreItem(rel, language, open_)
+
+
+def _under(rel: str, prefix: str) -> bool:
+    prefix = prefix.strip('/')
+    return not prefix or rel == prefix or rel.startswith(prefix + '/')
+
+
+def items_from_directory(backup_dir: str, prefix: str = '') -> list[RestoreItem]:
+    """The items of a backup folder. With a manifest, the object types are known; otherwise they are guessed"""
+    def reader(filename):
+        return lambda: open(filename, 'rb')
+
+    items = []
+    manifest = os.path.join(backup_dir, MANIFEST_NAME)
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            for e in json.load(f)['objects']:
+                items.append(_item(e['local_path'], e['path'], reader(os.path.join(backup_dir, e['local_path']))))
+    else:
+        for dirpath, _, filenames in os.walk(backup_dir):
+            for name in filenames:
+                full = os.path.join(dirpath, name)
+                with open(full, 'rb') as f:
+                    head = f.read(64)
+                items.append(_item(os.path.relpath(full, backup_dir), None, reader(full), head))
+    return [i for i in items if _under(i.rel_path, prefix)]
+
+
+def items_from_snapshot(store: BackupStore, snapshot_id: str, prefix: str = '') -> list[RestoreItem]:
+    def reader(sha256):
+        def open_():
+            # the blob is decompressed to a spooled file: large contents go to disk, not to memory
+            f = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+            store.read_to(sha256, f)
+            f.seek(0)
+            return f
+        return open_
+
+    items = [_item(e['local_path'], e['path'], reader(e['sha256']))
+             for e in store.list_snapshot(snapshot_id)]
+    return [i for i in items if _under(i.rel_path, prefix)]
+
+
+def target_path(item: RestoreItem, target: str, prefix: str = '') -> str:
+    """:return: the workspace path of the item under the target folder"""
+    prefix = prefix.strip('/')
+    rel = item.rel_path[len(prefix):].lstrip('/') if prefix else item.rel_path
+    return posixpath.join(target.rstrip('/'), rel) if rel else target.rstrip('/')
+
+
+class WorkspaceRestore:
+
+    def __init__(self, host: str, token: str, max_workers: int = 8, logger=None):
+        if not host.startswith('http'):
+            host = 'https://' + host
+        self.host = host
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.max_workers = max_workers
+        self.logger = logger or logging.getLogger(__name__)
+
+    def mkdirs(self, path: str):
+        url = f"{self.host}/api/2.0/workspace/mkdirs"
+        resilient_request('POST', url, headers=self.headers, data=json.dumps({"path": path})).raise_for_status()
+
+    def import_object(self, item: RestoreItem, path: str, overwrite: bool):
+        """
+        :raise FileExistsError: the object exists and overwrite is False
+        """
+        fields = {"path": path, "overwrite": "true" if overwrite else "false"}
+        if item.language:
+            fields.update(format="SOURCE", language=item.language)
+        else:
+            fields.update(format="AUTO")
+        url = f"{self.host}/api/2.0/workspace/import"
+        with item.open() as f:
+            body = MultipartBody(fields, "content", posixpath.basename(path), f)
+            headers = dict(self.headers, **{"Content-Type": body.content_type})
+            response = resilient_request('POST', url, idempotent=overwrite, headers=headers, data=body)
+        if response.status_code in (400, 409) and 'ALREADY_EXISTS' in response.text:
+            raise FileExistsError(path)
+        response.raise_for_status()
+
+    def run(self, items: list[RestoreItem], targets: list[str], prefix: str = '',
+            policy: str = 'skip') -> list[RestoreResult]:
+        """
+        Import every item under every target folder.
+        :param prefix: the part of the items' path that is replaced by the target
+        :return: one RestoreResult per imported object
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {POLICIES}")
+        jobs = [(item, target_path(item, t, prefix)) for t in targets for item in items]
+
+        # only the deepest folders: mkdirs creates the parents
+        folders = {posixpath.dirname(p) for _, p in jobs}
+        ancestors = {f.rsplit('/', n)[0] for f in folders for n in range(1, f.count('/'))}
+        leaves = sorted(folders - ancestors)
+        results = []
+        failed_folders = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for folder, future in [(f, executor.submit(self.mkdirs, f)) for f in leaves]:
+                try:
+                    future.result()
+                except requests.RequestException as ex:
+                    failed_folders.add(folder)
+                    self.logger.error(f"mkdirs {folder} failed: {ex}")
+
+            def restore_one(job) -> RestoreResult:
+                item, path = job
+                if posixpath.dirname(path) in failed_folders:
+                    return RestoreResult(path, 'failed', 'could not create the parent folder')
+                try:
+                    self.import_object(item, path, overwrite=policy == 'overwrite')
+                    return RestoreResult(path, 'imported')
+                except FileExistsError:
+                    if policy == 'skip':
+                        return RestoreResult(path, 'skipped', 'exists')
+                    return RestoreResult(path, 'failed', 'exists')
+                except (requests.RequestException, OSError, CorruptBlobError) as ex:
+                    return RestoreResult(path, 'failed', str(ex))
+
+            for r in executor.map(restore_one, jobs):
+                results.append(r)
+                log = self.logger.error if r.status == 'failed' else self.logger.info
+                log(f"{r.status:8} {r.path} {r.error}")
+        return results
+
+
+def format_results(results: list[RestoreResult]) -> str:
+    counts = {}
+    for r in results:
+        counts[r.status] = counts.get(r.status, 0) + 1
+    lines = [f"{r.status:8} {r.path}  {r.error}" for r in results if r.status == 'failed']
+    lines.append(", ".join(f"{k}={v}" for k, v in sorted(counts.items())) or "nothing to restore")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import dotenv
+    dotenv.load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="Restore or seed workspace folders from a backup")
+    parser.add_argument("source", help="backup folder, or backup store (with --snapshot)")
+    parser.add_argument("--snapshot", help="the snapshot to restore from a backup store")
+    parser.add_argument("--prefix", default='', help="restore only this part of the backup, e.g. cnoam@technion.ac.il/starter")
+    parser.add_argument("--target", action="append", required=True, help="workspace folder to import into (can be repeated)")
+    parser.add_argument("--policy", choices=POLICIES, default='skip', help="what to do with objects that exist")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.snapshot:
+        items = items_from_snapshot(BackupStore(args.source), args.snapshot, args.prefix)
+    else:
+        items = items_from_directory(args.source, args.prefix)
+    restore = WorkspaceRestore(os.environ["DATABRICKS_HOST"], os.environ["DATABRICKS_TOKEN"], max_workers=args.workers)
+    results = restore.run(items, args.target, args.prefix, args.policy)
+    print(format_results(results))
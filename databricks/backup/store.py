@@ -0,0 +1,342 @@
+"""
+Content-addressed, compressed store for workspace backups.
+
+Layout of the repository folder:
+    packs/pack-NNNNNN.pack   compressed blobs, appended one after the other
+    index.json               sha256 -> [pack, offset, compressed length, size, codec]
+    snapshots/<id>.json      one small manifest per backup run: path -> sha256, size, modified_at
+
+A blob is stored once, no matter how many snapshots (or students) have the same content.
+Listing and diffing snapshots read only the manifests.
+Compression is zstd when the 'zstandard' package is installed, zlib otherwise. Each blob
+records its codec, so a repository can mix both.
+Contents can be written and read as streams of chunks (put_stream, read_to), so the size of
+a file does not matter for the memory use.
+
+    python -m databricks.backup.store REPO snapshots
+    python -m databricks.backup.store REPO ls SNAPSHOT [--prefix /Users/a@x.com]
+    python -m databricks.backup.store REPO diff SNAPSHOT_A SNAPSHOT_B
+    python -m databricks.backup.store REPO restore SNAPSHOT TARGET_DIR [--prefix ...]
+    python -m databricks.backup.store REPO forget SNAPSHOT
+    python -m databricks.backup.store REPO gc
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import io
+import os
+import tempfile
+import threading
+import zlib
+from dataclasses import dataclass
+
+try:
+    import zstandard
+except ModuleNotFoundError:
+    zstandard = None
+
+PACK_SIZE = 64 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+
+class CorruptBlobError(Exception):
+    """The content read from a pack does not match its hash"""
+
+
+def compress(data: bytes) -> tuple[bytes, str]:
+    """:return: (compressed data, codec name)"""
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(data), 'zstd'
+    return zlib.compress(data, 9), 'zlib'
+
+
+def compressor():
+    """:return: (streaming compressor with compress(chunk) and flush(), codec name)"""
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compressobj(), 'zstd'
+    return zlib.compressobj(9), 'zlib'
+
+
+def decompressor(codec: str):
+    """:return: streaming decompressor with decompress(chunk)"""
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("this blob is zstd compressed: pip install zstandard")
+        return zstandard.ZstdDecompressor().decompressobj()
+    if codec == 'zlib':
+        return zlib.decompressobj()
+    raise ValueError(f"unknown codec {codec}")
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    return decompressor(codec).decompress(data)
+
+
+def _read_range(f, offset: int, length: int):
+    """yield the bytes [offset, offset+length) of an open file, in chunks"""
+    f.seek(offset)
+    while length > 0:
+        chunk = f.read(min(CHUNK_SIZE, length))
+        if not chunk:
+            raise CorruptBlobError(f"{f.name} is truncated")
+        length -= len(chunk)
+        yield chunk
+
+
+@dataclass
+class BlobLocation:
+    pack: str
+    offset: int
+    length: int     # compressed
+    size: int       # original
+    codec: str
+
+
+class BackupStore:
+
+    def __init__(self, root: str, pack_size: int = PACK_SIZE):
+        self.root = root
+        self.pack_size = pack_size
+        self.packs_dir = os.path.join(root, 'packs')
+        self.snapshots_dir = os.path.join(root, 'snapshots')
+        os.makedirs(self.packs_dir, exist_ok=True)
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        self.index_file = os.path.join(root, 'index.json')
+        self.index = {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file) as f:
+                self.index = {sha: BlobLocation(*loc) for sha, loc in json.load(f).items()}
+        self._lock = threading.Lock()
+        self._pack = None       # name of the pack being appended to
+
+    # --- blobs
+
+    def has(self, sha256: str) -> bool:
+        with self._lock:
+            return sha256 in self.index
+
+    def put(self, data: bytes) -> str:
+        """Store the content (if new). :return: its sha256"""
+        sha256 = hashlib.sha256(data).hexdigest()
+        if self.has(sha256):
+            return sha256
+        compressed, codec = compress(data)
+        with self._lock:
+            if sha256 not in self.index:
+                self.index[sha256] = self._append([compressed], len(data), codec)
+        return sha256
+
+    def put_stream(self, chunks, check=None) -> tuple[str, int]:
+        """
+        Store content given as an iterable of byte chunks, with bounded memory:
+        the chunks are compressed to a temporary file, which is appended to a pack if the content is new.
+        :param check: check(size) called before the content is stored. Raise to reject it
+        :return: (sha256, size)
+        """
+        digest, size = hashlib.sha256(), 0
+        comp, codec = compressor()
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(comp.compress(chunk))
+                f.write(comp.flush())
+            sha256 = digest.hexdigest()
+            if check:
+                check(size)
+            with self._lock:
+                if sha256 not in self.index:
+                    with open(tmp, 'rb') as f:
+                        self.index[sha256] = self._append(_read_range(f, 0, os.path.getsize(tmp)), size, codec)
+        finally:
+            os.remove(tmp)
+        return sha256, size
+
+    def _append(self, chunks, size: int, codec: str) -> BlobLocation:
+        """append the compressed chunks to the current pack. Call with the lock held"""
+        path = os.path.join(self.packs_dir, self._pack) if self._pack else None
+        if path is None or os.path.getsize(path) >= self.pack_size:
+            self._pack = self._new_pack_name()
+            path = os.path.join(self.packs_dir, self._pack)
+        length = 0
+        with open(path, 'ab') as f:
+            offset = f.tell()
+            for chunk in chunks:
+                f.write(chunk)
+                length += len(chunk)
+        return BlobLocation(self._pack, offset, length, size, codec)
+
+    def _new_pack_name(self) -> str:
+        existing = [int(p[5:11]) for p in os.listdir(self.packs_dir) if p.startswith('pack-') and p.endswith('.pack')]
+        return f"pack-{max(existing, default=0) + 1:06}.pack"
+
+    def get(self, sha256: str) -> bytes:
+        out = io.BytesIO()
+        self.read_to(sha256, out)
+        return out.getvalue()
+
+    def read_to(self, sha256: str, out) -> int:
+        """
+        Decompress the content into the open binary file 'out', chunk by chunk, and verify its hash.
+        :return: the size
+        """
+        with self._lock:
+            loc = self.index[sha256]
+        digest, size = hashlib.sha256(), 0
+        decomp = decompressor(loc.codec)
+        with open(os.path.join(self.packs_dir, loc.pack), 'rb') as f:
+            for chunk in _read_range(f, loc.offset, loc.length):
+                data = decomp.decompress(chunk)
+                digest.update(data)
+                size += len(data)
+                out.write(data)
+        if digest.hexdigest() != sha256 or size != loc.size:
+            raise CorruptBlobError(f"blob {sha256} in {loc.pack} is corrupt")
+        return size
+
+    def flush(self):
+        """Save the index. Blobs written after the last flush are lost in a crash (gc reclaims their space)"""
+        with self._lock:
+            data = {sha: [loc.pack, loc.offset, loc.length, loc.size, loc.codec] for sha, loc in self.index.items()}
+            self._pack = None   # never append to a pack that a crashed run may have left half written
+        tmp = self.index_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, self.index_file)
+
+    # --- snapshots
+
+    def create_snapshot(self, entries: list[dict], root: str = '/', snapshot_id: str | None = None) -> str:
+        """
+        :param entries: [{'path':, 'sha256':, 'size':, 'modified_at':, ...}]. All the blobs must be in the store.
+        :return: the snapshot id, e.g. '20250107-231500'
+        """
+        missing = [e['path'] for e in entries if not self.has(e['sha256'])]
+        if missing:
+            raise KeyError(f"{len(missing)} objects are not in the store, e.g. {missing[0]}")
+        self.flush()
+        if snapshot_id is None:
+            base = snapshot_id = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+            n = 1
+            while os.path.exists(os.path.join(self.snapshots_dir, snapshot_id + '.json')):
+                n += 1
+                snapshot_id = f"{base}.{n}"
+        doc = {'id': snapshot_id, 'created': datetime.datetime.now().isoformat(timespec='seconds'), 'root': root,
+               'objects': sorted(entries, key=lambda e: e['path'])}
+        tmp = os.path.join(self.snapshots_dir, snapshot_id + '.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(doc, f, indent=1)
+        os.replace(tmp, os.path.join(self.snapshots_dir, snapshot_id + '.json'))
+        return snapshot_id
+
+    def snapshots(self) -> list[str]:
+        return sorted(f[:-5] for f in os.listdir(self.snapshots_dir) if f.endswith('.json'))
+
+    def load_snapshot(self, snapshot_id: str) -> dict:
+        with open(os.path.join(self.snapshots_dir, snapshot_id + '.json')) as f:
+            return json.load(f)
+
+    def list_snapshot(self, snapshot_id: str, prefix: str = '') -> list[dict]:
+        return [e for e in self.load_snapshot(snapshot_id)['objects'] if e['path'].startswith(prefix)]
+
+    def diff(self, old_id: str, new_id: str) -> dict:
+        """:return: {'added': [paths], 'removed': [paths], 'modified': [paths]}"""
+        old = {e['path']: e['sha256'] for e in self.load_snapshot(old_id)['objects']}
+        new = {e['path']: e['sha256'] for e in self.load_snapshot(new_id)['objects']}
+        return {'added': sorted(new.keys() - old.keys()),
+                'removed': sorted(old.keys() - new.keys()),
+                'modified': sorted(p for p in old.keys() & new.keys() if old[p] != new[p])}
+
+    def restore(self, snapshot_id: str, target_dir: str, prefix: str = '') -> int:
+        """Write the snapshot files under target_dir (at their local_path, or their workspace path). :return: number of files"""
+        n = 0
+        for e in self.list_snapshot(snapshot_id, prefix):
+            rel = e.get('local_path') or e['path'].lstrip('/')
+            target = os.path.join(target_dir, rel)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                self.read_to(e['sha256'], f)
+            n += 1
+        return n
+
+    def forget(self, snapshot_id: str):
+        """Delete a snapshot manifest. Run gc() to reclaim the space of blobs no other snapshot uses"""
+        os.remove(os.path.join(self.snapshots_dir, snapshot_id + '.json'))
+
+    def gc(self) -> dict:
+        """
+        Drop the blobs that no snapshot refers to, and rewrite the packs that contain them.
+        :return: {'blobs_removed':, 'packs_rewritten':, 'bytes_freed':}
+        """
+        referenced = set()
+        for sid in self.snapshots():
+            referenced.update(e['sha256'] for e in self.load_snapshot(sid)['objects'])
+
+        self.flush()
+        with self._lock:
+            garbage = [sha for sha in self.index if sha not in referenced]
+            packs_in_use = {loc.pack for sha, loc in self.index.items() if sha in referenced}
+            dirty = {self.index[sha].pack for sha in garbage}
+        before = sum(os.path.getsize(os.path.join(self.packs_dir, p)) for p in os.listdir(self.packs_dir))
+
+        # copy the live blobs of dirty packs to new packs
+        for pack in sorted(dirty & packs_in_use):
+            with open(os.path.join(self.packs_dir, pack), 'rb') as f:
+                for sha, loc in sorted(((s, l) for s, l in self.index.items() if l.pack == pack and s in referenced),
+                                       key=lambda x: x[1].offset):
+                    with self._lock:
+                        self.index[sha] = self._append(_read_range(f, loc.offset, loc.length), loc.size, loc.codec)
+        with self._lock:
+            for sha in garbage:
+                del self.index[sha]
+            live_packs = {loc.pack for loc in self.index.values()}
+        self.flush()
+        # packs with no live blob: the rewritten ones, and leftovers of crashed runs
+        for pack in os.listdir(self.packs_dir):
+            if pack not in live_packs:
+                os.remove(os.path.join(self.packs_dir, pack))
+        after = sum(os.path.getsize(os.path.join(self.packs_dir, p)) for p in os.listdir(self.packs_dir))
+        return {'blobs_removed': len(garbage), 'packs_rewritten': len(dirty & packs_in_use), 'bytes_freed': before - after}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Browse and maintain a backup repository")
+    parser.add_argument("repo", help="the repository folder")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("snapshots", help="list the snapshots")
+    p = sub.add_parser("ls", help="list the objects of a snapshot")
+    p.add_argument("snapshot")
+    p.add_argument("--prefix", default='')
+    p = sub.add_parser("diff", help="what changed between two snapshots")
+    p.add_argument("old")
+    p.add_argument("new")
+    p = sub.add_parser("restore", help="write the files of a snapshot to a folder")
+    p.add_argument("snapshot")
+    p.add_argument("target")
+    p.add_argument("--prefix", default='')
+    p = sub.add_parser("forget", help="delete a snapshot (run gc afterwards)")
+    p.add_argument("snapshot")
+    sub.add_parser("gc", help="remove the content no snapshot uses")
+    args = parser.parse_args()
+
+    store = BackupStore(args.repo)
+    if args.command == "snapshots":
+        for sid in store.snapshots():
+            objects = store.load_snapshot(sid)['objects']
+            print(f"{sid}  {len(objects):6} objects  {sum(e['size'] for e in objects):12} bytes")
+    elif args.command == "ls":
+        for e in store.list_snapshot(args.snapshot, args.prefix):
+            print(f"{e['size']:10}  {e['sha256'][:12]}  {e['path']}")
+    elif args.command == "diff":
+        for kind, paths in store.diff(args.old, args.new).items():
+            for path in paths:
+                print(f"{kind:9} {path}")
+    elif args.command == "restore":
+        print(f"restored {store.restore(args.snapshot, args.target, args.prefix)} files to {args.target}")
+    elif args.command == "forget":
+        store.forget(args.snapshot)
+    elif args.command == "gc":
+        print(store.gc())
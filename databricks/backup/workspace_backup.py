@@ -0,0 +1,328 @@
+"""
+Incremental, parallel backup of the workspace notebooks and files.
+
+    backup = WorkspaceBackup(host, token, "./databricks_94290_backup_2024w")
+    summary = backup.run("/Users")
+
+* the directories are listed concurrently (one workspace/list call per directory, many in flight)
+* the objects are exported with a bounded worker pool, streamed to disk (no size limit, bounded memory)
+* a manifest (manifest.json in the backup dir) keeps path, object_id, modified_at, sha256 and size
+  of each exported object. Objects whose object_id and modified_at did not change since the last
+  run are not exported again.
+* a journal (journal.jsonl, see journal.py) records the progress, so run(resume=True) continues an
+  interrupted run: the directories listed are not listed again, and only what failed or was not done is exported.
+  The run ends with a consistency check of the manifest against the backup copies.
+* with a BackupStore, the contents go to the deduplicated store (and the manifest lives in its folder),
+  and each run ends with a snapshot of the tree. See store.py
+"""
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass, field, asdict
+
+import requests
+
+from ..resilience import resilient_request
+from .journal import BackupJournal
+from .store import BackupStore, CHUNK_SIZE
+
+MANIFEST_NAME = "manifest.json"
+EXPORTED_TYPES = ('NOTEBOOK', 'FILE')
+NOTEBOOK_EXTENSIONS = {'PYTHON': '.py', 'SCALA': '.scala', 'SQL': '.sql', 'R': '.r'}
+
+
+@dataclass
+class ManifestEntry:
+    path: str
+    object_id: int | None
+    modified_at: int | None    # milliseconds since epoch, as reported by the workspace
+    sha256: str
+    size: int
+    local_path: str            # relative to the backup dir
+
+
+@dataclass
+class BackupSummary:
+    listed_dirs: int = 0
+    objects: int = 0
+    exported: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+    failed: list = field(default_factory=list)   # [(path, error)]
+    snapshot: str | None = None                   # when backing up to a BackupStore
+    resumed: bool = False
+    inconsistent: list = field(default_factory=list)  # manifest paths without a valid backup copy
+
+
+class Manifest:
+    """The index of the last backup: workspace path -> ManifestEntry"""
+
+    def __init__(self, backup_dir: str):
+        self.filename = os.path.join(backup_dir, MANIFEST_NAME)
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.filename):
+            with open(self.filename) as f:
+                self.entries = {e['path']: ManifestEntry(**e) for e in json.load(f)['objects']}
+
+    def get(self, path: str) -> ManifestEntry | None:
+        with self._lock:
+            return self.entries.get(path)
+
+    def put(self, entry: ManifestEntry):
+        with self._lock:
+            self.entries[entry.path] = entry
+
+    def remove(self, path: str):
+        with self._lock:
+            self.entries.pop(path, None)
+
+    def save(self):
+        with self._lock:
+            data = {'objects': [asdict(e) for e in sorted(self.entries.values(), key=lambda e: e.path)]}
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp, self.filename)
+
+
+def file_sha256(filename: str) -> str:
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_unchanged(obj: dict, entry: ManifestEntry | None) -> bool:
+    """An object is unchanged if it has the same object_id and modification time as in the manifest"""
+    return (entry is not None and obj.get('modified_at') is not None
+            and entry.object_id == obj.get('object_id') and entry.modified_at == obj.get('modified_at'))
+
+
+class WorkspaceBackup:
+
+    def __init__(self, host: str, token: str, backup_dir: str, max_workers: int = 8, logger=None,
+                 store: BackupStore | None = None):
+        """
+        :param backup_dir: the folder of the backup copies and the manifest. Ignored if 'store' is given
+        :param store: write the contents to this store instead of a folder tree
+        """
+        if not host.startswith('http'):
+            host = 'https://' + host
+        self.host = host
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.store = store
+        self.backup_dir = store.root if store else backup_dir
+        self.max_workers = max_workers
+        self.logger = logger or logging.getLogger(__name__)
+        self.manifest = Manifest(self.backup_dir)
+
+    def list_directory(self, path: str) -> list[dict]:
+        """:return: the objects (files and directories) in the workspace directory"""
+        url = f"{self.host}/api/2.0/workspace/list"
+        response = resilient_request('GET', url, headers=self.headers, params={"path": path})
+        response.raise_for_status()
+        return response.json().get("objects", [])
+
+    def list_tree(self, root: str, summary: BackupSummary | None = None, known: dict | None = None,
+                  journal: BackupJournal | None = None) -> list[dict]:
+        """
+        List the tree under root, many directories concurrently.
+        :param known: directory -> objects, listings from an interrupted run. These are not listed again
+        :param journal: record each listing here
+        :return: the notebooks and files in the tree
+        """
+        summary = summary or BackupSummary()
+        known = known or {}
+        objects = []
+
+        def list_directory(path):
+            if path in known:
+                return known[path]
+            listing = self.list_directory(path)
+            if journal:
+                journal.listed(path, listing)
+            return listing
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {executor.submit(list_directory, root): root}
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    pending.pop(future)
+                    summary.listed_dirs += 1
+                    for obj in future.result():   # a failed listing fails the backup: we must not report deletions
+                        if obj['object_type'] == 'DIRECTORY':
+                            pending[executor.submit(list_directory, obj['path'])] = obj['path']
+                        elif obj['object_type'] in EXPORTED_TYPES:
+                            objects.append(obj)
+        self.logger.debug(f"listed {summary.listed_dirs} directories under {root}: {len(objects)} objects")
+        return objects
+
+    def local_path(self, obj: dict, root: str) -> str:
+        """:return: the path of the backup copy, relative to the backup dir"""
+        rel = os.path.relpath(obj['path'], root)
+        if obj['object_type'] == 'NOTEBOOK':
+            rel += NOTEBOOK_EXTENSIONS.get(obj.get('language'), '.py')
+        return rel
+
+    def export(self, obj: dict, local_path: str) -> tuple[str, int]:
+        """
+        Export one object in SOURCE format to local_path (relative to the backup dir), or to the store.
+        The content is downloaded directly (not as base64 in a json doc) and written chunk by chunk,
+        so any size is fine. The size is checked (see _size_check) before the copy is kept.
+        :return: (sha256, size) of the exported content
+        """
+        url = f"{self.host}/api/2.0/workspace/export"
+        params = {"path": obj['path'], "format": "SOURCE", "direct_download": "true"}
+        with resilient_request('GET', url, headers=self.headers, params=params, stream=True) as response:
+            response.raise_for_status()
+            check = self._size_check(obj, response)
+            chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+            if self.store:
+                return self.store.put_stream(chunks, check=check)
+            return self._write_file(chunks, local_path, check)
+
+    @staticmethod
+    def _size_check(obj: dict, response):
+        """
+        :return: check(size) that raises ValueError if the download is incomplete.
+        The size is checked against Content-Length, else against the listed size. iter_content() decodes gzip,
+        so with a Content-Encoding the Content-Length is compared with the bytes read on the wire.
+        """
+        length = response.headers.get('Content-Length')
+        encoded = response.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+
+        def check(size: int):
+            if length is None:
+                received, expected = size, obj.get('size')
+            else:
+                received, expected = (response.raw.tell() if encoded else size), int(length)
+            if expected is not None and received != expected:
+                raise ValueError(f"{obj['path']}: got {received} bytes, expected {expected}")
+        return check
+
+    def _write_file(self, chunks, local_path: str, check) -> tuple[str, int]:
+        """Write to a temporary file, check it, then move it in place of the previous copy"""
+        target = os.path.join(self.backup_dir, local_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = target + '.part'
+        digest, size = hashlib.sha256(), 0
+        try:
+            with open(tmp, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            check(size)
+            if file_sha256(tmp) != digest.hexdigest():
+                raise OSError(f"{local_path}: the file on disk differs from the downloaded content")
+            os.replace(tmp, target)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return digest.hexdigest(), size
+
+    def _backup_one(self, obj: dict, root: str) -> ManifestEntry | None:
+        """:return: the new manifest entry if exported, None if unchanged"""
+        local_path = self.local_path(obj, root)
+        entry = self.manifest.get(obj['path'])
+        if is_unchanged(obj, entry) and self._has_copy(entry):
+            return None
+        sha256, size = self.export(obj, local_path)
+        entry = ManifestEntry(path=obj['path'], object_id=obj.get('object_id'),
+                              modified_at=obj.get('modified_at'), sha256=sha256, size=size,
+                              local_path=local_path)
+        self.manifest.put(entry)
+        return entry
+
+    def _has_copy(self, entry: ManifestEntry) -> bool:
+        if self.store:
+            return self.store.has(entry.sha256)
+        return os.path.exists(os.path.join(self.backup_dir, entry.local_path))
+
+    def verify(self, root: str) -> list[str]:
+        """
+        Consistency check: every manifest entry under root has its backup copy, of the right size.
+        :return: the paths that do not
+        """
+        prefix = root.rstrip('/') + '/'
+        bad = []
+        for path, entry in list(self.manifest.entries.items()):
+            if not path.startswith(prefix):
+                continue
+            if self.store:
+                ok = self.store.has(entry.sha256)
+            else:
+                local = os.path.join(self.backup_dir, entry.local_path)
+                ok = os.path.exists(local) and os.path.getsize(local) == entry.size
+            if not ok:
+                bad.append(path)
+        return sorted(bad)
+
+    def run(self, root: str = "/Users", resume: bool = False) -> BackupSummary:
+        """
+        Back up everything under root. Only new and modified objects are exported.
+        :param resume: continue the last run if it did not finish (and it backed up the same root)
+        """
+        os.makedirs(self.backup_dir, exist_ok=True)
+        summary = BackupSummary()
+        journal = BackupJournal(self.backup_dir)
+        state = journal.unfinished() if resume else None
+        if state is not None and state.root != root:
+            self.logger.warning(f"the interrupted run backed up {state.root}, not {root}. Starting over")
+            state = None
+        if state is not None:
+            summary.resumed = True
+            for entry in state.exported.values():
+                self.manifest.put(ManifestEntry(**entry))
+            self.logger.info(f"resuming: {len(state.listed)} directories listed, {len(state.exported)} objects "
+                             f"exported, {len(state.failed)} failed")
+        journal.start(root, resume=state is not None)
+        try:
+            self._run(root, summary, journal, state.listed if state else None)
+        finally:
+            journal.close()
+        return summary
+
+    def _run(self, root: str, summary: BackupSummary, journal: BackupJournal, known: dict | None):
+        objects = self.list_tree(root, summary, known=known, journal=journal)
+        summary.objects = len(objects)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._backup_one, obj, root): obj for obj in objects}
+            for future in concurrent.futures.as_completed(futures):
+                path = futures[future]['path']
+                try:
+                    entry = future.result()
+                    if entry:
+                        summary.exported += 1
+                        journal.exported(asdict(entry))
+                        self.logger.info(f"Exported: {path}")
+                    else:
+                        summary.unchanged += 1
+                except (requests.RequestException, KeyError, ValueError, OSError) as ex:
+                    summary.failed.append((path, str(ex)))
+                    journal.failed(path, str(ex))
+                    self.logger.error(f"Error exporting {path}: {ex}")
+
+        # objects deleted from the workspace. Their last backup copy is kept on disk.
+        listed = {obj['path'] for obj in objects}
+        prefix = root.rstrip('/') + '/'
+        for path in [p for p in self.manifest.entries if p.startswith(prefix) and p not in listed]:
+            self.manifest.remove(path)
+            summary.deleted += 1
+        summary.inconsistent = self.verify(root)
+        for path in summary.inconsistent:
+            self.logger.error(f"consistency check: no valid backup copy of {path}")
+            self.manifest.remove(path)   # the next run exports it again
+        self.manifest.save()
+        if self.store:
+            in_tree = [asdict(e) for p, e in self.manifest.entries.items() if p.startswith(prefix)]
+            summary.snapshot = self.store.create_snapshot(in_tree, root)
+        if not summary.failed and not summary.inconsistent:
+            journal.finish()
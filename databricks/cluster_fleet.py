@@ -0,0 +1,135 @@
+"""
+Create a fleet of student clusters concurrently.
+
+    results = create_cluster_fleet(cluster_api, [f"cluster_{i:02}" for i in range(1, 41)],
+                                   policy_id=policy_id, groups=True, logger=logger)
+    print(format_fleet_report(results))
+
+Pipeline for every cluster (the clusters run through it in parallel):
+  1. create from cluster_spec(), with the auto-termination already in the spec (no edit later)
+  2. terminate right away. The clusters API has no "create without starting", so the cluster
+     is stopped while it is still PENDING, before the VMs are paid for.
+  3. pin, and give CAN_RESTART to its group (cluster_NN -> group_NN)
+Then the cluster states are tracked with one clusters/list call per polling round
+(not one clusters/get per cluster) until all of them are TERMINATED, or the timeout passes.
+"""
+import concurrent.futures
+import time
+from dataclasses import dataclass, field
+
+import requests
+
+from .DataBricksClusterOps import DataBricksClusterOps
+
+
+@dataclass
+class FleetResult:
+    name: str
+    cluster_id: str | None = None
+    state: str = ''                     # last state seen
+    transitions: list = field(default_factory=list)  # [(seconds since start, state)]
+    error: str | None = None
+    skipped: bool = False               # the cluster already existed
+
+
+def group_for_cluster(cluster_name: str) -> str:
+    return "group_" + cluster_name[len("cluster_"):]
+
+
+def _provision(client: DataBricksClusterOps, result: FleetResult, spec: dict, group: str | None, pin: bool):
+    created = client.create_cluster_from_spec(spec)
+    if not created:
+        raise RuntimeError("create returned no cluster_id")
+    result.cluster_id = created['cluster_id']
+    client.terminate_cluster(result.cluster_id)
+    if pin:
+        client.pin_cluster({'cluster_id': result.cluster_id})
+    if group:
+        client.set_cluster_permission(result.cluster_id, group_name=group,
+                                      permission=client.ClusterPermission.RESTART)
+
+
+def wait_for_states(client: DataBricksClusterOps, results: list[FleetResult], target_states: set,
+                    timeout: float = 1200, poll_interval: float = 10, logger=None) -> bool:
+    """
+    Track the state of the clusters with one list call per round.
+    :return: True if all the clusters reached one of the target states before the timeout
+    """
+    pending = {r.cluster_id: r for r in results if r.cluster_id and r.error is None}
+    start = time.monotonic()
+    while True:
+        states = {c['cluster_id']: c.get('state') for c in client.get_clusters(max_age=0)}
+        for cluster_id, r in list(pending.items()):
+            state = states.get(cluster_id, 'MISSING')
+            if state != r.state:
+                r.state = state
+                r.transitions.append((round(time.monotonic() - start, 1), state))
+                if logger:
+                    logger.info(f"{r.name}: {state}")
+            if state in target_states:
+                del pending[cluster_id]
+            elif state in ('ERROR', 'MISSING'):
+                r.error = f"cluster is {state}"
+                del pending[cluster_id]
+        if not pending:
+            return all(r.error is None for r in results)
+        if time.monotonic() - start >= timeout:
+            for r in pending.values():
+                r.error = f"timeout: still {r.state}"
+            return False
+        time.sleep(poll_interval)
+
+
+def create_cluster_fleet(client: DataBricksClusterOps, names: list[str], policy_id: str = '',
+                         autotermination_minutes: int = 22, groups: bool = True, pin: bool = True,
+                         max_workers: int = 8, timeout: float = 1200, poll_interval: float = 10,
+                         logger=None) -> list[FleetResult]:
+    """
+    Create the clusters that do not exist yet, and bring all of them to TERMINATED, pinned,
+    with CAN_RESTART for their group.
+    :param names: cluster names, e.g. cluster_01 .. cluster_40
+    :param groups: give each cluster_NN permission for group_NN
+    :return: one FleetResult per name
+    """
+    existing = {c['cluster_name'] for c in client.get_clusters(max_age=0)}
+    results = [FleetResult(name=n, skipped=n in existing) for n in names]
+    todo = [r for r in results if not r.skipped]
+    for r in results:
+        if r.skipped and logger:
+            logger.warning(f"cluster {r.name} already exists ==> skipped")
+    if not todo:
+        return results
+
+    def provision(r: FleetResult):
+        spec = client.cluster_spec(r.name, policy_id, autotermination_minutes=autotermination_minutes)
+        _provision(client, r, spec, group_for_cluster(r.name) if groups else None, pin)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(todo))) as executor:
+        futures = {executor.submit(provision, r): r for r in todo}
+        for future in concurrent.futures.as_completed(futures):
+            r = futures[future]
+            try:
+                future.result()
+                if logger:
+                    logger.info(f"created {r.name} ({r.cluster_id})")
+            except (requests.RequestException, RuntimeError) as ex:
+                r.error = str(ex)
+                if logger:
+                    logger.error(f"failed {r.name}: {ex}")
+
+    wait_for_states(client, todo, {'TERMINATED'}, timeout=timeout, poll_interval=poll_interval, logger=logger)
+    return results
+
+
+def format_fleet_report(results: list[FleetResult]) -> str:
+    from tabulate import tabulate
+
+    rows = []
+    for r in results:
+        status = 'skipped' if r.skipped else ('FAILED' if r.error else 'ok')
+        seconds = r.transitions[-1][0] if r.transitions else ''
+        rows.append([r.name, r.cluster_id or '', status, r.state, seconds, r.error or ''])
+    ok = sum(1 for r in results if not r.skipped and not r.error)
+    failed = sum(1 for r in results if r.error)
+    table = tabulate(rows, headers=['cluster', 'id', 'status', 'state', 'seconds', 'error'])
+    return f"{table}\ncreated {ok}, failed {failed}, skipped {sum(r.skipped for r in results)}"
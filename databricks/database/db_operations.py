@@ -87,6 +87,91 @@ class ClusterInfo(BaseModel):
     cluster_name = CharField(unique=True)
 
 
+# --- Roster index ---
+# Who owns which cluster, which schema and service principal belong to a group.
+# Populated from the Moodle roster and from the workspace (see roster_index.py), so the
+# scripts look it up locally instead of deriving it from the names and calling the API.
+
+class StudentGroup(BaseModel):
+    group_name = CharField(primary_key=True)        # group_NN, the workspace group
+    moodle_id = CharField(null=True, index=True)    # the Moodle 'Group ID'
+    ordinal = IntegerField(null=True)
+
+    class Meta:
+        table_name = 'roster_groups'
+
+
+class GroupMember(BaseModel):
+    group = ForeignKeyField(StudentGroup, backref='members', field='group_name', on_delete='CASCADE')
+    email = CharField(index=True)                   # lower case
+
+    class Meta:
+        table_name = 'roster_members'
+        indexes = (
+            (('group', 'email'), True),
+        )
+
+
+class ClusterBinding(BaseModel):
+    """The cluster of a group. cluster_id is NULL until the cluster is seen in the workspace."""
+    cluster_name = CharField(primary_key=True)
+    cluster_id = CharField(null=True, unique=True)
+    group = ForeignKeyField(StudentGroup, backref='clusters', field='group_name', on_delete='CASCADE')
+
+    class Meta:
+        table_name = 'roster_clusters'
+
+
+class GroupSchema(BaseModel):
+    group = ForeignKeyField(StudentGroup, backref='schemas', field='group_name', on_delete='CASCADE')
+    catalog = CharField(default='')
+    schema_name = CharField()
+
+    class Meta:
+        table_name = 'roster_schemas'
+        indexes = (
+            (('catalog', 'schema_name'), True),
+        )
+
+
+class GroupServicePrincipal(BaseModel):
+    group = ForeignKeyField(StudentGroup, backref='service_principals', field='group_name', on_delete='CASCADE')
+    display_name = CharField(unique=True)
+    application_id = CharField(null=True)
+
+    class Meta:
+        table_name = 'roster_service_principals'
+
+
+ROSTER_MODELS = [StudentGroup, GroupMember, ClusterBinding, GroupSchema, GroupServicePrincipal]
+
+
+class OutboxMessage(BaseModel):
+    """
+    An email waiting to be sent (see resource_manager/mail_outbox.py).
+    Addresses are stored as comma separated lists.
+    """
+    PENDING, SENT, FAILED = 'pending', 'sent', 'failed'
+
+    created = DateTimeField(default=datetime.datetime.now)
+    subject = CharField()
+    body_html = TextField()
+    recipients = TextField(default='')
+    cc = TextField(default='')
+    status = CharField(default=PENDING, index=True)
+    attempts = IntegerField(default=0)
+    next_attempt = DateTimeField(default=datetime.datetime.now)
+    last_error = TextField(null=True)
+    sent_time = DateTimeField(null=True)
+    digest = ForeignKeyField('self', null=True, backref='merged')   # the digest that carries the CC of this message
+
+    class Meta:
+        table_name = 'mail_outbox'
+
+
+MODELS = [ClusterUptime, ClusterCumulativeUptime, ClusterInfo] + ROSTER_MODELS + [OutboxMessage]
+
+
 # NEW: Function to handle production setup (called in poll_clusters.py)
 def initialize_production_db():
     db_instance = SqliteDatabase(DATABASE_FILE_NAME,
@@ -108,9 +193,8 @@ def initialize_production_db():
     db_instance.execute_sql('PRAGMA wal_checkpoint(FULL);')
 
     # Bind models to the production instance
-    ClusterUptime.bind(db_instance)
-    ClusterCumulativeUptime.bind(db_instance)
-    ClusterInfo.bind(db_instance)
+    for model in MODELS:
+        model.bind(db_instance)
     return db_instance
 
 
@@ -120,7 +204,7 @@ def create_tables(db_instance: SqliteDatabase):
     """Connects to the DB and creates the tables from the models."""
 
     # Only create tables if they do not already exist
-    db_instance.create_tables([ClusterUptime, ClusterCumulativeUptime, ClusterInfo])
+    db_instance.create_tables(MODELS)
 
 def to_datetime(s):
     if s is None:
@@ -1,49 +1,234 @@
 # 2026-01-01
-# Run this script ONCE in a Databricks workspace to create an isolated "database" for 
-# each student group.
+# Create an isolated "database" for each student group: a schema ('database' in DBR speak) in a single
+# catalog, whose name is the DBR workspace name, with the grants the group needs.
+# Same layout as terraform/dbr/modules/unified_catalog_setup: group_NN gets schema_NN, granted to each
+# student of the group and to the group service principal sp_NN.
 #
-# All "databases", 'schema' in DBR speak are in a single catalog, whose name is the DBR workspace name
+# The script is idempotent and diff-based: the existing schemas and grants are read in bulk from
+# information_schema, and only the missing CREATE SCHEMA / GRANT statements are executed (concurrently).
+# Adding one group mid-semester costs a few statements, instead of re-granting all the schemas.
+#
+# NOTE: Unity Catalog cannot see workspace level groups (like 'group_01'), and we cannot create account level
+# groups. So the privileges are granted to EACH STUDENT (email) individually, and to the SP (application id).
+#
+# To find the SQL warehouse id, select the SQL warehouse, choose "Connection Details" tab,
+# and there you will see both hostname and HTTP path (/sql/1.0/warehouses/<id>).
+#
+#   export DATABRICKS_HOST=adb-983293358114278.18.azuredatabricks.net DATABRICKS_SQL_ID=44e60e83178ee82c
+#   export DATABRICKS_TOKEN=dapi... DATABRICKS_CATALOG=lab94290w3
+#   python -m databricks.deploy_sql_schemas --csv groups.csv --dry-run
+#   python -m databricks.deploy_sql_schemas --csv groups.csv --groups group_26
+import argparse
+import concurrent.futures
+import os
+import threading
+from dataclasses import dataclass, field
+
+from .DataBricksGroups import DataBricksGroups
+from .MoodleFileParser import MoodleFileParser
+from .roster_index import STUDENT_GROUP_RE, open_index
+
+# the privileges of a student on the schema of the group: full CRUD within the schema ONLY
+SCHEMA_PRIVILEGES = ("USE SCHEMA", "CREATE TABLE", "SELECT", "MODIFY")
+# the privileges of the group service principal on the schema
+SP_SCHEMA_PRIVILEGES = ("USE SCHEMA", "CREATE TABLE", "SELECT")
+# minimal catalog visibility
+CATALOG_PRIVILEGES = ("USE CATALOG", "BROWSE")
+SP_CATALOG_PRIVILEGES = ("USE CATALOG",)
+
+
+@dataclass
+class SchemaState:
+    """The current schemas and grants of the catalog"""
+    schemas: set = field(default_factory=set)             # schema names (lower case)
+    schema_grants: dict = field(default_factory=dict)     # (schema, grantee) -> set of privileges
+    catalog_grants: dict = field(default_factory=dict)    # grantee -> set of privileges. grantees are lower case
+
+
+@dataclass(frozen=True)
+class GroupPrincipals:
+    """The Unity Catalog principals of one group: its students and its service principal"""
+    group: str                              # group_NN
+    members: tuple = ()                     # emails
+    sp_application_id: str | None = None
+
+    @property
+    def schema(self) -> str:
+        return schema_name(self.group)
+
+
+def schema_name(group: str) -> str:
+    """group_NN -> schema_NN"""
+    match = STUDENT_GROUP_RE.match(group)
+    if not match:
+        raise ValueError(f"'{group}' is not a student group name (group_NN)")
+    return f"schema_{int(match.group(1)):02}"
+
+
+@dataclass(frozen=True)
+class Statement:
+    phase: int          # 0: create the schema, 1: grants (the schema must exist)
+    group: str
+    sql: str
+
+    def __str__(self):
+        return self.sql
+
+
+def fetch_state(cursor, catalog: str) -> SchemaState:
+    """Read all the schemas and grants of the catalog with three queries"""
+    state = SchemaState()
+    cursor.execute(f"SELECT schema_name FROM `{catalog}`.information_schema.schemata")
+    state.schemas = {row[0].lower() for row in cursor.fetchall()}
+
+    cursor.execute(f"SELECT schema_name, grantee, privilege_type FROM `{catalog}`.information_schema.schema_privileges")
+    for schema, grantee, privilege in cursor.fetchall():
+        state.schema_grants.setdefault((schema.lower(), grantee.lower()), set()).add(privilege)
+
+    cursor.execute(f"SELECT grantee, privilege_type FROM `{catalog}`.information_schema.catalog_privileges "
+                   f"WHERE catalog_name = '{catalog}'")
+    for grantee, privilege in cursor.fetchall():
+        state.catalog_grants.setdefault(grantee.lower(), set()).add(privilege)
+    return state
+
+
+def _missing(granted: set, wanted: tuple) -> list:
+    if "ALL PRIVILEGES" in granted:
+        return []
+    return [p for p in wanted if p not in granted]
+
+
+def plan_provisioning(catalog: str, groups: list[GroupPrincipals], state: SchemaState) -> list[Statement]:
+    """
+    The privileges are compared per principal: a student added to a group gets only their own grants.
+    :param groups: each group gets the schema schema_NN, granted to its members and its service principal
+    :return: the statements that are missing, in execution order
+    """
+    plan = []
+    catalog_granted = set()     # a principal gets its catalog grant once, even if it is in several groups
+    for g in sorted(groups, key=lambda g: g.schema):
+        schema = g.schema
+        if schema not in state.schemas:
+            plan.append(Statement(0, g.group, f"CREATE SCHEMA IF NOT EXISTS `{catalog}`.`{schema}`"))
+        principals = [(m.strip(), CATALOG_PRIVILEGES, SCHEMA_PRIVILEGES) for m in sorted(g.members) if m.strip()]
+        if g.sp_application_id:
+            principals.append((g.sp_application_id, SP_CATALOG_PRIVILEGES, SP_SCHEMA_PRIVILEGES))
+        for principal, catalog_privileges, schema_privileges in principals:
+            key = principal.lower()
+            if key not in catalog_granted:
+                catalog_granted.add(key)
+                missing = _missing(state.catalog_grants.get(key, set()), catalog_privileges)
+                if missing:
+                    plan.append(Statement(1, g.group, f"GRANT {', '.join(missing)} ON CATALOG `{catalog}` TO `{principal}`"))
+            missing = _missing(state.schema_grants.get((schema, key), set()), schema_privileges)
+            if missing:
+                plan.append(Statement(1, g.group,
+                                      f"GRANT {', '.join(missing)} ON SCHEMA `{catalog}`.`{schema}` TO `{principal}`"))
+    return sorted(plan, key=lambda s: s.phase)
+
+
+def apply_plan(connect, plan: list[Statement], max_workers: int = 4) -> list:
+    """
+    Execute the statements concurrently, phase by phase. Each worker thread uses its own connection.
+    :param connect: () -> a new DB-API connection
+    :return: list of (Statement, error), error is None if the statement succeeded
+    """
+    local = threading.local()
+    connections = []
+    lock = threading.Lock()
+
+    def execute(statement):
+        if not hasattr(local, 'connection'):
+            local.connection = connect()
+            with lock:
+                connections.append(local.connection)
+        try:
+            with local.connection.cursor() as cursor:
+                cursor.execute(statement.sql)
+            return statement, None
+        except Exception as e:  # the connector raises its own exception types
+            return statement, e
+
+    # a group whose schema could not be created gets no grants
+    results = []
+    failed_groups = set()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for phase in sorted({s.phase for s in plan}):
+                todo = [s for s in plan if s.phase == phase and s.group not in failed_groups]
+                for statement, error in executor.map(execute, todo):
+                    results.append((statement, error))
+                    print(f"  {'ERROR' if error else 'OK':5} {statement.sql}" + (f": {error}" if error else ""))
+                    if error:
+                        failed_groups.add(statement.group)
+    finally:
+        for connection in connections:
+            connection.close()
+    return results
+
+
+def groups_from_moodle(filename: str) -> list[GroupPrincipals]:
+    return [GroupPrincipals(f"group_{gid:02}", tuple(members))
+            for gid, members in MoodleFileParser.parse_moodle_csv(filename).items()]
+
+
+def service_principals(groups_api: DataBricksGroups) -> dict:
+    """:return: dict { display name (sp_NN) -> application id } of the workspace service principals"""
+    return {sp["displayName"]: sp.get("applicationId")
+            for sp in groups_api.iter_service_principals(attributes="displayName,applicationId",
+                                                         filter_='displayName sw "sp_"')}
 
-it does not work because the groups are ws level but are expected to be account level
 
+def with_service_principals(groups: list[GroupPrincipals], sp_ids: dict) -> list[GroupPrincipals]:
+    """Add the application id of sp_NN to group_NN. A group without a service principal is only granted to its members"""
+    out = []
+    for g in groups:
+        sp_name = "sp_" + g.schema.removeprefix("schema_")
+        if sp_name not in sp_ids:
+            print(f"  WARNING: no service principal '{sp_name}' for {g.group}")
+        out.append(GroupPrincipals(g.group, g.members, sp_ids.get(sp_name)))
+    return out
 
-from databricks import sql
 
-# Configuration
+def sql_connector(host: str, sql_id: str, token: str):
+    """:return: a function that opens a new SQL warehouse connection"""
+    from databricks import sql  # databricks-sql-connector (see databricks/__init__.py)
 
-# Catalog name is the same as Databricks workspace name
-CATALOG = "lab94290w3"
+    def connect():
+        return sql.connect(server_hostname=host.replace("https://", "").rstrip("/"),
+                           http_path=f"/sql/1.0/warehouses/{sql_id}", access_token=token)
+    return connect
 
-# how many student groups? group_01 .. group_NN
-NUM_GROUPS = 32
 
-# Workspace ID (the first part in the URL of the ws)
-WS_ID = "adb-983293358114278.18"
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the schema and grants of every student group (only what is missing)")
+    parser.add_argument("--csv", required=True, help="Moodle group roster (the students to grant)")
+    parser.add_argument("--groups", nargs='+', help="only these groups, e.g. group_26")
+    parser.add_argument("--catalog", default=os.getenv("DATABRICKS_CATALOG"), help="defaults to DATABRICKS_CATALOG env var (the workspace name)")
+    parser.add_argument("--dry-run", action="store_true", help="print the missing statements, do not execute them")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent SQL warehouse connections")
+    args = parser.parse_args()
 
-# Token (Pesonal Access Token) you created in the portal
-TOKEN = "dapi***"
-GROUPS = [f"group_{i:02d}" for i in range(1, NUM_GROUPS)]
-GROUPS = ['group_26']
-HOSTNAME = f"{WS_ID}.azuredatabricks.net"
+    host, sql_id, token = (os.getenv(v) for v in ("DATABRICKS_HOST", "DATABRICKS_SQL_ID", "DATABRICKS_TOKEN"))
+    if not all([host, sql_id, token, args.catalog]):
+        raise SystemExit("must set DATABRICKS_HOST, DATABRICKS_SQL_ID, DATABRICKS_TOKEN and DATABRICKS_CATALOG (or --catalog)")
 
-# To find the URL, select the SQL workspace you created, choose "Connection Details" tab,
-# and there you will see both hostname and HTTP path.
-HTTP_PATH = f"/sql/1.0/warehouses/44e60e83178ee82c"
+    open_index()    # the group numbers of the last sync, so schema_NN goes to the members of group_NN
+    groups = groups_from_moodle(args.csv)
+    if args.groups:
+        groups = [g for g in groups if g.group in args.groups]
+    groups_api = DataBricksGroups(host=f"https://{host.replace('https://', '').rstrip('/')}", token=token)
+    groups = with_service_principals(groups, service_principals(groups_api))
 
-def setup_lab():
-    with sql.connect(server_hostname=HOSTNAME, http_path=HTTP_PATH, access_token=TOKEN) as conn:
+    connect = sql_connector(host, sql_id, token)
+    with connect() as conn:
         with conn.cursor() as cursor:
-            for group in GROUPS:
-                schema = f"{CATALOG}.{group}"
-                print(f"Provisioning {schema}...")
-                
-                # Create isolated schema
-                cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
-                
-                # Grant minimal catalog visibility
-                cursor.execute(f"GRANT USE CATALOG ON CATALOG `{CATALOG}` TO `{group}`")
-                
-                # Grant full CRUD permissions within their own schema ONLY
-                cursor.execute(f"GRANT USE SCHEMA, CREATE TABLE, SELECT, MODIFY ON SCHEMA {schema} TO `{group}`")
-
-setup_lab()
\ No newline at end of file
+            state = fetch_state(cursor, args.catalog)
+    plan = plan_provisioning(args.catalog, groups, state)
+    print(f"{len(groups)} groups, {len(state.schemas)} existing schemas: {len(plan)} statements to execute")
+    for statement in plan:
+        print(f"  {statement}")
+    if plan and not args.dry_run:
+        results = apply_plan(connect, plan, max_workers=args.workers)
+        failed = sum(1 for _, error in results if error)
+        print(f"Done: {len(results) - failed} succeeded, {failed} failed")
@@ -0,0 +1,228 @@
+"""
+Drift detection between the Terraform state (terraform/dbr/dev.tfstate) and the live workspace.
+
+main.py and the other ops change the workspace behind Terraform's back (users, permissions,
+auto-termination...). Instead of a full 'terraform plan' (which refreshes every resource one by one),
+the state file is parsed and the live objects are read with a few bulk calls (SCIM listings,
+clusters/list) plus concurrent permission reads:
+
+    resources = load_state("terraform/dbr/dev.tfstate")
+    report = detect_drift(resources, groups_api, cluster_api)
+    print(format_report(report))
+
+Only the attributes the ops scripts touch are compared; the other resource types are counted as unchecked.
+"""
+import concurrent.futures
+import json
+from dataclasses import dataclass, field
+
+from .DataBricksClusterOps import DataBricksClusterOps
+from .DataBricksGroups import DataBricksGroups
+
+# attributes compared for each cluster (state attribute name == clusters/get field name)
+CLUSTER_FIELDS = ('cluster_name', 'spark_version', 'node_type_id', 'driver_node_type_id',
+                  'autotermination_minutes', 'data_security_mode')
+CHECKED_TYPES = ('databricks_user', 'databricks_group', 'databricks_group_member', 'databricks_service_principal',
+                 'databricks_cluster', 'databricks_permissions')
+
+
+@dataclass
+class StateResource:
+    address: str        # e.g. databricks_user.workspace_user["a@x.com"]
+    type: str
+    id: str
+    attributes: dict
+
+
+@dataclass
+class Drift:
+    address: str
+    type: str
+    kind: str                                       # missing / changed
+    changes: list = field(default_factory=list)     # (attribute, state value, live value)
+
+    def __str__(self):
+        if self.kind == 'missing':
+            return f"{self.address}: missing in the workspace"
+        return f"{self.address}: " + ", ".join(f"{a} {s!r} -> {l!r}" for a, s, l in self.changes)
+
+
+@dataclass
+class DriftReport:
+    drifts: list = field(default_factory=list)
+    checked: dict = field(default_factory=dict)     # type -> number of resources compared
+    unchecked: dict = field(default_factory=dict)   # type -> number of resources of unsupported types
+
+
+def _address(resource: dict, instance: dict) -> str:
+    address = f"{resource['type']}.{resource['name']}"
+    if 'module' in resource:
+        address = f"{resource['module']}.{address}"
+    key = instance.get('index_key')
+    if isinstance(key, str):
+        address += f'["{key}"]'
+    elif key is not None:
+        address += f'[{key}]'
+    return address
+
+
+def load_state(filename: str) -> list[StateResource]:
+    """:return: the managed resources of a (version 4) tfstate file"""
+    with open(filename) as f:
+        state = json.load(f)
+    out = []
+    for r in state.get('resources', []):
+        if r.get('mode') != 'managed':
+            continue
+        for instance in r.get('instances', []):
+            attributes = instance.get('attributes', {})
+            out.append(StateResource(_address(r, instance), r['type'], attributes.get('id', ''), attributes))
+    return out
+
+
+@dataclass
+class LiveObjects:
+    users: dict = field(default_factory=dict)       # id -> SCIM user
+    groups: dict = field(default_factory=dict)      # id -> SCIM group
+    sps: dict = field(default_factory=dict)         # id -> SCIM service principal
+    clusters: dict = field(default_factory=dict)    # cluster_id -> cluster
+    acls: dict = field(default_factory=dict)        # cluster_id -> permissions/clusters response
+
+
+def fetch_live(resources: list[StateResource], groups_api: DataBricksGroups, cluster_api: DataBricksClusterOps,
+               max_workers: int = 8) -> LiveObjects:
+    """Read only what the state refers to: the listings run concurrently, then the cluster ACLs concurrently"""
+    types = {r.type for r in resources}
+    live = LiveObjects()
+    listings = {
+        'users': (types & {'databricks_user'},
+                  lambda: groups_api.iter_users(attributes="id,userName,active")),
+        'groups': (types & {'databricks_group', 'databricks_group_member'},
+                   lambda: groups_api.iter_groups(attributes="id,displayName,members")),
+        'sps': (types & {'databricks_service_principal'},
+                lambda: groups_api.iter_service_principals(attributes="id,displayName,applicationId,active")),
+    }
+    acl_ids = sorted({r.attributes['cluster_id'] for r in resources
+                      if r.type == 'databricks_permissions' and r.attributes.get('cluster_id')})
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(lambda f=fetch: {o['id']: o for o in f()})
+                   for name, (needed, fetch) in listings.items() if needed}
+        if 'databricks_cluster' in types:
+            futures['clusters'] = executor.submit(
+                lambda: {c['cluster_id']: c for c in cluster_api.get_clusters(max_age=0)})
+        acl_futures = {cid: executor.submit(cluster_api.get_cluster_permission, cid) for cid in acl_ids}
+        for name, future in futures.items():
+            setattr(live, name, future.result())
+        for cid, future in acl_futures.items():
+            try:
+                live.acls[cid] = future.result()
+            except Exception as ex:  # a deleted cluster has no ACL: reported as missing
+                if getattr(getattr(ex, 'response', None), 'status_code', None) not in (400, 404):
+                    raise
+    return live
+
+
+def _compare(pairs) -> list:
+    return [(name, s, l) for name, s, l in pairs if s != l]
+
+
+def _direct_acl(acl: dict) -> dict:
+    """:return: {principal: permission level} of the non-inherited entries"""
+    out = {}
+    for entry in acl.get('access_control_list', []):
+        principal = entry.get('group_name') or entry.get('user_name') or entry.get('service_principal_name')
+        for p in entry.get('all_permissions', []):
+            if not p.get('inherited', False):
+                out[principal] = p['permission_level']
+    return out
+
+
+def check_resource(r: StateResource, live: LiveObjects) -> Drift | None:
+    """:return: the drift of one resource, None if it is in sync. The type must be in CHECKED_TYPES."""
+    a = r.attributes
+    if r.type == 'databricks_user':
+        u = live.users.get(r.id)
+        if u is None:
+            return Drift(r.address, r.type, 'missing')
+        changes = _compare([('user_name', a.get('user_name', '').lower(), u.get('userName', '').lower()),
+                            ('active', a.get('active', True), u.get('active', True))])
+    elif r.type == 'databricks_group':
+        g = live.groups.get(r.id)
+        if g is None:
+            return Drift(r.address, r.type, 'missing')
+        changes = _compare([('display_name', a.get('display_name'), g.get('displayName'))])
+    elif r.type == 'databricks_group_member':
+        g = live.groups.get(a.get('group_id'))
+        if g is None or a.get('member_id') not in {m['value'] for m in g.get('members', [])}:
+            return Drift(r.address, r.type, 'missing')
+        changes = []
+    elif r.type == 'databricks_service_principal':
+        sp = live.sps.get(r.id)
+        if sp is None:
+            return Drift(r.address, r.type, 'missing')
+        changes = _compare([('display_name', a.get('display_name'), sp.get('displayName')),
+                            ('active', a.get('active', True), sp.get('active', True))])
+    elif r.type == 'databricks_cluster':
+        c = live.clusters.get(r.id)
+        if c is None:
+            return Drift(r.address, r.type, 'missing')
+        pairs = [(f, a.get(f), c.get(f)) for f in CLUSTER_FIELDS if a.get(f) not in (None, '')]
+        if a.get('autoscale'):
+            wanted = {k: a['autoscale'][0].get(k) for k in ('min_workers', 'max_workers')}
+            pairs.append(('autoscale', wanted, {k: c.get('autoscale', {}).get(k) for k in wanted}))
+        changes = _compare(pairs)
+    elif r.type == 'databricks_permissions':
+        acl = live.acls.get(a.get('cluster_id'))
+        if acl is None:
+            return Drift(r.address, r.type, 'missing')
+        current = _direct_acl(acl)
+        changes = []
+        for entry in a.get('access_control', []):
+            principal = entry.get('group_name') or entry.get('user_name') or entry.get('service_principal_name')
+            if current.get(principal) != entry['permission_level']:
+                changes.append((principal, entry['permission_level'], current.get(principal)))
+    else:
+        raise ValueError(f"unsupported type {r.type}")
+    return Drift(r.address, r.type, 'changed', changes) if changes else None
+
+
+def detect_drift(resources: list[StateResource], groups_api: DataBricksGroups, cluster_api: DataBricksClusterOps,
+                 max_workers: int = 8) -> DriftReport:
+    """
+    Compare the state resources with the live workspace.
+    Of the databricks_permissions resources, only the cluster ACLs are checked.
+    """
+    checked = [r for r in resources if r.type in CHECKED_TYPES
+               and (r.type != 'databricks_permissions' or r.attributes.get('cluster_id'))]
+    live = fetch_live(checked, groups_api, cluster_api, max_workers=max_workers)
+    report = DriftReport()
+    for r in checked:
+        report.checked[r.type] = report.checked.get(r.type, 0) + 1
+        drift = check_resource(r, live)
+        if drift:
+            report.drifts.append(drift)
+    checked_ids = {id(r) for r in checked}
+    for r in resources:
+        if id(r) not in checked_ids:
+            report.unchecked[r.type] = report.unchecked.get(r.type, 0) + 1
+    return report
+
+
+def format_report(report: DriftReport) -> str:
+    from tabulate import tabulate
+
+    rows = []
+    for t, n in sorted(report.checked.items()):
+        drifts = [d for d in report.drifts if d.type == t]
+        missing = sum(1 for d in drifts if d.kind == 'missing')
+        rows.append([t, n, n - len(drifts), missing, len(drifts) - missing])
+    lines = [tabulate(rows, headers=['type', 'checked', 'in sync', 'missing', 'changed'])]
+    if report.unchecked:
+        lines.append("not checked: " + ", ".join(f"{t} ({n})" for t, n in sorted(report.unchecked.items())))
+    if report.drifts:
+        lines.append("")
+        lines += [str(d) for d in sorted(report.drifts, key=lambda d: (d.type, d.address))]
+    else:
+        lines.append("No drift: the workspace matches the Terraform state.")
+    return "\n".join(lines)
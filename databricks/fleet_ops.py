@@ -0,0 +1,247 @@
+"""
+Run one per-cluster operation on many clusters concurrently.
+
+    selector = ClusterSelector(name_regex=r"^cluster_\\d{2}$", states={'TERMINATED'})
+    results = run_fleet_operation(cluster_api, pin, selector, checkpoint="pin.ckpt.json")
+    print(format_results(results))
+
+* the clusters are listed once, and filtered by name regex, state and custom tags
+* the operation runs with bounded concurrency, and each cluster is retried on a transient failure
+  (5xx, 429, connection error or timeout). Other failures (4xx, bad cluster spec) fail fast: they would fail again
+* a checkpoint file records the clusters that are done, so an interrupted run can be
+  repeated and continues where it stopped. The file is removed when all the clusters succeed.
+
+An operation is a function (client, cluster dict) -> anything. A requests.Response with an
+error status counts as a failure.
+"""
+import concurrent.futures
+import json
+import os
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import partial
+
+import requests
+
+from .DataBricksClusterOps import DataBricksClusterOps
+from .resilience import CircuitOpenError
+
+NLP_LIBRARIES = [
+    {"pypi": {"package": "spark-nlp", "repo": "https://pypi.org/simple"}},
+    {"pypi": {"package": "nltk", "repo": "https://pypi.org/simple"}},
+    {"pypi": {"package": "spacy", "repo": "https://pypi.org/simple"}},
+    {"pypi": {"package": "gensim", "repo": "https://pypi.org/simple"}},
+    {"maven": {"coordinates": "com.johnsnowlabs.nlp:spark-nlp_2.12:5.1.2"}}  # add your own maven library here
+]
+
+
+@dataclass
+class ClusterSelector:
+    name_regex: str | None = None
+    states: set | None = None           # e.g. {'TERMINATED'}
+    tags: dict = field(default_factory=dict)  # custom_tags that must match
+
+    def matches(self, cluster: dict) -> bool:
+        if self.name_regex and not re.search(self.name_regex, cluster.get('cluster_name', '')):
+            return False
+        if self.states and cluster.get('state') not in self.states:
+            return False
+        custom_tags = cluster.get('custom_tags', {})
+        return all(custom_tags.get(k) == v for k, v in self.tags.items())
+
+    @classmethod
+    def from_args(cls, name_regex: str | None, state: str | None, tags: list[str] | None):
+        """:param tags: list of 'key=value'"""
+        return cls(name_regex=name_regex,
+                   states={s.strip().upper() for s in state.split(',')} if state else None,
+                   tags=dict(t.split('=', 1) for t in tags or []))
+
+
+@dataclass
+class OpResult:
+    cluster_id: str
+    cluster_name: str
+    status: str = 'pending'     # ok / failed / done before (found in the checkpoint)
+    attempts: int = 0
+    seconds: float = 0.0
+    error: str = ''
+
+
+class Checkpoint:
+    """The IDs of the clusters the operation already succeeded on, saved after each success"""
+
+    def __init__(self, path: str | None, operation_name: str):
+        self.path = path
+        self.operation_name = operation_name
+        self.done = set()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get('operation') == operation_name:
+                self.done = set(saved.get('done', []))
+
+    def mark_done(self, cluster_id: str):
+        with self._lock:
+            self.done.add(cluster_id)
+            if self.path:
+                tmp = self.path + '.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump({'operation': self.operation_name, 'done': sorted(self.done)}, f)
+                os.replace(tmp, self.path)
+
+    def remove(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ProgressBar:
+    """A one line text progress bar on stderr"""
+
+    def __init__(self, total: int, enabled: bool = True, width: int = 30, stream=sys.stderr):
+        self.total, self.enabled, self.width, self.stream = total, enabled, width, stream
+        self.ok = self.failed = 0
+        self._lock = threading.Lock()
+
+    def update(self, ok: bool):
+        with self._lock:
+            if ok:
+                self.ok += 1
+            else:
+                self.failed += 1
+            if self.enabled:
+                n = self.ok + self.failed
+                filled = self.width * n // max(self.total, 1)
+                self.stream.write(f"\r[{'#' * filled}{'.' * (self.width - filled)}] {n}/{self.total} "
+                                  f"ok={self.ok} failed={self.failed}")
+                if n == self.total:
+                    self.stream.write('\n')
+                self.stream.flush()
+
+
+def is_transient(ex: Exception) -> bool:
+    """A failure that may pass if the operation is repeated"""
+    if isinstance(ex, CircuitOpenError):
+        return False  # the workspace keeps failing, the breaker would reject the retry anyway
+    if isinstance(ex, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(ex, requests.HTTPError) and ex.response is not None:
+        return ex.response.status_code == 429 or ex.response.status_code >= 500
+    return False
+
+
+def _run_one(operation, client, cluster: dict, result: OpResult, retries: int, retry_delay: float):
+    start = time.monotonic()
+    for attempt in range(1, retries + 2):
+        result.attempts = attempt
+        try:
+            ret = operation(client, cluster)
+            if isinstance(ret, requests.Response):
+                ret.raise_for_status()
+            result.status, result.error = 'ok', ''
+            break
+        except (requests.RequestException, RuntimeError, KeyError, ValueError) as ex:
+            result.status, result.error = 'failed', str(ex)
+            if attempt > retries or not is_transient(ex):
+                break
+            time.sleep(retry_delay * attempt)
+    result.seconds = round(time.monotonic() - start, 2)
+    return result
+
+
+def run_fleet_operation(client: DataBricksClusterOps, operation, selector: ClusterSelector | None = None,
+                        max_workers: int = 8, retries: int = 2, retry_delay: float = 2.0,
+                        checkpoint: str | None = None, progress: bool = True, logger=None) -> list[OpResult]:
+    """
+    :param operation: function (client, cluster dict) -> anything. Raise (or return an error Response) to fail.
+    :param checkpoint: path of the checkpoint file. None: do not checkpoint
+    :return: one OpResult per selected cluster
+    """
+    selector = selector or ClusterSelector()
+    name = getattr(operation, '__name__', 'operation')
+    ckpt = Checkpoint(checkpoint, name)
+    clusters = [c for c in client.get_clusters(max_age=0) if selector.matches(c)]
+
+    results, todo = [], []
+    for c in clusters:
+        r = OpResult(cluster_id=c['cluster_id'], cluster_name=c.get('cluster_name', ''))
+        if r.cluster_id in ckpt.done:
+            r.status = 'done before'
+        else:
+            todo.append((c, r))
+        results.append(r)
+    if logger:
+        logger.info(f"{name}: {len(clusters)} clusters selected, {len(todo)} to do")
+
+    bar = ProgressBar(len(todo), enabled=progress and bool(todo))
+    if todo:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(todo))) as executor:
+            futures = [executor.submit(_run_one, operation, client, c, r, retries, retry_delay) for c, r in todo]
+            for future in concurrent.futures.as_completed(futures):
+                r = future.result()
+                if r.status == 'ok':
+                    ckpt.mark_done(r.cluster_id)
+                elif logger:
+                    logger.error(f"{name} failed on {r.cluster_name} ({r.cluster_id}): {r.error}")
+                bar.update(r.status == 'ok')
+
+    if all(r.status != 'failed' for r in results):
+        ckpt.remove()
+    return results
+
+
+def format_results(results: list[OpResult]) -> str:
+    from tabulate import tabulate
+
+    rows = [[r.cluster_name, r.cluster_id, r.status, r.attempts, r.seconds, r.error] for r in
+            sorted(results, key=lambda r: r.cluster_name)]
+    counts = {}
+    for r in results:
+        counts[r.status] = counts.get(r.status, 0) + 1
+    table = tabulate(rows, headers=['cluster', 'id', 'status', 'attempts', 'seconds', 'error'])
+    return table + "\n" + ", ".join(f"{k}={v}" for k, v in sorted(counts.items()))
+
+
+# The operations. Each one is (client, cluster) -> ...
+
+def pin(client: DataBricksClusterOps, cluster: dict):
+    return client.pin_cluster(cluster)
+
+
+def terminate(client: DataBricksClusterOps, cluster: dict):
+    if cluster.get('state') not in ('TERMINATED', 'TERMINATING'):
+        client.terminate_cluster(cluster['cluster_id'])
+
+
+def permanent_delete(client: DataBricksClusterOps, cluster: dict):
+    client.permanent_delete_cluster(cluster['cluster_id'])
+
+
+def auto_termination(client: DataBricksClusterOps, cluster: dict, minutes: int):
+    return client.update_auto_termination(cluster, minutes)
+
+
+def install_libraries(client: DataBricksClusterOps, cluster: dict, libraries: list[dict]):
+    return client.install_libraries(cluster['cluster_id'], libraries)
+
+
+def operation_by_name(name: str, minutes: int | None = None):
+    """:return: the operation for the CLI name, e.g. 'pin' or 'auto_termination'"""
+    if name == 'auto_termination':
+        if minutes is None:
+            raise ValueError("auto_termination needs the number of minutes")
+        op = partial(auto_termination, minutes=minutes)
+    elif name == 'install_nlp_libs':
+        op = partial(install_libraries, libraries=NLP_LIBRARIES)
+    elif name in ('pin', 'terminate', 'permanent_delete'):
+        return globals()[name]
+    else:
+        raise ValueError(f"unknown fleet operation {name}")
+    op.__name__ = f"{name}({minutes})" if name == 'auto_termination' else name
+    return op
+
+
+OPERATION_NAMES = ('pin', 'terminate', 'auto_termination', 'install_nlp_libs', 'permanent_delete')
@@ -0,0 +1,142 @@
+"""
+Track the installation of libraries on the clusters, with one libraries/all-cluster-statuses call per round.
+
+    tracker = LibraryTracker(cluster_api, expected=NLP_LIBRARIES)
+    tracker.wait(timeout=1800, logger=logger)
+    print(tracker.failure_report())
+
+The libraries are installed only on running clusters. On a terminated cluster they stay
+PENDING until the next start, so by default only running clusters are waited for, and the
+others are reported as 'waiting for cluster start'.
+
+Polling is adaptive: after a round with changes the next round comes after min_interval,
+after a quiet round the interval grows by 'backoff', up to max_interval.
+"""
+import time
+from dataclasses import dataclass, field
+
+from .DataBricksClusterOps import DataBricksClusterOps
+
+TERMINAL_STATES = {'INSTALLED', 'FAILED', 'SKIPPED', 'UNINSTALL_ON_RESTART'}
+NOT_REPORTED = 'NOT_REPORTED'   # an expected library the workspace does not know on this cluster
+
+
+def library_key(library: dict) -> str:
+    """:return: a readable key of a library spec, e.g. 'pypi:spacy' or 'maven:com.johnsnowlabs.nlp:spark-nlp_2.12:5.1.2'"""
+    for kind in ('pypi', 'cran'):
+        if kind in library:
+            return f"{kind}:{library[kind]['package']}"
+    if 'maven' in library:
+        return f"maven:{library['maven']['coordinates']}"
+    for kind in ('jar', 'egg', 'whl', 'requirements'):
+        if kind in library:
+            return f"{kind}:{library[kind]}"
+    return str(library)
+
+
+@dataclass
+class LibraryState:
+    status: str
+    messages: list = field(default_factory=list)
+    since: float = 0.0   # seconds since the tracking started
+
+
+class LibraryTracker:
+
+    def __init__(self, client: DataBricksClusterOps, expected: list[dict] | None = None,
+                 cluster_ids: set | None = None, running_only: bool = True, report_grace: float = 30):
+        """
+        :param expected: the libraries that should be on every tracked cluster. None: track whatever is reported
+        :param cluster_ids: the clusters to track. None: all the clusters
+        :param running_only: wait only for libraries on running clusters
+        :param report_grace: seconds to wait for an expected library to show up in the statuses. Then it is a failure
+        """
+        self.client = client
+        self.expected = [library_key(lib) for lib in expected] if expected else []
+        self.cluster_ids = cluster_ids
+        self.running_only = running_only
+        self.report_grace = report_grace
+        self.states = {}        # (cluster_id, library key) -> LibraryState
+        self.transitions = []   # (seconds, cluster_id, library key, old status, new status)
+        self.cluster_names = {}
+        self.not_running = set()
+        self._start = time.monotonic()
+
+    def _tracked(self, cluster_id: str) -> bool:
+        return self.cluster_ids is None or cluster_id in self.cluster_ids
+
+    def poll(self) -> int:
+        """One batched status query. :return: the number of state changes"""
+        clusters = self.client.get_clusters(max_age=0)
+        self.cluster_names = {c['cluster_id']: c.get('cluster_name', '') for c in clusters}
+        self.not_running = {c['cluster_id'] for c in clusters if c.get('state') != 'RUNNING'}
+        now = round(time.monotonic() - self._start, 1)
+        seen = {}
+        for entry in self.client.get_all_library_statuses():
+            if not self._tracked(entry['cluster_id']):
+                continue
+            for ls in entry.get('library_statuses', []):
+                seen[(entry['cluster_id'], library_key(ls['library']))] = (ls['status'], ls.get('messages', []))
+        for cluster_id in self.cluster_names:
+            if self._tracked(cluster_id):
+                for key in self.expected:
+                    seen.setdefault((cluster_id, key), (NOT_REPORTED, []))
+
+        changes = 0
+        for k, (status, messages) in seen.items():
+            old = self.states.get(k)
+            if old is None or old.status != status:
+                self.transitions.append((now, k[0], k[1], old.status if old else None, status))
+                self.states[k] = LibraryState(status, messages, now)
+                changes += 1
+            else:
+                old.messages = messages
+        return changes
+
+    def pending(self) -> list[tuple]:
+        """:return: the (cluster_id, library key) not in a terminal state, that we are waiting for"""
+        grace_over = time.monotonic() - self._start >= self.report_grace
+        return [k for k, s in self.states.items() if s.status not in TERMINAL_STATES
+                and not (s.status == NOT_REPORTED and grace_over)
+                and not (self.running_only and k[0] in self.not_running)]
+
+    def wait(self, timeout: float = 1800, min_interval: float = 5, max_interval: float = 60,
+             backoff: float = 1.5, logger=None) -> bool:
+        """
+        Poll until all the tracked libraries reach a terminal state.
+        :return: True if all of them are INSTALLED (or SKIPPED) before the timeout
+        """
+        interval = min_interval
+        while True:
+            changes = self.poll()
+            pending = self.pending()
+            if logger:
+                logger.info(f"libraries: {len(pending)} pending, {changes} changed")
+            if not pending:
+                break
+            if time.monotonic() - self._start >= timeout:
+                if logger:
+                    logger.error(f"timeout: {len(pending)} libraries did not finish")
+                return False
+            interval = min_interval if changes else min(max_interval, interval * backoff)
+            time.sleep(interval)
+        return not self.failures()
+
+    def failures(self) -> list[tuple]:
+        """:return: [(cluster_id, library key, LibraryState)] of failed or missing libraries"""
+        return [(c, lib, s) for (c, lib), s in sorted(self.states.items())
+                if s.status in ('FAILED', NOT_REPORTED) and not (self.running_only and c in self.not_running)]
+
+    def failure_report(self) -> str:
+        from tabulate import tabulate
+
+        rows = [[self.cluster_names.get(c, c), lib, s.status, ' | '.join(s.messages)[:200]]
+                for c, lib, s in self.failures()]
+        rows += [[self.cluster_names.get(c, c), lib, s.status, 'waiting for cluster start']
+                 for (c, lib), s in sorted(self.states.items())
+                 if self.running_only and c in self.not_running and s.status not in TERMINAL_STATES]
+        installed = sum(1 for s in self.states.values() if s.status == 'INSTALLED')
+        summary = f"installed {installed}, failed {len(self.failures())}, total {len(self.states)}"
+        if not rows:
+            return f"All libraries are installed. {summary}"
+        return tabulate(rows, headers=['cluster', 'library', 'status', 'message']) + "\n" + summary
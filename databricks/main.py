@@ -4,11 +4,12 @@
 
 import json
 import logging
-import os, sys, re, pprint
+import os, sys, pprint
 
 try:
     from .DataBricksClusterOps import DataBricksClusterOps
     from .DataBricksGroups import DataBricksGroups
+    from .roster_index import STUDENT_GROUP_RE, open_index, numbered_roster
 except ImportError:
     # gemini 2025-11-26 13:30
     print("Error: This script should be run as a module.")
@@ -27,20 +28,19 @@ def group_name_int(id_ :int):
     assert 0 < id_ < 100  # blo fuze if naming breaks
     return f"group_{id_:02}"
 
-def create_users_from_moodle(dbapi: DataBricksClusterOps, filename: str, verbose: bool) -> int:
+def create_users_from_moodle(dbapi: DataBricksClusterOps, filename: str, verbose: bool) -> dict:
     """
     Read Moodle user groups, and create Databricks groups with these users
     The groups and users MUST NOT exist before in Databricks workspace.
+    The groups are numbered like the last sync (see roster_index.numbered_roster)
 
     :param dbapi: initialized connection to Databricks API
     :param filename: CSV file in Moodle format, group assignment
-    :return: number of groups created in the workspace
+    :return: the groups created in the workspace: dict {Moodle group id -> RosterGroup}
     :raise HTTPstatus if any of the requests failed
     """
-    from .MoodleFileParser import MoodleFileParser
-
     if dry_run:
-        return 0
+        return {}
 
     def raise_for_status_unless_exists(res):
          if 400 <= res.status_code < 500:
@@ -51,7 +51,8 @@ def create_users_from_moodle(dbapi: DataBricksClusterOps, filename: str, verbose
                 return
              response.raise_for_status()
 
-    groups = MoodleFileParser.parse_moodle_csv(filename)
+    open_index()
+    groups = numbered_roster(filename)
 
     groups_api = DataBricksGroups(host=dbapi.host, token=dbapi.token)
 
@@ -61,11 +62,12 @@ def create_users_from_moodle(dbapi: DataBricksClusterOps, filename: str, verbose
     response = groups_api.create_group(master_group_name)
     raise_for_status_unless_exists(response)
 
-    for group_id, users in groups.items():
+    for group in groups.values():
         # the 'users' is full email address, all in the same domain.
         # let's remove the domain -- we know that the name will be unique in a single domain.
         # shortnames = [u[: u.rfind('@')]  for u in users]
-        group_name = group_name_int(group_id)
+        users = list(group.members)
+        group_name = group_name_int(group.ordinal)
         response = groups_api.create_group(group_name)
         raise_for_status_unless_exists(response)
 
@@ -84,30 +86,25 @@ def create_users_from_moodle(dbapi: DataBricksClusterOps, filename: str, verbose
             print(f"{group_name}", end=' ')
     if verbose:
         print('\n')
-    return len(groups)
+    return groups
 
 
-def create_clusters(how_many: int, verbose: bool = False):
+def create_clusters(numbers: list[int], verbose: bool = False):
+    """
+    Create cluster_NN for each group number concurrently: each one is created with 22 minutes auto-termination,
+    turned OFF, pinned, and group_NN gets permission to restart it.
+    """
     global dry_run
     if dry_run:
-        print(f"FAKE: create {how_many} clusters")
+        print(f"FAKE: create {len(numbers)} clusters")
         return
 
-    for j in range(how_many):
-        i = j +1
-        try:
-            resp1 = cluster_api.create_cluster(f"cluster_{i}", policy_id=policy_id)  # create the cluster and turn it ON
-            if resp1:
-                cluster_api.delete_cluster(f"cluster_{i}")  # turn the cluster OFF. We don't want to run it now.
-            else:
-                print(f"Failed created cluster {i}")
-            if verbose:
-                print(f"cluster {i}", end=' ')
-        except AttributeError as e:
-            print(f"{e}  ==> skipped")
-
+    from .cluster_fleet import create_cluster_fleet, format_fleet_report
+    names = [f"cluster_{i:02}" for i in sorted(numbers)]
+    results = create_cluster_fleet(cluster_api, names, policy_id=policy_id, autotermination_minutes=22,
+                                   logger=logger if verbose else None)
     if verbose:
-        print('\n')
+        print(format_fleet_report(results))
 
 
 def delete_all_users(groups_api: DataBricksGroups, exception_list: list[str]):
@@ -115,9 +112,8 @@ def delete_all_users(groups_api: DataBricksGroups, exception_list: list[str]):
     if ok != 'yes':
         print("Cancelled.")
         return
-    users = groups_api.list_users()
-    users_to_delete = list( filter(lambda u: u['emails'][0]['value'] not in exception_list, users['Resources']))
-    id_to_delete = [u['id'] for u in users_to_delete]
+    users = groups_api.iter_users(attributes="id,emails")
+    id_to_delete = [u['id'] for u in users if u['emails'][0]['value'] not in exception_list]
 
 
     # TODO 2025-10-22: asking the api to delete 73 users caused error 426 Too many requests.
@@ -128,14 +124,12 @@ def delete_all_users(groups_api: DataBricksGroups, exception_list: list[str]):
 
 
 def delete_all_groups(groups_api: DataBricksGroups):
-    ok = input(r"About to permanently delete ALL GROUPS matching \"^group_\d{2}\". If this is ok, type 'yes': ")
+    ok = input(r"About to permanently delete ALL GROUPS matching \"^group_\d{1,3}$\". If this is ok, type 'yes': ")
     if ok != 'yes':
         print("Cancelled.")
         return
     group_names = groups_api.list_groups()
-    p=re.compile(r"^group_\d{2}")
-
-    names_to_delete = [s for s in group_names if p.match(s)]
+    names_to_delete = [s for s in group_names if STUDENT_GROUP_RE.match(s)]
     names_to_delete.append('all_student_groups')
 
     num_deleted = 0
@@ -148,11 +142,11 @@ def delete_all_groups(groups_api: DataBricksGroups):
 
 
 def create_clusters_and_users(moodle_filename: str):
-    nGroups = create_users_from_moodle(cluster_api, moodle_filename, verbose=True)
-    create_clusters(nGroups, verbose=True)
-
-    allgroups = [f"group_{n + 1}" for n in range(nGroups)]
-    cluster_api.attach_groups_to_clusters(allgroups, verbose=True)
+    groups = create_users_from_moodle(cluster_api, moodle_filename, verbose=True)
+    create_clusters([g.ordinal for g in groups.values()], verbose=True)  # also attaches group_NN to cluster_NN
+    if groups:
+        from .roster_index import index_roster
+        index_roster(groups)
 
     print("Once the groups and users are created, you can go to the DataBricks portal to add permission to use the workspace.\n "
           "choose your name - Admin Console. 'Identity and access' | 'Groups' .\n"
@@ -161,40 +155,48 @@ def create_clusters_and_users(moodle_filename: str):
 
 def install_libs_for_NLP(c :DataBricksClusterOps): # noqa: VUL
     """Install the libraries needed for the NLP task to all the clusters"""
-    clusters = c.get_clusters()
-    #clusters_ids = [c['cluster_id'] for c in clusters]
-    for cluster in clusters:
-        cid = cluster['cluster_id']
-        result = c.install_libraries(cid, [
-            {"pypi": {"package": "spark-nlp", "repo": "https://pypi.org/simple"}},
-            {"pypi": {"package": "nltk", "repo": "https://pypi.org/simple"}},
-            {"pypi": {"package": "spacy", "repo": "https://pypi.org/simple"}},
-            {"pypi": {"package": "gensim", "repo": "https://pypi.org/simple"}},
-            {"maven": {"coordinates": "com.johnsnowlabs.nlp:spark-nlp_2.12:5.1.2"}}  # add your own maven library here
-        ])
-        if result:
-            logger.info("Installed libraries to cluster " + cid  + "("+ cluster['cluster_name'] + ")")
-        else:
-            logger.error("Failed to install libraries to cluster " + cid)
+    from .fleet_ops import run_fleet_operation, operation_by_name, format_results
+    results = run_fleet_operation(c, operation_by_name('install_nlp_libs'), logger=logger)
+    logger.info(format_results(results))
+    track_libraries(c, {r.cluster_id for r in results if r.status == 'ok'})
+
+
+def track_libraries(c: DataBricksClusterOps, cluster_ids: set | None = None) -> bool:
+    """Wait until the NLP libraries are installed (or failed) on the running clusters, and print a failure report"""
+    from .fleet_ops import NLP_LIBRARIES
+    from .library_tracker import LibraryTracker
+    tracker = LibraryTracker(c, expected=NLP_LIBRARIES, cluster_ids=cluster_ids)
+    ok = tracker.wait(logger=logger)
+    print(tracker.failure_report())
+    return ok
 
 
 def update_auto_termination(c: DataBricksClusterOps, minutes: int):
     """Set the auto-termination time of all the clusters to the given number of minutes"""
-    clusters = c.get_clusters()
-    for cluster in clusters:
-        cid = cluster['cluster_id']
-        result = c.update_auto_termination(cluster, minutes)
-        if result:
-            logger.info("Updated auto-termination time of cluster " + cid + " to " + str(minutes) + " minutes")
-        else:
-            logger.error("Failed to update auto-termination time of cluster " + cid + " to " + str(minutes) + " minutes")
+    from .fleet_ops import run_fleet_operation, operation_by_name, format_results
+    results = run_fleet_operation(c, operation_by_name('auto_termination', minutes), logger=logger)
+    logger.info(format_results(results))
 
 
 def pin_clusters(client: DataBricksClusterOps):
     """PIN all the clusters in the workspace."""
-    clusters = client.get_clusters()
-    for c in clusters:
-        client.pin_cluster(c)
+    from .fleet_ops import run_fleet_operation, pin, format_results
+    results = run_fleet_operation(client, pin, logger=logger)
+    logger.info(format_results(results))
+
+
+def run_fleet_op(client: DataBricksClusterOps, args):
+    """--fleet_op: run one operation on the selected clusters"""
+    from .fleet_ops import ClusterSelector, run_fleet_operation, operation_by_name, format_results
+    if args.fleet_op == 'permanent_delete':
+        ok = input("About to permanently delete the selected clusters. If this is ok, type 'yes': ")
+        if ok != 'yes':
+            print("Cancelled.")
+            return
+    selector = ClusterSelector.from_args(args.select_name, args.select_state, args.select_tag)
+    results = run_fleet_operation(client, operation_by_name(args.fleet_op, args.minutes), selector,
+                                  max_workers=args.workers, checkpoint=args.checkpoint, logger=logger)
+    print(format_results(results))
 
 
 def print_usage():
@@ -218,7 +220,7 @@ def print_usage():
     """)
 
 def _sorted_group_names( names:list)->list :
-    names = [n for n in names if re.match(r'group_\d{2}',n)]
+    names = [n for n in names if STUDENT_GROUP_RE.match(n)]
     names.sort(key= lambda x : int(x[len('group_'):]))
     return names
 
@@ -227,9 +229,8 @@ def print_groups(groups_api: DataBricksGroups):
     pprint.pprint(names)
 
 def print_users(groups_api: DataBricksGroups):
-    values = groups_api.list_users()
-    emails =[ x['emails'][0]['value'] for x in values['Resources'] ]
-    pprint.pprint(emails)
+    for x in groups_api.iter_users(attributes="emails"):
+        print(x['emails'][0]['value'])
 
 def print_user_in_groups(groups_api: DataBricksGroups):
     names = _sorted_group_names(groups_api.list_groups()) # take only users in 'group_NN' format
@@ -260,6 +261,7 @@ def check_mandatory_env_vars():
 
 if __name__ == "__main__":
     from .resource_manager import stats
+    from .fleet_ops import OPERATION_NAMES
     if len(sys.argv) == 1:
         print_usage()
         exit(0)
@@ -283,6 +285,12 @@ if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description="Process a CSV file (optional)")
     parser.add_argument("--create_from_csv", type=str, help="Path to the CSV file")
+    parser.add_argument("--sync_from_csv", type=str, help="Bring users, groups and clusters in line with the Moodle CSV file (only the differences are applied)")
+    parser.add_argument("--plan_only", action="store_true", default=False, help="with --sync_from_csv: print the change plan, do not apply it")
+    parser.add_argument("--prune_users", action="store_true", default=False, help="with --sync_from_csv: also delete students that are no longer in the roster")
+    parser.add_argument("--since_roster", type=str, help="with --sync_from_csv: json file of the previously synced roster. Only the groups that changed since are synced, and the file is updated")
+    parser.add_argument("--renumber", action="store_true", default=False, help="with --sync_from_csv: number the groups by their position in the CSV file, like Terraform (a full sync). By default a group keeps its group_NN from the last sync")
+    parser.add_argument("--index_workspace", action="store_true", default=False, help="Update the local roster index (in the uptime DB) with the group members, clusters and service principals of the workspace")
     parser.add_argument("--print_clusters", action="store_true", default=False, help="Print the cluster names")
     parser.add_argument("--print_groups", action="store_true", default=False, help="Print the group names")
     parser.add_argument("--print_users", action="store_true", default=False, help="Print the users names")
@@ -294,14 +302,71 @@ if __name__ == "__main__":
     parser.add_argument("--test_email", action="store_true", default=False,   help="Send a test email message")
     parser.add_argument("--cluster_usage", action="store_true", default=False, help="print stats of cluster usage")
     #parser.add_argument("--install_NLP_libs", action="store_true", default=False, help="install  some needed libs")
+    parser.add_argument("--track_libraries", action="store_true", default=False, help="Wait for the NLP libraries to be installed on the running clusters, report failures")
+    parser.add_argument("--fleet_op", choices=OPERATION_NAMES, help="Run an operation on all the selected clusters, concurrently")
+    parser.add_argument("--select_name", type=str, help="with --fleet_op: regex of the cluster names, e.g. '^cluster_\\d{2}$'")
+    parser.add_argument("--select_state", type=str, help="with --fleet_op: comma separated cluster states, e.g. TERMINATED")
+    parser.add_argument("--select_tag", type=str, action="append", help="with --fleet_op: key=value custom tag (can be repeated)")
+    parser.add_argument("--minutes", type=int, help="with --fleet_op auto_termination: the auto-termination time")
+    parser.add_argument("--workers", type=int, default=8, help="with --fleet_op: number of clusters handled concurrently")
+    parser.add_argument("--checkpoint", type=str, help="with --fleet_op: checkpoint file. Re-run with the same file to resume")
+    parser.add_argument("--drift", type=str, metavar="TFSTATE", help="Report the differences between a Terraform state file (e.g. terraform/dbr/dev.tfstate) and the workspace")
     args = parser.parse_args()
 
     #install_libs_for_NLP(client)
     if args.create_from_csv:
         # Given a Moodle file, create users and groups in Databricks workspace
         create_clusters_and_users(args.create_from_csv)
-        update_auto_termination(cluster_api, 22) # 22 minutes
-        pin_clusters(cluster_api)
+
+    if args.sync_from_csv:
+        from . import reconcile
+        from .roster import read_roster, load_roster, save_roster, diff_rosters, format_diff
+        if args.renumber and args.since_roster:
+            sys.exit("--renumber is a full sync: do not use it with --since_roster")
+        if args.renumber:
+            new_roster = read_roster(args.sync_from_csv)
+        else:
+            # the groups keep their group_NN (and cluster, schema) from the last sync
+            open_index()
+            new_roster = numbered_roster(args.sync_from_csv, args.since_roster)
+        old_roster = load_roster(args.since_roster) if args.since_roster else {}
+        only_groups = None
+        if args.since_roster:
+            diff = diff_rosters(old_roster, new_roster)
+            print(format_diff(diff))
+            if diff.renumbered():
+                sys.exit("the roster renumbers existing groups. Run a full sync (without --since_roster) to renumber them")
+            only_groups = diff.changed_group_names()
+        plan = []
+        if only_groups is None or only_groups:
+            live = reconcile.fetch_live_state(groups_api, cluster_api)
+            plan = reconcile.plan_changes({g.group_name: list(g.members) for g in new_roster.values()}, live,
+                                          only_groups=only_groups, prune_users=args.prune_users)
+        print(reconcile.format_plan(plan))
+        failed = []
+        if plan and not args.plan_only:
+            results = reconcile.apply_plan(plan, groups_api, cluster_api, policy_id, logger, live=live)
+            failed = [a for a, err in results if err is not None]
+            print(f"applied {len(results) - len(failed)} changes, {len(failed)} failed")
+        if not args.plan_only and not failed:
+            if args.since_roster:
+                save_roster(new_roster, args.since_roster)
+            open_index()
+            from .roster_index import index_roster
+            index_roster(new_roster)
+
+    if args.index_workspace:
+        from . import reconcile
+        from .roster_index import index_workspace
+        live = reconcile.fetch_live_state(groups_api, cluster_api)
+        open_index()
+        index_workspace(live.groups, [{'cluster_name': n, 'cluster_id': i} for n, i in live.clusters.items()],
+                        service_principals=list(groups_api.iter_service_principals(attributes="displayName,applicationId")))
+
+    if args.drift:
+        from . import drift
+        report = drift.detect_drift(drift.load_state(args.drift), groups_api, cluster_api, max_workers=args.workers)
+        print(drift.format_report(report))
 
     if args.print_clusters:
         cluster_api.print_clusters()
@@ -316,6 +381,7 @@ if __name__ == "__main__":
         print_user_in_groups(groups_api)
 
     if args.print_user_groups_clusters:
+        open_index()
         stats.print_user_allocation_clusters(groups_api=groups_api, cluster_api=cluster_api, logger=logger)
 
     if args.delete_all_users:
@@ -333,6 +399,12 @@ if __name__ == "__main__":
         delete_all_groups(groups_api=g)
         print("To delete the workspace folders of the deleted users, use DatabricksClusterOps.py script")
 
+    if args.fleet_op:
+        run_fleet_op(cluster_api, args)
+
+    if args.track_libraries:
+        track_libraries(cluster_api)
+
     if args.purge_clusters:
         # purge all clusters in this workspace: (need to type 'yes')
         cluster_api.permanent_delete_all_clusters(verbose=True)
@@ -15,15 +15,19 @@ import datetime
 from peewee import IntegrityError
 from .DataBricksGroups import DataBricksGroups
 from .DataBricksClusterOps import DataBricksClusterOps
-from .main import group_name_int, check_mandatory_env_vars
+from .main import check_mandatory_env_vars
+from .roster_index import bind_clusters, group_for_cluster, members_of_cluster
 
 from .resource_manager.cluster_uptime import (
     update_cumulative_uptime,
     get_or_create_cluster_record
 )
 # gemini 2025-11-25 13:30
-from .database.db_operations import ClusterUptime, ClusterInfo
+from .database.db_operations import ClusterUptime, ClusterInfo, OutboxMessage
 from .resource_manager.user_mail import send_emails
+from .resource_manager.mail_outbox import enqueue_email, OutboxSender
+
+MAIL_DRAIN_SECONDS = 60
 
 
 def update_cluster_info(clusters: list[dict]):
@@ -47,15 +51,19 @@ def update_cluster_info(clusters: list[dict]):
 
 # {'members': [{'user_name': 'mdana@campus.technion.ac.il'}, {'user_name': 'liat.tsipory@campus.technion.ac.il'}]}
 def get_emails_address(cluster_name: str, g: DataBricksGroups) -> list:
-    """ The cluster name MUST be 'cluster_NNN'
+    """ The owners of the cluster, from the roster index.
+    If the group is not in the index, its members are read from the workspace.
     """
-    import re
-    if not re.match(r"cluster_\d{1,3}$", cluster_name):
+    addr = members_of_cluster(cluster_name)
+    if addr is not None:
+        return addr
+    group_name = group_for_cluster(cluster_name)
+    if not group_name:
         logging.error(f"Invalid cluster name {cluster_name}")
         return []
 
     addr = []
-    for m in g.get_group_members(group_name_int(int(cluster_name[8:]))):
+    for m in g.get_group_members(group_name):
         addr.append(m['user_name'])
     return addr
 
@@ -116,16 +124,17 @@ def main():
     dbr_groups = DataBricksGroups(host='https://' + host, token=token)
 
 
-    clusters = client.get_clusters()
+    clusters = client.get_clusters(max_age=0)  # never act on cached state
     update_cluster_info(clusters)
+    bind_clusters(clusters)
     json.dump(clusters, open('clusters.json', 'w'), indent=2)
     check_update_running_clusters(client, clusters)
 
     # now that we have the updated times, run a check and act accordingly
     send_alert_threshold = datetime.timedelta(minutes=warning_watermark_minutes)
     terminate_cluster_threshold = datetime.timedelta(minutes=termination_watermark_minutes)
-    # note: sending emails takes a lot of time, but we are not in a hurry --
-    # expected to have very few messages.
+    # note: sending emails takes a lot of time, so they are queued in the outbox
+    # and sent by the background sender (see __main__).
     # Iterate directly over Peewee model records instead of dictionary
     # Select all records from the ClusterUptime model
 
@@ -158,18 +167,18 @@ def main():
 
             logger.info(f"cluster {cluster_name} will be terminated NOW. It is up for {total_time}")
 
-            send_emails(f"'{cluster_name}' will be stopped now.",
+            enqueue_email(f"'{cluster_name}' will be stopped now.",
                         body=f"Your cluster is used for too long during the last day.({int(hours)}h{int(minutes)}m , quota is {termination_watermark_minutes} minutes) and will be terminated soon. \n\n",
                         recipients=get_emails_address(cluster_name, dbr_groups), logger=logger)
             client.delete_cluster(cluster_name)  # this will turn the cluster OFF, but not erase it.
 
             # prevent users from restarting the cluster
-            try:
-                cname_id = int(cluster_name[8:])
-                client.set_cluster_permission(cid, group_name=group_name_int(cname_id),
-                                          permission=client.ClusterPermission.ATTACH)
-            except KeyError as e:
-                logger.error(f"cluster {cluster_name} has no group name. Cannot set permission. {e}")
+            group_name = group_for_cluster(cluster_name, cid)
+            if group_name:
+                client.set_cluster_permission(cid, group_name=group_name,
+                                              permission=client.ClusterPermission.ATTACH)
+            else:
+                logger.error(f"cluster {cluster_name} has no group name. Cannot set permission.")
 
         # --- WARNING CHECK ---
         elif (total_time > send_alert_threshold) and not v.warning_sent:
@@ -177,7 +186,7 @@ def main():
             v.save()
 
             logger.info(f"cluster {cluster_name} time quota is almost used! It is up for {total_time}")
-            send_emails(subject=f"'{cluster_name}' is working for a long time",
+            enqueue_email(subject=f"'{cluster_name}' is working for a long time",
                         body=f"""Your cluster is used for {int(hours)}h{int(minutes)}m during the last day.\n\
 Please check if you still need it!\n \
 This message is sent at most once a day\n\
@@ -190,6 +199,30 @@ The time quota is reset at midnight.\n\n""",
     logger.info('Exiting successfully')
 
 
+def notify_crash(body: str):
+    """
+    Email the crash report to the admin now. It goes through the outbox, but if the outbox could not send it
+    (the mail service is down, or the outbox DB is what is broken), it is sent directly: the next run may crash
+    again before sending it.
+    """
+    subject, recipients = "Poll clusters crashed!", [os.getenv('ADMIN_EMAIL')]
+    message = None
+    try:
+        message_id = enqueue_email(subject, body=body, recipients=recipients, cc=[])
+        summary = OutboxSender().send_pending()
+        message = OutboxMessage.get_or_none(OutboxMessage.id == message_id)
+        if summary['sent'] and message and message.status == OutboxMessage.SENT:
+            return
+    except Exception as ex:
+        logging.error(f"the outbox could not send the crash report: {ex}")
+    send_emails(subject, body=body, recipients=recipients, logger=None)
+    if message:
+        # sent: the next run must not send the queued copy again
+        message.status = OutboxMessage.SENT
+        message.sent_time = datetime.datetime.now()
+        message.save()
+
+
 def text_to_pre_html(text: str) -> str:
     # Use a <pre> tag to preserve whitespace and newlines
     return f"<pre>{text}</pre>"
@@ -214,13 +247,17 @@ if __name__ == "__main__":
         prod_db = initialize_production_db()
         with prod_db.connection_context():
             create_tables(prod_db)
-            main()
+            sender = OutboxSender(logger=logging.getLogger('CLUSTER_POLL')).start()
+            try:
+                main()
+            finally:
+                # a slow mail service must not stretch the poll: the rest is sent by the next run
+                sender.stop(timeout=MAIL_DRAIN_SECONDS)
     except Exception as ex:
         print("Poll clusters crashed! email was sent")
         logging.error(f"Poll clusters crashed! sending email: {ex}")
         trace = traceback.format_exc()
-        send_emails("Poll clusters crashed!", body=text_to_pre_html(f"{str(ex)}\n\n{trace}"),
-                    recipients=[os.getenv('ADMIN_EMAIL')], logger=None)
+        notify_crash(text_to_pre_html(f"{str(ex)}\n\n{trace}"))
 
 
 
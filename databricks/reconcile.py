@@ -0,0 +1,209 @@
+"""
+Desired-state reconciliation of the workspace against the Moodle roster.
+
+Instead of blindly creating everything (and treating 409 as "exists"), the live state
+(users, student groups and their members, clusters, cluster ACLs) is fetched in bulk,
+compared with the roster, and only the differences are applied:
+
+    roster = roster_from_moodle("groups.csv")
+    live = fetch_live_state(groups_api, cluster_api)
+    plan = plan_changes(roster, live)
+    print(format_plan(plan))            # dry run
+    apply_plan(plan, groups_api, cluster_api, policy_id, logger)
+
+A mid-semester roster update then costs O(changes) API calls instead of O(students).
+Naming follows the Terraform setup: group_NN uses cluster_NN, and all the student groups
+are members of 'all_student_groups'.
+"""
+import concurrent.futures
+from dataclasses import dataclass, field
+
+import requests
+
+from .DataBricksClusterOps import DataBricksClusterOps
+from .DataBricksGroups import DataBricksGroups
+from .restore_cluster_permissions import direct_permission_level
+from .roster_index import STUDENT_GROUP_RE, STUDENT_CLUSTER_RE
+
+MASTER_GROUP = "all_student_groups"
+
+# actions are applied phase by phase; actions within a phase are independent of each other
+PHASES = (
+    ('create_user', 'create_group'),
+    ('add_to_master', 'add_member', 'remove_member', 'create_cluster'),
+    ('set_permission',),
+    ('delete_user',),
+)
+
+
+@dataclass(frozen=True)
+class Action:
+    kind: str
+    target: str         # user email, group name or cluster name
+    group: str = ''     # the group involved, if any
+
+    def __str__(self):
+        return f"{self.kind:15} {self.target}" + (f" -> {self.group}" if self.group else "")
+
+
+@dataclass
+class LiveState:
+    users: dict = field(default_factory=dict)           # email -> SCIM id
+    groups: dict = field(default_factory=dict)          # student group name -> set(member emails)
+    master_members: set | None = None                   # group names in all_student_groups. None: no such group
+    clusters: dict = field(default_factory=dict)        # cluster name -> cluster id
+    cluster_access: dict = field(default_factory=dict)  # cluster name -> direct permission level of its group
+
+
+def cluster_for_group(group_name: str) -> str:
+    return "cluster_" + group_name[len("group_"):]
+
+
+def roster_from_moodle(filename: str) -> dict:
+    """:return: dict { group_NN -> [member emails] }, numbered like the last sync (roster_index.numbered_roster)"""
+    from .roster_index import numbered_roster
+
+    return {g.group_name: list(g.members) for g in numbered_roster(filename).values()}
+
+
+def fetch_live_state(groups_api: DataBricksGroups, cluster_api: DataBricksClusterOps, max_workers: int = 8) -> LiveState:
+    """Read everything the plan depends on with a few bulk calls (plus one concurrent ACL read per student cluster)"""
+    live = LiveState()
+    for u in groups_api.iter_users(attributes="id,userName"):
+        live.users[u['userName'].lower()] = u['id']
+    id_to_email = {v: k for k, v in live.users.items()}
+
+    for g in groups_api.iter_groups(attributes="id,displayName,members"):
+        name = g['displayName']
+        members = g.get('members', [])
+        if name == MASTER_GROUP:
+            live.master_members = {m.get('display') for m in members if m.get('$ref', '').startswith('Groups/')}
+        elif STUDENT_GROUP_RE.match(name):
+            live.groups[name] = {id_to_email[m['value']] for m in members if m['value'] in id_to_email}
+
+    student_clusters = {}
+    for c in cluster_api.get_clusters(max_age=0):
+        if STUDENT_CLUSTER_RE.match(c['cluster_name']):
+            live.clusters[c['cluster_name']] = c['cluster_id']
+            student_clusters[c['cluster_name']] = c['cluster_id']
+
+    def read_access(cluster_name):
+        group_name = "group_" + cluster_name[len("cluster_"):]
+        return direct_permission_level(cluster_api.get_cluster_permission(student_clusters[cluster_name]), group_name)
+
+    if student_clusters:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(student_clusters))) as executor:
+            for name, level in zip(student_clusters, executor.map(read_access, student_clusters)):
+                live.cluster_access[name] = level
+    return live
+
+
+def plan_changes(roster: dict, live: LiveState, only_groups: set | None = None, prune_users: bool = False) -> list[Action]:
+    """
+    Compute the minimal list of actions that brings the workspace to the roster.
+    :param roster: dict { group_NN -> [member emails] }
+    :param only_groups: restrict the plan to these groups (e.g. the groups changed since the last roster)
+    :param prune_users: also delete users that are not in the roster anymore, but are still members of a student group
+    """
+    plan = []
+    roster = {g: {m.lower() for m in members} for g, members in roster.items()}
+    groups = [g for g in sorted(roster) if only_groups is None or g in only_groups]
+    level = DataBricksClusterOps.permission_level(DataBricksClusterOps.ClusterPermission.RESTART)
+
+    if live.master_members is None:
+        plan.append(Action('create_group', MASTER_GROUP))
+    for email in sorted(set().union(*[roster[g] for g in groups]) - set(live.users)):
+        plan.append(Action('create_user', email))
+
+    for g in groups:
+        if g not in live.groups:
+            plan.append(Action('create_group', g))
+        if g not in (live.master_members or set()):
+            plan.append(Action('add_to_master', g, MASTER_GROUP))
+        current = live.groups.get(g, set())
+        plan += [Action('add_member', email, g) for email in sorted(roster[g] - current)]
+        plan += [Action('remove_member', email, g) for email in sorted(current - roster[g])]
+        cluster = cluster_for_group(g)
+        if cluster not in live.clusters:
+            plan.append(Action('create_cluster', cluster, g))
+        if live.cluster_access.get(cluster) != level:
+            plan.append(Action('set_permission', cluster, g))
+
+    # students in student groups that are not in the roster (e.g. group_41 after the roster shrank)
+    for g in sorted(set(live.groups) - set(roster)):
+        if only_groups is None or g in only_groups:
+            plan += [Action('remove_member', email, g) for email in sorted(live.groups[g])]
+
+    if prune_users and only_groups is None:
+        enrolled = set().union(*roster.values()) if roster else set()
+        former = set().union(*live.groups.values()) if live.groups else set()
+        plan += [Action('delete_user', email) for email in sorted(former - enrolled)]
+    return plan
+
+
+def format_plan(plan: list[Action]) -> str:
+    if not plan:
+        return "The workspace matches the roster. Nothing to do."
+    counts = {}
+    for a in plan:
+        counts[a.kind] = counts.get(a.kind, 0) + 1
+    lines = [str(a) for a in plan]
+    lines.append("total: " + ", ".join(f"{k}={v}" for k, v in counts.items()))
+    return "\n".join(lines)
+
+
+def _raise_for_status_unless_exists(response: requests.Response):
+    if response.status_code != 409:
+        response.raise_for_status()
+
+
+def apply_plan(plan: list[Action], groups_api: DataBricksGroups, cluster_api: DataBricksClusterOps,
+               policy_id: str, logger, live: LiveState | None = None, max_workers: int = 8) -> list:
+    """
+    Apply the plan phase by phase. Actions in the same phase run concurrently.
+    :return: list of (action, error or None)
+    """
+    def apply(a: Action):
+        if a.kind == 'create_user':
+            if groups_api.create_users([a.target]) != 1:
+                raise RuntimeError(f"user {a.target} was not created")
+        elif a.kind == 'create_group':
+            _raise_for_status_unless_exists(groups_api.create_group(a.target))
+        elif a.kind == 'add_to_master':
+            _raise_for_status_unless_exists(groups_api.add_member_to_group(a.target, a.group, is_user=False))
+        elif a.kind == 'add_member':
+            _raise_for_status_unless_exists(groups_api.add_member_to_group(a.target, a.group, is_user=True))
+        elif a.kind == 'remove_member':
+            groups_api.remove_member_from_group(a.target, a.group, is_user=True).raise_for_status()
+        elif a.kind == 'create_cluster':
+            created = cluster_api.create_cluster(a.target, policy_id=policy_id)  # this also starts it
+            cluster_api.terminate_cluster(created['cluster_id'])  # turn the cluster OFF
+        elif a.kind == 'set_permission':
+            cluster_id = cluster_api.cluster_from_name(a.target)['cluster_id']
+            cluster_api.set_cluster_permission(cluster_id, group_name=a.group,
+                                               permission=cluster_api.ClusterPermission.RESTART)
+        elif a.kind == 'delete_user':
+            user_id = (live.users if live else {}).get(a.target)
+            if user_id is None:
+                raise KeyError(f"no SCIM id for {a.target}")
+            groups_api.delete_users([user_id])
+        else:
+            raise ValueError(f"unknown action {a.kind}")
+
+    results = []
+    for phase in PHASES:
+        actions = [a for a in plan if a.kind in phase]
+        if not actions:
+            continue
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(actions))) as executor:
+            futures = {executor.submit(apply, a): a for a in actions}
+            for future in concurrent.futures.as_completed(futures):
+                a = futures[future]
+                try:
+                    future.result()
+                    results.append((a, None))
+                    logger.info(f"done: {a}")
+                except (requests.RequestException, KeyError, RuntimeError, AttributeError) as ex:
+                    results.append((a, ex))
+                    logger.error(f"failed: {a}: {ex}")
+    return results
@@ -0,0 +1,225 @@
+"""
+Retry, backoff and circuit breaker for the Databricks REST calls.
+
+* Idempotent calls (GET/PUT/DELETE and the POST endpoints listed in IDEMPOTENT_POSTS)
+  are retried on 5xx, 429 and connection errors, with jittered exponential backoff.
+* Non-idempotent calls (e.g. clusters/create) are retried only when the request was surely
+  not processed: 429 or a failure to connect.
+* A Retry-After header is honored (up to RetryPolicy.max_retry_after).
+* Each endpoint has a circuit breaker. After 'failure_threshold' consecutive failures it opens,
+  and calls fail fast with CircuitOpenError until 'reset_timeout' passes. Then one trial call is let through.
+
+CircuitOpenError is a requests.RequestException, so existing error handling keeps working.
+
+The databricks_cli calls go through cli_call(), with a client from cli_api_client(): the session of a plain
+ApiClient retries 429 by itself (6 times), which would multiply the attempts of call_with_retry().
+"""
+import email.utils
+import logging
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+import requests
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+IDEMPOTENT_POSTS = {
+    '/api/2.0/clusters/edit',
+    '/api/2.0/clusters/pin',
+    '/api/2.0/clusters/unpin',
+    '/api/2.0/clusters/delete',  # terminate
+    '/api/2.0/clusters/permanent-delete',
+    '/api/2.0/libraries/install',
+    '/api/2.0/groups/add-member',
+    '/api/2.0/groups/remove-member',
+    '/api/2.0/workspace/mkdirs',
+}
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """The endpoint failed too many times recently. The call was not sent."""
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+    max_retry_after: float = 20.0
+
+    def delay(self, attempt: int, retry_after: float | None = None) -> float:
+        """:param attempt: 1 for the first retry"""
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # half open: let one call through. If it fails, the breaker opens again.
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+DEFAULT_POLICY = RetryPolicy()
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def endpoint_of(url: str) -> tuple[str, str]:
+    """:return: (host, path) with the object IDs replaced by '*', e.g. ('adb-1.2.net', '/api/2.0/permissions/clusters/*')"""
+    parsed = urlparse(url)
+    segments = [re.sub(r'^(\d+|\d{4}-\d{6}-\w+)$', '*', s) for s in parsed.path.split('/')]
+    return parsed.netloc, '/'.join(segments)
+
+
+def breaker_for(host: str, endpoint: str) -> CircuitBreaker:
+    with _breakers_lock:
+        return _breakers.setdefault((host, endpoint), CircuitBreaker())
+
+
+def is_idempotent(method: str, path: str) -> bool:
+    method = method.upper()
+    return method in ('GET', 'HEAD', 'PUT', 'DELETE') or (method == 'POST' and path in IDEMPOTENT_POSTS)
+
+
+def retry_after_seconds(response: requests.Response | None) -> float | None:
+    """Parse the Retry-After header (seconds or HTTP date)"""
+    if response is None:
+        return None
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def resilient_request(method: str, url: str, idempotent: bool | None = None,
+                      policy: RetryPolicy = DEFAULT_POLICY, **kwargs) -> requests.Response:
+    """
+    Drop-in replacement of requests.request() with retries and a circuit breaker.
+    Like requests.request(), the final response is returned even if it is an error response.
+    """
+    host, path = endpoint_of(url)
+    if idempotent is None:
+        idempotent = is_idempotent(method, path)
+    breaker = breaker_for(host, path)
+
+    for attempt in range(1, policy.max_attempts + 1):
+        if not breaker.allow():
+            raise CircuitOpenError(f"circuit open for {method} {path}: the workspace is failing, not sending")
+        last_attempt = attempt == policy.max_attempts
+        if attempt > 1 and hasattr(kwargs.get('data'), 'seek'):
+            kwargs['data'].seek(0)  # a streamed body was consumed by the previous attempt
+        try:
+            response = requests.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as ex:
+            breaker.record_failure()
+            # only a connect timeout guarantees the server did not get the request
+            maybe_processed = not isinstance(ex, requests.exceptions.ConnectTimeout)
+            if last_attempt or (maybe_processed and not idempotent):
+                raise
+            delay = policy.delay(attempt)
+            logging.warning(f"{method} {path} failed ({ex}). retry {attempt} in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        retry = response.status_code in RETRYABLE_STATUS and (idempotent or response.status_code == 429)
+        if not retry or last_attempt:
+            return response
+        delay = policy.delay(attempt, retry_after_seconds(response))
+        logging.warning(f"{method} {path} returned {response.status_code}. retry {attempt} in {delay:.1f}s")
+        time.sleep(delay)
+    raise AssertionError("not reached")
+
+
+def call_with_retry(func, endpoint: str, host: str = '', idempotent: bool = True,
+                    policy: RetryPolicy = DEFAULT_POLICY):
+    """
+    Run func() (e.g. a databricks_cli API call, which raises requests.HTTPError) with the same
+    retry and circuit breaker rules as resilient_request().
+    :param endpoint: name of the circuit breaker, e.g. '/api/2.0/clusters/list'
+    """
+    breaker = breaker_for(urlparse(host).netloc or host, endpoint)
+    for attempt in range(1, policy.max_attempts + 1):
+        if not breaker.allow():
+            raise CircuitOpenError(f"circuit open for {endpoint}: the workspace is failing, not sending")
+        last_attempt = attempt == policy.max_attempts
+        try:
+            result = func()
+        except requests.exceptions.HTTPError as ex:
+            status = ex.response.status_code if ex.response is not None else 0
+            if status >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            if status not in RETRYABLE_STATUS or not (idempotent or status == 429) or last_attempt:
+                raise
+            delay = policy.delay(attempt, retry_after_seconds(ex.response))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as ex:
+            breaker.record_failure()
+            maybe_processed = not isinstance(ex, requests.exceptions.ConnectTimeout)
+            if last_attempt or (maybe_processed and not idempotent):
+                raise
+            delay = policy.delay(attempt)
+        else:
+            breaker.record_success()
+            return result
+        logging.warning(f"{endpoint} failed. retry {attempt} in {delay:.1f}s")
+        time.sleep(delay)
+    raise AssertionError("not reached")
+
+
+def cli_api_client(host: str, token: str):
+    """:return: a databricks_cli ApiClient whose session does not retry (call_with_retry() does)"""
+    from databricks_cli.sdk.api_client import ApiClient, TlsV1HttpAdapter
+
+    client = ApiClient(host=host, token=token)
+    client.session.mount('https://', TlsV1HttpAdapter(max_retries=0))
+    return client
+
+
+def cli_call(host: str, endpoint: str, func, idempotent: bool = True):
+    """
+    Run a databricks_cli call with retries and a per-endpoint circuit breaker.
+    :param endpoint: the API path after /api/2.0/, e.g. 'clusters/list'
+    """
+    return call_with_retry(func, '/api/2.0/' + endpoint, host=host, idempotent=idempotent)
@@ -0,0 +1,132 @@
+"""
+Cluster metadata cache, shared by all the processes on this host.
+
+The list of clusters is kept in a JSON file (one file per workspace), so frequent CLI calls
+do not re-list the whole fleet. Entries expire after a TTL, and single clusters can be
+marked stale (after a mutating call) and refreshed individually with clusters/get.
+
+Writers replace the file atomically; read-modify-write is serialized with a lock file.
+
+env vars:
+    DATABRICKS_CLUSTER_CACHE_TTL   seconds, default 60. 0 disables the cache.
+    DATABRICKS_CLUSTER_CACHE_DIR   default ~/.cache/iem_teachinglab
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # fcntl does not exist on Windows. The cache still works, without cross-process locking.
+    fcntl = None
+
+DEFAULT_TTL_SECONDS = 60.0
+
+
+class ClusterCache:
+
+    def __init__(self, host: str, ttl_seconds: float | None = None, cache_dir: str | None = None):
+        if ttl_seconds is None:
+            ttl_seconds = float(os.getenv('DATABRICKS_CLUSTER_CACHE_TTL', DEFAULT_TTL_SECONDS))
+        self.ttl_seconds = ttl_seconds
+        cache_dir = cache_dir or os.getenv('DATABRICKS_CLUSTER_CACHE_DIR')
+        directory = Path(cache_dir).expanduser() if cache_dir else Path.home() / ".cache" / "iem_teachinglab"
+        digest = hashlib.sha1(host.encode()).hexdigest()[:12]
+        self.path = directory / f"clusters_{digest}.json"
+
+    @contextmanager
+    def _locked(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        with open(str(self.path) + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self) -> dict | None:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as ex:
+            logging.warning(f"ignoring unreadable cluster cache {self.path}: {ex}")
+            return None
+
+    def _write(self, state: dict):
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+    def read(self, max_age: float | None = None) -> dict | None:
+        """
+        :param max_age: seconds. None means the configured TTL. 0 means "do not use the cache".
+        :return: {'fetched_at': float, 'clusters': {id: cluster}, 'stale': [id,...]} or None if expired/missing
+        """
+        max_age = self.ttl_seconds if max_age is None else max_age
+        if max_age <= 0:
+            return None
+        state = self._read()
+        if state is None or time.time() - state.get('fetched_at', 0) > max_age:
+            return None
+        return state
+
+    def store_all(self, clusters: list[dict]):
+        """Replace the cache with a full listing"""
+        if self.ttl_seconds <= 0:
+            return
+        with self._locked():
+            self._write({'fetched_at': time.time(),
+                         'clusters': {c['cluster_id']: c for c in clusters},
+                         'stale': []})
+
+    def update_one(self, cluster: dict):
+        """Store a fresh copy of a single cluster (e.g. from clusters/get). Does not extend the TTL."""
+        cluster_id = cluster['cluster_id']
+
+        def _update(state):
+            state['clusters'][cluster_id] = cluster
+            if cluster_id in state['stale']:
+                state['stale'].remove(cluster_id)
+        self._modify(_update)
+
+    def mark_stale(self, cluster_id: str):
+        """The cluster was changed: refresh it before the next use."""
+        def _mark(state):
+            if cluster_id not in state['stale']:
+                state['stale'].append(cluster_id)
+        self._modify(_mark)
+
+    def forget(self, cluster_id: str):
+        """The cluster no longer exists"""
+        def _forget(state):
+            state['clusters'].pop(cluster_id, None)
+            if cluster_id in state['stale']:
+                state['stale'].remove(cluster_id)
+        self._modify(_forget)
+
+    def invalidate(self):
+        """Drop everything. The next get_clusters() will re-list the fleet."""
+        with self._locked():
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def _modify(self, func):
+        with self._locked():
+            state = self._read()
+            if state is None:
+                return  # nothing cached, so nothing can be stale
+            func(state)
+            self._write(state)
@@ -0,0 +1,167 @@
+"""
+Load test of the email path (outbox + transport) against a local SMTP sink, without touching the real service.
+
+A sink is started with aiosmtpd (pip install aiosmtpd), unless --smtp HOST:PORT points to a running one.
+For each configuration, N notices are queued in a temporary outbox, like a poll that warns many clusters,
+then the REAL OutboxSender sends them through an SmtpTransport. Reported: the enqueue time seen by the
+producer, the throughput, the send latency percentiles, the SMTP connections opened and the admin digests.
+
+usage:
+    python -m databricks.resource_manager.mail_load_test --messages 500 --workers 1 4 8 --connections 4
+    python -m databricks.resource_manager.mail_load_test --messages 200 --workers 4 --no-reuse --sink-delay 0.05
+"""
+import logging
+import socket
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from peewee import SqliteDatabase
+
+from ..database.db_operations import OutboxMessage
+from .mail_outbox import OutboxSender, enqueue_email
+from .user_mail import MailTransport, SmtpTransport
+
+ADMIN = "admin@load.test"
+
+
+@dataclass
+class LoadResult:
+    label: str
+    messages: int
+    workers: int
+    enqueue_seconds: float = 0.0
+    send_seconds: float = 0.0
+    latencies: list = field(default_factory=list)     # seconds, one per send
+    connections_opened: int | None = None
+    digests: int = 0
+    failed: int = 0
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run(transport: MailTransport, messages: int, workers: int, admin_cc: bool = True, label: str = '') -> LoadResult:
+    """Queue `messages` notices in a fresh outbox and send them all with `workers` concurrent sends"""
+    result = LoadResult(label or transport.name, messages, workers)
+    lock = threading.Lock()
+
+    def timed_send(subject, body_html, to, cc):
+        start = time.perf_counter()
+        try:
+            return transport.send(subject, body_html, to, cc)
+        finally:
+            with lock:
+                result.latencies.append(time.perf_counter() - start)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SqliteDatabase(str(Path(tmp) / "outbox.db"), pragmas={'journal_mode': 'wal'})
+        OutboxMessage.bind(db)
+        try:
+            db.create_tables([OutboxMessage])
+            start = time.perf_counter()
+            for i in range(messages):
+                enqueue_email(f"'cluster_{i % 99 + 1:02}' is working for a long time",
+                              f"<p>Your cluster is used for 3h{i % 60:02}m during the last day.</p>",
+                              [f"student{i}@load.test"], cc=[ADMIN] if admin_cc else [])
+            result.enqueue_seconds = time.perf_counter() - start
+
+            sender = OutboxSender(send=timed_send, max_workers=workers, max_attempts=1)
+            start = time.perf_counter()
+            summary = sender.send_pending()
+            result.send_seconds = time.perf_counter() - start
+            result.failed = summary['failed']
+            result.digests = OutboxMessage.select().where(OutboxMessage.subject.startswith("Digest:")).count()
+        finally:
+            db.close()
+            OutboxMessage.bind(None)
+    result.connections_opened = getattr(transport, 'connections_opened', None)
+    return result
+
+
+def format_results(results: list[LoadResult]) -> str:
+    from tabulate import tabulate
+
+    rows = []
+    for r in results:
+        sent = len(r.latencies)
+        rows.append([r.label, r.messages, r.workers, f"{1000 * r.enqueue_seconds / max(r.messages, 1):.2f}",
+                     f"{r.send_seconds:.2f}", f"{sent / r.send_seconds:.0f}" if r.send_seconds else "-",
+                     f"{1000 * percentile(r.latencies, 0.5):.1f}", f"{1000 * percentile(r.latencies, 0.95):.1f}",
+                     f"{1000 * max(r.latencies, default=0):.1f}",
+                     r.connections_opened if r.connections_opened is not None else "-", r.digests, r.failed])
+    return tabulate(rows, headers=["transport", "messages", "workers", "enqueue/msg [ms]", "send [s]", "msg/s",
+                                   "p50 [ms]", "p95 [ms]", "max [ms]", "connections", "digests", "failed"],
+                    tablefmt="github")
+
+
+class SinkHandler:
+    """aiosmtpd handler: count the messages, optionally answer slowly like a remote service"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        import asyncio
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received += 1
+        return '250 Message accepted for delivery'
+
+
+def start_sink(delay: float = 0.0):
+    """:return: (controller, handler, port) of a local aiosmtpd sink. Call controller.stop() when done"""
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        raise SystemExit("aiosmtpd is not installed: pip install aiosmtpd, or use --smtp HOST:PORT")
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    handler = SinkHandler(delay)
+    controller = Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    return controller, handler, port
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load test the email outbox against a local SMTP sink")
+    parser.add_argument("--messages", type=int, default=200, help="number of notices queued per run")
+    parser.add_argument("--workers", type=int, nargs='+', default=[1, 4], help="concurrent sends (one run per value)")
+    parser.add_argument("--connections", type=int, default=4, help="size of the SMTP connection pool")
+    parser.add_argument("--no-reuse", action="store_true", default=False, help="open a new SMTP connection per message")
+    parser.add_argument("--no-cc", action="store_true", default=False, help="do not CC the admin (no digest)")
+    parser.add_argument("--sink-delay", type=float, default=0.0, help="seconds the local sink waits before accepting")
+    parser.add_argument("--smtp", type=str, help="HOST:PORT of an existing SMTP sink instead of starting one")
+    args = parser.parse_args()
+
+    logging.getLogger('MAIL_OUTBOX').setLevel(logging.WARNING)
+    controller = handler = None
+    if args.smtp:
+        host, port = args.smtp.rsplit(':', 1)
+    else:
+        controller, handler, port = start_sink(args.sink_delay)
+        host = '127.0.0.1'
+    try:
+        results = []
+        for workers in args.workers:
+            transport = SmtpTransport(host, int(port), sender="poll@load.test", connections=args.connections,
+                                      reuse=not args.no_reuse)
+            label = f"smtp pool={args.connections}" + (" no-reuse" if args.no_reuse else "")
+            results.append(run(transport, args.messages, workers, admin_cc=not args.no_cc, label=label))
+            transport.close()
+        print(format_results(results))
+        if handler:
+            print(f"the sink received {handler.received} messages")
+    finally:
+        if controller:
+            controller.stop()
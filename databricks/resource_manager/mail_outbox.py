@@ -0,0 +1,187 @@
+"""
+Outbox of email messages, kept in the uptime DB (OutboxMessage).
+
+Producers call enqueue_email(): it only inserts a row, so a slow mail service never delays them.
+An OutboxSender delivers the pending messages:
+ - all the messages go through the same transport (one shared client), at most max_workers at a time
+ - a failed send is retried on a later pass (exponential backoff). After max_attempts the message is 'failed'
+ - when several pending messages are CC'ed to the same address (the admin), that address gets one digest
+   instead of a copy of each message
+
+    sender = OutboxSender(logger=logger).start()
+    enqueue_email("subject", "<p>body</p>", ["student@x.com"])
+    ...
+    sender.stop(timeout=60)   # what is not sent by then stays in the outbox for the next run
+
+Delivery is at least once: a message that was being sent when the process exited is sent again.
+"""
+import concurrent.futures
+import datetime
+import html
+import logging
+import os
+import threading
+
+from ..database.db_operations import OutboxMessage
+from . import user_mail
+
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 3600
+
+# set by enqueue_email() to wake up the background sender
+_wakeup = threading.Event()
+
+
+def _split(addresses: str) -> list[str]:
+    return [a for a in addresses.split(',') if a]
+
+
+def enqueue_email(subject: str, body: str, recipients: list[str], logger=None, cc: list[str] | None = None) -> int | None:
+    """
+    Queue a message. The arguments are those of user_mail.send_emails(): the admin (ADMIN_EMAIL) is CC'ed by default.
+    :return: the id of the message in the outbox. None if it has no recipient at all
+    """
+    if cc is None:
+        admin = os.getenv('ADMIN_EMAIL')
+        cc = [admin] if admin else []
+    recipients = [r for r in recipients if r]
+    if not recipients and not cc:
+        logging.error(f"email '{subject}' has no recipients. Not sent")
+        return None
+    message = OutboxMessage.create(subject=subject, body_html=body, recipients=','.join(recipients), cc=','.join(cc))
+    if logger:
+        logger.info(f"queued email {message.id} '{subject}' to {recipients}")
+    _wakeup.set()
+    return message.id
+
+
+def coalesce_cc() -> list[OutboxMessage]:
+    """
+    Replace the CC of pending messages that share a CC address with one digest message to that address.
+    Messages whose only recipient is the CC are left alone.
+    :return: the digest messages created
+    """
+    candidates = list(OutboxMessage.select().where((OutboxMessage.status == OutboxMessage.PENDING) &
+                                                   (OutboxMessage.cc != '') & (OutboxMessage.recipients != ''))
+                      .order_by(OutboxMessage.id))
+    by_address = {}
+    for m in candidates:
+        for address in _split(m.cc):
+            by_address.setdefault(address, []).append(m)
+
+    digests = []
+    for address, messages in by_address.items():
+        if len(messages) < 2:
+            continue
+        parts = [f"<p>{len(messages)} messages were queued for sending:</p>"]
+        for m in messages:
+            parts.append(f"<hr><p><b>{html.escape(m.subject)}</b><br>"
+                         f"To: {html.escape(', '.join(_split(m.recipients)))}<br>"
+                         f"Queued: {m.created:%Y-%m-%d %H:%M}</p>{m.body_html}")
+        digest = OutboxMessage.create(subject=f"Digest: {len(messages)} notices", body_html="\n".join(parts),
+                                      recipients=address, cc='')
+        for m in messages:
+            m.cc = ','.join(a for a in _split(m.cc) if a != address)
+            m.digest = digest
+            m.save()
+        digests.append(digest)
+    return digests
+
+
+class OutboxSender:
+    """Deliver the outbox, on demand (send_pending) or from a background thread (start/stop)"""
+
+    def __init__(self, send=None, max_workers: int = 4, max_attempts: int = 5, logger: logging.Logger | None = None):
+        """
+        :param send: send(subject, body_html, to, cc) raising on failure. Default: user_mail.send_message
+        """
+        self.send = send or user_mail.send_message
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.logger = logger or logging.getLogger('MAIL_OUTBOX')
+        self._stop = threading.Event()
+        self._thread = None
+
+    def send_pending(self) -> dict:
+        """
+        Send the messages that are due now.
+        :return: dict { 'sent': n, 'retry': n, 'failed': n }
+        """
+        with OutboxMessage._meta.database.atomic():
+            coalesce_cc()
+        now = datetime.datetime.now()
+        batch = list(OutboxMessage.select().where((OutboxMessage.status == OutboxMessage.PENDING) &
+                                                  (OutboxMessage.next_attempt <= now)).order_by(OutboxMessage.id))
+        summary = {'sent': 0, 'retry': 0, 'failed': 0}
+        if not batch:
+            return summary
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_workers, len(batch))) as executor:
+            futures = {executor.submit(self.send, m.subject, m.body_html, _split(m.recipients), _split(m.cc)): m
+                       for m in batch}
+            # the DB is updated from this thread only
+            for future in concurrent.futures.as_completed(futures):
+                m = futures[future]
+                m.attempts += 1
+                try:
+                    future.result()
+                except Exception as ex:
+                    m.last_error = str(ex)
+                    if m.attempts >= self.max_attempts:
+                        m.status = OutboxMessage.FAILED
+                        summary['failed'] += 1
+                        self.logger.error(f"email {m.id} '{m.subject}' failed {m.attempts} times, giving up: {ex}")
+                    else:
+                        delay = min(RETRY_BASE_SECONDS * 2 ** (m.attempts - 1), RETRY_MAX_SECONDS)
+                        m.next_attempt = datetime.datetime.now() + datetime.timedelta(seconds=delay)
+                        summary['retry'] += 1
+                        self.logger.warning(f"email {m.id} '{m.subject}' failed, retry in {delay}s: {ex}")
+                else:
+                    m.status = OutboxMessage.SENT
+                    m.sent_time = datetime.datetime.now()
+                    summary['sent'] += 1
+                m.save()
+        self.logger.info(f"outbox: {summary}")
+        return summary
+
+    def _pass(self):
+        try:
+            self.send_pending()
+        except Exception as ex:
+            self.logger.error(f"outbox pass failed: {ex}")
+
+    def _run(self, interval: float, linger: float):
+        try:
+            while not self._stop.is_set():
+                if _wakeup.wait(interval):
+                    self._stop.wait(linger)  # let the notices of the same poll pile up, to digest their CC
+                _wakeup.clear()
+                self._pass()
+            self._pass()  # what was queued until stop()
+        finally:
+            OutboxMessage._meta.database.close()  # the connection of this thread
+
+    def start(self, interval: float = 5.0, linger: float = 1.0):
+        """
+        Send in a background thread: linger seconds after enqueue_email(), and every interval seconds for the retries
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval, linger), name='mail-outbox', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float | None = None) -> int:
+        """
+        Send what is queued, then stop the background thread. Waits at most timeout seconds.
+        :return: the number of messages still pending
+        """
+        self._stop.set()
+        _wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                self.logger.warning(f"the mail service is slow: stopped waiting after {timeout}s")
+        pending = OutboxMessage.select().where(OutboxMessage.status == OutboxMessage.PENDING).count()
+        if pending:
+            self.logger.info(f"{pending} emails are left in the outbox for the next run")
+        return pending
@@ -1,117 +1,81 @@
 import logging
-import re
 import concurrent.futures
 import time
 from ..DataBricksClusterOps import DataBricksClusterOps
 from ..DataBricksGroups import DataBricksGroups
+from ..restore_cluster_permissions import direct_permission_level
+from ..roster_index import STUDENT_CLUSTER_RE, group_for_cluster, members_of_group
+
+
+def _cluster_owners(clusters: list[dict], groups_api: DataBricksGroups) -> dict:
+    """
+    :return: dict {cluster_id -> (group name, [user emails])}, from the roster index (read from this thread).
+    Only the members of a group that the index does not know need a remote call.
+    """
+    owners = {}
+    for c in clusters:
+        group_name = group_for_cluster(c['cluster_name'], c['cluster_id'])
+        if group_name:
+            users = members_of_group(group_name)
+            if users is None:
+                users = [u['user_name'] for u in groups_api.get_group_members(group_name)]
+            owners[c['cluster_id']] = (group_name, users)
+    return owners
+
+
+def _cluster_allocation(cluster: dict, owner: tuple | None, cluster_api: DataBricksClusterOps) -> list:
+    """:return: [cluster name, group name, permission, [user names]] of one cluster"""
+    if not owner:
+        return [cluster['cluster_name'], '', '', []]
+    group_name, users = owner
+    # {"object_id":"/clusters/0626-112719-jy3n8ws2", "object_type":"cluster",
+    #  "access_control_list":
+    #   [ {"group_name":"admins",
+    #      "all_permissions":[{"permission_level":"CAN_MANAGE", "inherited":true, "inherited_from_object":["/clusters/"]}]},
+    #     {"group_name":"g13","all_permissions":[{"permission_level":"CAN_RESTART","inherited":false}]}]}
+    permission = direct_permission_level(cluster_api.get_cluster_permission(cluster['cluster_id']), group_name) or ''
+    return [cluster['cluster_name'], group_name, permission, [u[: u.find('@')] for u in users]]
+
+
+def _cluster_order(line: list):
+    """student clusters by number, then the others by name"""
+    match = STUDENT_CLUSTER_RE.match(line[0])
+    return (0, int(match.group(1)), '') if match else (1, 0, line[0])
 
 
 def print_user_allocation_clusters(groups_api: DataBricksGroups, cluster_api: DataBricksClusterOps, logger: logging.Logger):
     """ print a table  sorted by cluster name:
     [
-    [ cluster name, group name, [user_emails,...] ]
+    [ cluster name, group name, permission, [user names] ]
      ...
     ]
     """
 
     # As long as the API request is done using sync client, I can not use asyncio.
     # fallback to threadpool
-
-    def get_data_from_cluster(cluster: dict):
-        permissions = cluster_api.get_cluster_permission(cluster['cluster_id'])
-        perms = []
-        for g in permissions['access_control_list']:
-            try:
-                perms.append({'group_name': g['group_name'], 'permission': g['all_permissions'][0]['permission_level']})
-            except KeyError as ex:
-                logger.warning(f"Skipping permissions of user without a group in cluster {c['cluster_name']}")
-
-        matcher = re.compile(r"^g[\d]{1,2}")
-        user_groups = list(filter(lambda x: matcher.match(x['group_name']), perms))
-        if user_groups:
-            user_names = groups_api.get_group_members(user_groups[0]['group_name'])
-        else:
-            user_names = []
-        return {'cluster_id': cluster['cluster_id'], 'cluster_name': cluster['cluster_name'],'groups': user_groups, 'users': user_names}
-
     clusters = cluster_api.get_clusters()
+    if not clusters:
+        return
     start = time.time()
+    owners = _cluster_owners(clusters, groups_api)
     with concurrent.futures.ThreadPoolExecutor(max_workers=min(100, len(clusters))) as executor:
-        futures = [executor.submit(get_data_from_cluster, value) for value in clusters]
-        results = [future.result() for future in concurrent.futures.as_completed(futures)]
+        futures = [executor.submit(_cluster_allocation, c, owners.get(c['cluster_id']), cluster_api) for c in clusters]
+        f = [future.result() for future in concurrent.futures.as_completed(futures)]
 
     delta = time.time() - start
     logger.info(f"collecting info from {len(clusters)} clusters took {delta:.2} Seconds")
 
-    # now that we have all the info, print it as we want
-    f = []
-    for v in results:
-        try:
-            cluster_name = v['cluster_name']
-            gname = v['groups'][0]['group_name']
-            permission = v['groups'][0]['permission']
-            users = [u['user_name'] for u in v['users']]
-            clipped = [x[: x.find('@')] for x in users]
-        except (KeyError, IndexError):
-            gname = permission = ''
-            clipped = []
-        finally:
-            f.append([cluster_name, gname, permission, clipped]
-                     )
-    f.sort(key=lambda x: int(x[0][8:]))  # drop the "cluster_" prefix
+    f.sort(key=_cluster_order)
     for line in f:
         print(f"{line[0]},\t{line[1]:4}, {line[2]},\t {' : '.join(line[3])}")
 
 
 def print_user_allocation_clusters_sync(groups_api: DataBricksGroups,  # noqa: VUL
-                                        cluster_api: DataBricksClusterOps, logger: logging.Logger): 
+                                        cluster_api: DataBricksClusterOps, logger: logging.Logger):
     "sync version . Each API call is about 4.5 seconds. 4.5 * len(clusters) == a long time"
-    res = {}
     clusters = cluster_api.get_clusters()
-    for c in clusters:
-        permissions = cluster_api.get_cluster_permission(c['cluster_id'])
-        # {
-        # "object_id":"/clusters/0626-112719-jy3n8ws2",
-        # "object_type":"cluster",
-        # "access_control_list":
-        #   [  {"group_name":"admins",
-        #       "all_permissions":[
-        #           {"permission_level":"CAN_MANAGE",
-        #            "inherited":true,
-        #            "inherited_from_object":["/clusters/"]}]
-        #        },
-        #       {"group_name":"g13","all_permissions":[{"permission_level":"CAN_RESTART","inherited":false}]}]}'
-
-        # for each cluster, get some info
-        perms = []
-        for g in permissions['access_control_list']:
-            try:
-                perms.append({'group_name': g['group_name'], 'permission': g['all_permissions'][0]['permission_level']} )
-            except KeyError as ex:
-                logger.warning(f"Skipping permissions of user without a group in cluster {c['cluster_name']}")
-
-        matcher = re.compile(r"^g[\d]{1,2}")
-        user_groups = list(filter(lambda x: matcher.match(x['group_name']), perms))
-        if user_groups:
-            user_names = groups_api.get_group_members(user_groups[0]['group_name'])
-        else:
-            user_names = []
-        res[c['cluster_name']] = { 'groups':user_groups, 'users': user_names}
-
-    # now that we have all the info, print it as we want
-    f = []
-    for k, v in res.items():
-        try:
-            gname = v['groups'][0]['group_name']
-            permission = v['groups'][0]['permission']
-            users = [u['user_name'] for u in v['users']]
-            clipped = [x[: x.find('@')] for x in users]
-        except (KeyError, IndexError):
-            gname = permission = ''
-            clipped = []
-        finally:
-            f.append([k, gname, permission, clipped]
-                     )
-    f.sort(key=lambda x: int(x[0][8:]))  # drop the "cluster_" prefix
+    owners = _cluster_owners(clusters, groups_api)
+    f = [_cluster_allocation(c, owners.get(c['cluster_id']), cluster_api) for c in clusters]
+    f.sort(key=_cluster_order)
     for line in f:
         print(f"{line[0]},\t{line[1]},\t, {line[2]},\t {' : '.join(line[3])}")
@@ -0,0 +1,273 @@
+"""
+Semester-scale simulator for the uptime accounting.
+
+The accounting in update_cumulative_uptime() is delta based (restart detection,
+last_poll_time bookmarks, midnight reset by log_daily_uptime()), so its accuracy
+depends on the poll interval and on the usage pattern.
+
+This module generates synthetic on/off/restart sessions for many clusters,
+then drives the REAL poll code (update_cluster_info + check_update_running_clusters)
+and the REAL end-of-day code (log_daily_uptime) under a virtual clock, and compares
+the daily usage written to ClusterCumulativeUptime with the ground truth.
+
+Quota enforcement (emails, termination) is not simulated - only the accounting.
+
+usage:
+    python -m databricks.resource_manager.usage_simulator --clusters 200 --days 98 --poll-interval 5 15 30
+"""
+import datetime as _dt
+import logging
+import random
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from peewee import SqliteDatabase
+
+from . import cluster_uptime
+from .. import end_of_day_operations
+from ..database.db_operations import ClusterCumulativeUptime, MODELS
+from ..poll_clusters import update_cluster_info, check_update_running_clusters
+
+
+class VirtualClock:
+    """A settable 'now' shared by the patched datetime/date classes."""
+
+    def __init__(self, now: _dt.datetime):
+        self.now = now
+
+
+@contextmanager
+def virtual_time(clock: VirtualClock):
+    """Make datetime.now() / date.today() in the accounting modules return the virtual clock."""
+
+    class _VirtualDatetime(_dt.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return clock.now
+
+        @classmethod
+        def fromtimestamp(cls, t, tz=None):
+            # return the base class: sqlite3 has no adapter for subclasses
+            return _dt.datetime.fromtimestamp(t, tz)
+
+    class _VirtualDate(_dt.date):
+        @classmethod
+        def today(cls):
+            return clock.now.date()
+
+    saved = (cluster_uptime.datetime, end_of_day_operations.date)
+    cluster_uptime.datetime = _VirtualDatetime
+    end_of_day_operations.date = _VirtualDate
+    try:
+        yield clock
+    finally:
+        cluster_uptime.datetime, end_of_day_operations.date = saved
+
+
+@dataclass
+class DayStats:
+    day: _dt.date
+    truth_seconds: float = 0.0
+    accounted_seconds: float = 0.0
+    polls: int = 0
+    cpu_seconds: float = 0.0
+    wall_seconds: float = 0.0
+
+    @property
+    def error_seconds(self) -> float:
+        return self.accounted_seconds - self.truth_seconds
+
+
+@dataclass
+class SimulationResult:
+    poll_interval: _dt.timedelta
+    days: list[DayStats] = field(default_factory=list)
+
+    @property
+    def truth_seconds(self) -> float:
+        return sum(d.truth_seconds for d in self.days)
+
+    @property
+    def accounted_seconds(self) -> float:
+        return sum(d.accounted_seconds for d in self.days)
+
+    @property
+    def abs_error_seconds(self) -> float:
+        """sum of the per-day absolute errors (over- and under-counting do not cancel out)"""
+        return sum(abs(d.error_seconds) for d in self.days)
+
+
+def generate_schedule(num_clusters: int, first_day: _dt.date, num_days: int, seed: int = 0,
+                      usage_probability: float = 0.4, restart_probability: float = 0.15) -> dict:
+    """
+    Create synthetic usage.
+    :return: dict { cluster_id -> sorted list of (start, end) driver sessions }
+    Two sessions separated by a short gap (or none) model a cluster restart.
+    Sessions may cross midnight, but not the end of the simulated period.
+    """
+    rnd = random.Random(seed)
+    period_end = _dt.datetime.combine(first_day + _dt.timedelta(days=num_days), _dt.time())
+    schedule = {}
+    for n in range(num_clusters):
+        sessions = []
+        for d in range(num_days):
+            if rnd.random() > usage_probability:
+                continue
+            day_start = _dt.datetime.combine(first_day + _dt.timedelta(days=d), _dt.time())
+            # students work mostly in the afternoon and evening
+            t = day_start + _dt.timedelta(minutes=rnd.randint(8 * 60, 23 * 60 + 50))
+            if sessions and t < sessions[-1][1]:
+                continue
+            for _ in range(rnd.randint(1, 3)):
+                end = min(t + _dt.timedelta(minutes=rnd.randint(10, 180)), period_end)
+                if end <= t:
+                    break
+                sessions.append((t, end))
+                if rnd.random() < restart_probability:
+                    t = end + _dt.timedelta(seconds=rnd.randint(0, 120))
+                else:
+                    t = end + _dt.timedelta(minutes=rnd.randint(20, 240))
+        schedule[f"{n:04}-000000-sim{n:05}"] = sessions
+    return schedule
+
+
+def ground_truth(schedule: dict, day: _dt.date) -> float:
+    """total seconds (all clusters) that the clusters were up during 'day'"""
+    day_start = _dt.datetime.combine(day, _dt.time())
+    day_end = day_start + _dt.timedelta(days=1)
+    total = 0.0
+    for sessions in schedule.values():
+        for start, end in sessions:
+            overlap = (min(end, day_end) - max(start, day_start)).total_seconds()
+            total += max(0.0, overlap)
+    return total
+
+
+def clusters_at(schedule: dict, names: dict, now: _dt.datetime) -> list[dict]:
+    """Mimic the clusters/list response at time 'now'. Running clusters have a 'driver'."""
+    clusters = []
+    for cluster_id, sessions in schedule.items():
+        cluster = {'cluster_id': cluster_id, 'cluster_name': names[cluster_id], 'state': 'TERMINATED'}
+        for start, end in sessions:
+            if start <= now < end:
+                cluster['state'] = 'RUNNING'
+                cluster['driver'] = {'start_timestamp': int(start.timestamp() * 1000)}
+                break
+        clusters.append(cluster)
+    return clusters
+
+
+def simulate(schedule: dict, first_day: _dt.date, num_days: int, poll_interval: _dt.timedelta,
+             end_of_day_offset: _dt.timedelta = _dt.timedelta(minutes=7),
+             db_instance: SqliteDatabase | None = None) -> SimulationResult:
+    """
+    Run the poll every 'poll_interval' and the end-of-day job every day at 'end_of_day_offset'
+    after midnight (as in the crontab), for 'num_days' days starting at 'first_day'.
+    The last day is logged by the end-of-day job that runs on the following day.
+    """
+    db_instance = db_instance or SqliteDatabase(':memory:')
+    names = {cid: f"cluster_{n + 1:02}" for n, cid in enumerate(schedule)}
+    result = SimulationResult(poll_interval=poll_interval)
+    stats = {}
+    for d in range(num_days):
+        day = first_day + _dt.timedelta(days=d)
+        stats[day] = DayStats(day=day, truth_seconds=ground_truth(schedule, day))
+
+    start = _dt.datetime.combine(first_day, _dt.time())
+    stop = start + _dt.timedelta(days=num_days) + end_of_day_offset
+    events = []
+    t = start
+    while t <= stop:
+        events.append((t, 0))
+        t += poll_interval
+    for d in range(1, num_days + 1):
+        events.append((start + _dt.timedelta(days=d) + end_of_day_offset, 1))
+    events.sort()
+
+    eod_logger = logging.getLogger('SIMULATOR')
+    for model in MODELS:
+        model.bind(db_instance)
+    logging.disable(logging.INFO)
+    clock = VirtualClock(start)
+    try:
+        with db_instance.connection_context(), virtual_time(clock):
+            db_instance.create_tables(MODELS)
+            for when, kind in events:
+                clock.now = when
+                # account the cost to the day being measured: the end-of-day job logs yesterday
+                day = (when - end_of_day_offset).date() if kind else when.date()
+                day_stats = stats.get(day)
+                clusters = clusters_at(schedule, names, when) if kind == 0 else None
+                cpu0, wall0 = time.process_time(), time.perf_counter()
+                if kind == 0:
+                    update_cluster_info(clusters)
+                    check_update_running_clusters(None, clusters)
+                else:
+                    end_of_day_operations.log_daily_uptime(db_instance, eod_logger)
+                if day_stats:
+                    day_stats.polls += kind == 0
+                    day_stats.cpu_seconds += time.process_time() - cpu0
+                    day_stats.wall_seconds += time.perf_counter() - wall0
+
+            for rec in ClusterCumulativeUptime.select():
+                if rec.date in stats:
+                    stats[rec.date].accounted_seconds += rec.daily_use_seconds
+            db_instance.drop_tables(MODELS)
+    finally:
+        logging.disable(logging.NOTSET)
+        for model in MODELS:
+            model.bind(None)
+
+    result.days = [stats[d] for d in sorted(stats)]
+    return result
+
+
+def format_report(results: list[SimulationResult], per_day: bool = False) -> str:
+    from tabulate import tabulate
+
+    lines = []
+    if per_day:
+        for r in results:
+            rows = [[d.day, f"{d.truth_seconds / 3600:.2f}", f"{d.accounted_seconds / 3600:.2f}",
+                     f"{d.error_seconds / 60:+.1f}", d.polls, f"{d.cpu_seconds * 1000:.1f}",
+                     f"{d.wall_seconds * 1000:.1f}"] for d in r.days]
+            lines.append(f"poll interval {r.poll_interval}")
+            lines.append(tabulate(rows, headers=["day", "truth [h]", "accounted [h]", "error [min]",
+                                                 "polls", "CPU [ms]", "wall [ms]"], tablefmt="github"))
+    rows = []
+    for r in results:
+        n = len(r.days) or 1
+        truth = r.truth_seconds or 1
+        rows.append([r.poll_interval, f"{r.truth_seconds / 3600:.1f}", f"{r.accounted_seconds / 3600:.1f}",
+                     f"{100 * (r.accounted_seconds - r.truth_seconds) / truth:+.2f}",
+                     f"{r.abs_error_seconds / 3600:.2f}",
+                     f"{1000 * sum(d.cpu_seconds for d in r.days) / n:.1f}",
+                     f"{1000 * sum(d.wall_seconds for d in r.days) / n:.1f}"])
+    lines.append(tabulate(rows, headers=["poll interval", "truth [h]", "accounted [h]", "net error [%]",
+                                         "abs daily error [h]", "CPU/day [ms]", "wall/day [ms]"],
+                          tablefmt="github"))
+    return "\n\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulate a semester of cluster usage and measure the uptime accounting")
+    parser.add_argument("--clusters", type=int, default=200, help="number of clusters")
+    parser.add_argument("--days", type=int, default=98, help="number of simulated days (a semester is 14 weeks)")
+    parser.add_argument("--poll-interval", type=float, nargs='+', default=[15.0], help="poll interval(s) in minutes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", type=str, default=None, help="sqlite file to use instead of an in-memory DB")
+    parser.add_argument("--per-day", action="store_true", default=False, help="print a line for every simulated day")
+    args = parser.parse_args()
+
+    first_day = _dt.date(2025, 10, 19)
+    schedule = generate_schedule(args.clusters, first_day, args.days, seed=args.seed)
+    results = []
+    for minutes in args.poll_interval:
+        db = None
+        if args.db:
+            db = SqliteDatabase(args.db, pragmas={'journal_mode': 'wal', 'synchronous': 'NORMAL'})
+        results.append(simulate(schedule, first_day, args.days, _dt.timedelta(minutes=minutes), db_instance=db))
+    print(format_report(results, per_day=args.per_day))
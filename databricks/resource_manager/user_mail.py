@@ -2,58 +2,253 @@
 we want to send warning to the user. find her email.
 
 cluster30 --> g_30 --> cnoam@here.com
+
+Send directly with send_emails(), or queue the message with mail_outbox.enqueue_email() so the caller
+does not wait for the mail service.
+
+The messages go through a transport, chosen by env vars:
+    MAIL_TRANSPORT   azure (default) | smtp | file | memory
+    MAIL_SENDER      the From address (default: the Azure DoNotReply address)
+    azure:  AZURE_EMAIL_ACCESS_KEY
+    smtp:   SMTP_HOST, SMTP_PORT (25), SMTP_USER, SMTP_PASSWORD, SMTP_STARTTLS (0/1), SMTP_CONNECTIONS (4)
+    file:   MAIL_DIR (default ./mail_out): one .eml file per message
 """
+import abc
+import itertools
 import logging
 import os
+import queue
+import smtplib
+import threading
 import time
+from email.message import EmailMessage
+from pathlib import Path
 
 dry_run = False
 
-def send_emails_azure(subject:str, body_html: str, recipients: list[str], logger: logging.Logger|None):
-    """Send email using Azure service.
-    This service must be configured prior to calling. After configuration, an API key is supplied.
-    This key must be saved in AZURE_EMAIL_ACCESS_KEY env var
+SENDER_ADDRESS = "DoNotReply@de9384ea-2d1f-4d24-a721-44bab6f65b6f.azurecomm.net"   # <<< HARD CODED
+AZURE_ENDPOINT = "https://comm-servicenc.unitedstates.communication.azure.com/"
+
+
+def build_mime(sender: str, subject: str, body_html: str, to: list[str], cc: list[str]) -> EmailMessage:
+    msg = EmailMessage()
+    msg['From'] = sender
+    if to:
+        msg['To'] = ', '.join(to)
+    if cc:
+        msg['Cc'] = ', '.join(cc)
+    msg['Subject'] = subject
+    msg.set_content(body_html, subtype='html')
+    return msg
+
+
+class MailTransport(abc.ABC):
+    """Sends one message and raises on failure. Implementations must be thread safe (the outbox sends concurrently)."""
+    name = 'base'
+
+    def __init__(self, sender: str = SENDER_ADDRESS):
+        self.sender = sender
+
+    @abc.abstractmethod
+    def send(self, subject: str, body_html: str, to: list[str], cc: list[str]):
+        ...
+
+    def close(self):
+        pass
+
+
+class AzureTransport(MailTransport):
     """
-    from azure.communication.email import EmailClient
+    Azure Communication Services. This service must be configured prior to use, it supplies an access key
+    (saved in AZURE_EMAIL_ACCESS_KEY env var). The EmailClient is created once and shared (it is thread safe)
+    """
+    name = 'azure'
 
-    key = os.getenv('AZURE_EMAIL_ACCESS_KEY')
-    if not key:
-        raise EnvironmentError("env var AZURE_EMAIL_ACCESS_KEY must be defined")
-    admin_email = os.getenv('ADMIN_EMAIL')
-    from_ = "DoNotReply@de9384ea-2d1f-4d24-a721-44bab6f65b6f.azurecomm.net"   # <<< HARD CODED
-
-    connection_string = f"endpoint=https://comm-servicenc.unitedstates.communication.azure.com/;accesskey={key}"
-    client = EmailClient.from_connection_string(connection_string)
-
-    recipients_list = [{'address': v} for v in recipients]
-    admin_list = [{'address': admin_email }]
-    message = {
-        "senderAddress": from_,
-        "recipients": {
-            "to": recipients_list,
-            "cc": admin_list
-        },
-        "content": {
-            "subject": subject,
-            "html": body_html
+    def __init__(self, access_key: str, sender: str = SENDER_ADDRESS, endpoint: str = AZURE_ENDPOINT):
+        super().__init__(sender)
+        self.connection_string = f"endpoint={endpoint};accesskey={access_key}"
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from azure.communication.email import EmailClient
+                self._client = EmailClient.from_connection_string(self.connection_string)
+            return self._client
+
+    def send(self, subject, body_html, to, cc):
+        message = {
+            "senderAddress": self.sender,
+            "recipients": {
+                "to": [{'address': v} for v in to],
+                "cc": [{'address': v} for v in cc]
+            },
+            "content": {
+                "subject": subject,
+                "html": body_html
+            }
         }
-    }
+        return self.client().begin_send(message).result()
+
+
+class SmtpTransport(MailTransport):
+    """
+    SMTP, with a pool of up to `connections` open connections that are reused from message to message
+    (reuse=False opens a connection per message). A connection that the server closed is reopened once.
+    """
+    name = 'smtp'
+
+    def __init__(self, host: str, port: int = 25, sender: str = SENDER_ADDRESS, username: str | None = None,
+                 password: str | None = None, starttls: bool = False, connections: int = 4, timeout: float = 30,
+                 reuse: bool = True):
+        super().__init__(sender)
+        self.host, self.port = host, port
+        self.username, self.password = username, password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.reuse = reuse
+        self.connections_opened = 0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(connections)
+        self._lock = threading.Lock()
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        with self._lock:
+            self.connections_opened += 1
+        return smtp
 
-    global dry_run
+    def send(self, subject, body_html, to, cc):
+        msg = build_mime(self.sender, subject, body_html, to, cc)
+        with self._slots:
+            try:
+                smtp = self._idle.get_nowait()
+            except queue.Empty:
+                smtp = self._connect()
+            try:
+                try:
+                    smtp.send_message(msg)
+                except smtplib.SMTPServerDisconnected:
+                    smtp = self._connect()
+                    smtp.send_message(msg)
+            except Exception:
+                smtp.close()
+                raise
+            if self.reuse:
+                self._idle.put(smtp)
+            else:
+                smtp.quit()
+
+    def close(self):
+        while True:
+            try:
+                smtp = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                smtp.quit()
+            except smtplib.SMTPException:
+                smtp.close()
+
+
+class FileTransport(MailTransport):
+    """Write each message as an .eml file (to check the content of the messages without sending them)"""
+    name = 'file'
+
+    def __init__(self, directory: str, sender: str = SENDER_ADDRESS):
+        super().__init__(sender)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._counter = itertools.count(1)
+
+    def send(self, subject, body_html, to, cc):
+        msg = build_mime(self.sender, subject, body_html, to, cc)
+        filename = self.directory / f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(self._counter):05}.eml"
+        filename.write_bytes(bytes(msg))
+        return str(filename)
+
+
+class MemoryTransport(MailTransport):
+    """Keep the messages in self.messages, as (subject, body_html, to, cc)"""
+    name = 'memory'
+
+    def __init__(self, sender: str = SENDER_ADDRESS):
+        super().__init__(sender)
+        self.messages = []
+        self._lock = threading.Lock()
+
+    def send(self, subject, body_html, to, cc):
+        with self._lock:
+            self.messages.append((subject, body_html, list(to), list(cc)))
+
+
+def transport_from_env() -> MailTransport:
+    """:return: the transport configured by MAIL_TRANSPORT (see the module doc)"""
+    kind = os.getenv('MAIL_TRANSPORT', 'azure').lower()
+    sender = os.getenv('MAIL_SENDER') or SENDER_ADDRESS
+    if kind == 'azure':
+        key = os.getenv('AZURE_EMAIL_ACCESS_KEY')
+        if not key:
+            raise EnvironmentError("env var AZURE_EMAIL_ACCESS_KEY must be defined")
+        return AzureTransport(key, sender)
+    if kind == 'smtp':
+        host = os.getenv('SMTP_HOST')
+        if not host:
+            raise EnvironmentError("env var SMTP_HOST must be defined when MAIL_TRANSPORT=smtp")
+        return SmtpTransport(host, int(os.getenv('SMTP_PORT', 25)), sender,
+                             username=os.getenv('SMTP_USER'), password=os.getenv('SMTP_PASSWORD'),
+                             starttls=os.getenv('SMTP_STARTTLS', '0') == '1',
+                             connections=int(os.getenv('SMTP_CONNECTIONS', 4)))
+    if kind == 'file':
+        return FileTransport(os.getenv('MAIL_DIR', 'mail_out'), sender)
+    if kind == 'memory':
+        return MemoryTransport(sender)
+    raise ValueError(f"unknown MAIL_TRANSPORT '{kind}'. Use azure, smtp, file or memory")
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> MailTransport:
+    """The transport shared by all the senders of this process (created on first use)"""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = transport_from_env()
+        return _transport
+
+
+def set_transport(transport: MailTransport | None):
+    """Use this transport from now on. None: read the configuration again on the next send"""
+    global _transport
+    with _transport_lock:
+        if _transport is not None and _transport is not transport:
+            _transport.close()
+        _transport = transport
+
+
+def send_message(subject: str, body_html: str, to: list[str], cc: list[str] | None = None,
+                 logger: logging.Logger | None = None):
+    """Send one message with the configured transport and wait for the result"""
+    cc = cc or []
     if dry_run:
-        print(f"FAKE sending mail to {recipients_list}, {admin_list}")
-        result = None
-    else:
-        start = time.time()
-        poller = client.begin_send(message)
-        if logger:
-            logger.info(f"Sending email took {time.time()-start:.2f} seconds")
-        start = time.time()
-        result = poller.result()
-        if logger:
-            logger.info(f"waiting for email result took {time.time()-start:.2f} seconds")
+        print(f"FAKE sending mail to {to}, {cc}")
+        return None
+    transport = get_transport()
+    start = time.time()
+    result = transport.send(subject, body_html, to, cc)
+    if logger:
+        logger.info(f"Sending email ({transport.name}) took {time.time()-start:.2f} seconds")
     return result
 
 
 def send_emails(subject:str, body: str, recipients: list[str], logger):
-    return send_emails_azure(subject,body,recipients,logger)
+    """Send to the recipients, CC the admin (ADMIN_EMAIL)"""
+    admin_email = os.getenv('ADMIN_EMAIL')
+    return send_message(subject, body, recipients, [admin_email] if admin_email else [], logger)
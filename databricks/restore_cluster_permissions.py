@@ -1,22 +1,82 @@
 """
 Verify all groups have CAN_RESTART permission in Azure DataBricks cluster
 This is needed to restore normal operation after revoking permissions.
+
+The current ACLs are read concurrently, and only the clusters whose ACL differs
+from the desired state are written.
 """
+import concurrent.futures
 
 import requests
 from .DataBricksClusterOps import DataBricksClusterOps
+from .roster_index import group_for_cluster
+
+
+def desired_cluster_permissions(clusters: list[dict]) -> dict:
+    """
+    Each group may restart its cluster (see roster_index: cluster_NN is used by group_NN unless bound otherwise).
+    :return: dict { cluster_id -> (group_name, permission_level) }. Clusters of no group are ignored.
+    """
+    desired = {}
+    level = DataBricksClusterOps.permission_level(DataBricksClusterOps.ClusterPermission.RESTART)
+    for c in clusters:
+        group_name = group_for_cluster(c['cluster_name'], c['cluster_id'])
+        if group_name:
+            desired[c['cluster_id']] = (group_name, level)
+    return desired
+
+
+def direct_permission_level(acl: dict, group_name: str) -> str | None:
+    """:return: the non-inherited permission level of the group in a permissions/clusters response"""
+    for entry in acl.get('access_control_list', []):
+        if entry.get('group_name') != group_name:
+            continue
+        for p in entry.get('all_permissions', []):
+            if not p.get('inherited', False):
+                return p['permission_level']
+    return None
 
-def restore_cluster_permissions(host,token,logger):
+
+def reconcile_cluster_permissions(client: DataBricksClusterOps, desired: dict, logger, max_workers: int = 8) -> dict:
+    """
+    Read the ACL of every cluster in 'desired' concurrently, and write only the ones that differ.
+    :param desired: dict { cluster_id -> (group_name, permission_level) }
+    :return: dict {'changed': [cluster_id], 'unchanged': [cluster_id], 'failed': [(cluster_id, error)]}
+    """
+    summary = {'changed': [], 'unchanged': [], 'failed': []}
+    if not desired:
+        return summary
+    level_to_enum = {client.permission_level(p): p for p in client.ClusterPermission}
+
+    def reconcile_one(cluster_id: str) -> bool:
+        group_name, level = desired[cluster_id]
+        if direct_permission_level(client.get_cluster_permission(cluster_id), group_name) == level:
+            return False
+        client.set_cluster_permission(cluster_id, group_name=group_name, permission=level_to_enum[level])
+        return True
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(desired))) as executor:
+        futures = {executor.submit(reconcile_one, cid): cid for cid in desired}
+        for future in concurrent.futures.as_completed(futures):
+            cid = futures[future]
+            try:
+                if future.result():
+                    summary['changed'].append(cid)
+                    logger.info(f"set permissions for {cid}, group {desired[cid][0]}")
+                else:
+                    summary['unchanged'].append(cid)
+            except requests.RequestException as e:
+                logger.error(f"{e}, group {desired[cid][0]}")
+                summary['failed'].append((cid, str(e)))
+    return summary
+
+
+def restore_cluster_permissions(host,token,logger) -> dict:
 
     client = DataBricksClusterOps(host_='https://' + host, token_=token)
-    clusters = list(client.get_clusters())
+    clusters = list(client.get_clusters(max_age=0))
     logger.info(f'Restoring cluster permissions for {len(clusters)} clusters')
-    for c in clusters:
-        group_name = "group_" + c['cluster_name'][8:]
-        try:
-            client.set_cluster_permission(c["cluster_id"], group_name=group_name, permission=client.ClusterPermission.RESTART)
-            logger.info(f"set permissions for {c['cluster_id']}")
-        except requests.HTTPError as e:
-            logger.error(f"{e}, group {group_name}")
-
-    logger.info('restore_cluster_permissions completed')
+    summary = reconcile_cluster_permissions(client, desired_cluster_permissions(clusters), logger)
+    logger.info(f"restore_cluster_permissions completed: {len(summary['changed'])} changed, "
+                f"{len(summary['unchanged'])} unchanged, {len(summary['failed'])} failed")
+    return summary
@@ -0,0 +1,219 @@
+"""
+Ingestion of the Moodle group roster ("Group self-selection" export).
+
+The CSV is read as a stream, one group per row. The columns are found by their header:
+'Group ID', 'Group Name' (optional) and any number of 'Member N Email' columns.
+A 'sep=;' preamble line (Excel style) sets the delimiter.
+
+    groups = read_roster("Groupself-selection_00094290.01_2024-01-14.csv")   # {Moodle group id -> RosterGroup}
+    diff = diff_rosters(load_roster("roster.json"), groups)
+    print(format_diff(diff))
+    save_roster(groups, "roster.json")
+
+Groups are keyed by their Moodle 'Group ID'. The workspace name (group_01, group_02 ...) comes from the
+ordinal. On the first sync it is the position of the group among the valid rows, the same numbering Terraform
+uses for users.csv. After that a group keeps its number (number_groups()), so a group that leaves the course
+does not shift the groups after it onto other clusters and schemas:
+
+    groups = number_groups(read_roster("groups.csv"), {gid: g.ordinal for gid, g in load_roster("roster.json").items()})
+
+The python tools read the roster with roster_index.numbered_roster(), which takes the numbers of the last sync
+from the roster index. NOTE: terraform/convert_moodle_to_tf_format.py writes users.csv by row position, so
+after a group left the course its numbering does not match the one of the python tools.
+"""
+import csv
+import json
+import logging
+import re
+from dataclasses import dataclass, field, replace
+
+MEMBER_EMAIL_RE = re.compile(r"^Member (\d+) Email$")
+EMAIL_RE = re.compile(r"^[^@\s,;]+@[^@\s,;]+\.[^@\s,;]+$")
+
+
+class RosterError(ValueError):
+    """The roster file cannot be used (bad header, or an invalid row in strict mode)"""
+
+
+@dataclass(frozen=True)
+class RosterGroup:
+    group_id: str               # the Moodle 'Group ID'
+    ordinal: int                # the workspace number: 1-based position in the roster, or kept from the last sync
+    members: tuple              # member emails, in column order
+    name: str = ''              # the Moodle 'Group Name'
+
+    @property
+    def group_name(self) -> str:
+        """the name of the group in the workspace"""
+        return f"group_{self.ordinal:02}"
+
+
+class RosterReader:
+    """
+    Iterate over the groups of a Moodle roster file object (open it with newline='' and encoding='utf-8-sig').
+    Invalid rows are skipped and recorded in self.errors, or raise RosterError if strict.
+    """
+
+    def __init__(self, file, strict: bool = False):
+        self.file = file
+        self.strict = strict
+        self.errors = []
+        self.line = 1
+        first = file.readline()
+        delimiter = ','
+        if first.startswith('sep='):
+            delimiter = first.strip()[len('sep='):] or ','
+            first = file.readline()
+            self.line += 1
+        self._reader = csv.reader(file, delimiter=delimiter)
+        header = next(csv.reader([first], delimiter=delimiter), [])
+        header = [h.strip() for h in header]
+        if 'Group ID' not in header:
+            raise RosterError('unexpected CSV format. The header MUST have a "Group ID" column')
+        self.index_id = header.index('Group ID')
+        self.index_name = header.index('Group Name') if 'Group Name' in header else None
+        members = sorted((int(m.group(1)), i) for i, h in enumerate(header) if (m := MEMBER_EMAIL_RE.match(h)))
+        if not members:
+            raise RosterError('unexpected CSV format. The header has no "Member N Email" column')
+        self.member_indexes = [i for _, i in members]
+
+    @property
+    def max_members(self) -> int:
+        return len(self.member_indexes)
+
+    def _invalid(self, message: str):
+        message = f"line {self.line}: {message}"
+        if self.strict:
+            raise RosterError(message)
+        logging.error(f"skipping invalid row in CSV file: {message}")
+        self.errors.append(message)
+
+    def __iter__(self):
+        seen_ids = set()
+        seen_emails = {}
+        ordinal = 0
+        for row in self._reader:
+            self.line += 1
+            if not any(cell.strip() for cell in row):
+                continue
+            cell = lambda i: row[i].strip() if i is not None and i < len(row) else ''
+            group_id = cell(self.index_id)
+            members = [e for e in (cell(i) for i in self.member_indexes) if e]
+            if not group_id:
+                self._invalid("no Group ID")
+                continue
+            if group_id in seen_ids:
+                self._invalid(f"duplicate Group ID {group_id}")
+                continue
+            bad = [e for e in members if not EMAIL_RE.match(e)]
+            if bad:
+                self._invalid(f"group {group_id}: invalid email {bad}")
+                continue
+            taken = [e for e in members if e.lower() in seen_emails]
+            if taken:
+                self._invalid(f"group {group_id}: {taken} already in group {seen_emails[taken[0].lower()]}")
+                continue
+            seen_ids.add(group_id)
+            if not members:
+                continue  # Moodle lists the empty groups too
+            for e in members:
+                seen_emails[e.lower()] = group_id
+            ordinal += 1
+            yield RosterGroup(group_id, ordinal, tuple(members), cell(self.index_name))
+
+
+def read_roster(filename: str, strict: bool = False) -> dict:
+    """:return: dict {Moodle group id -> RosterGroup}, in file order"""
+    with open(filename, newline='', encoding='utf-8-sig') as f:
+        return {g.group_id: g for g in RosterReader(f, strict=strict)}
+
+
+def number_groups(groups: dict, previous: dict) -> dict:
+    """
+    Keep the workspace number of the groups that were already synced.
+    :param groups: dict {Moodle group id -> RosterGroup}, as read
+    :param previous: dict {Moodle group id -> number} of the last sync. Empty, or no group in common (a new
+        course): keep the positions (first sync)
+    :return: the groups, with their number in RosterGroup.ordinal. A new group gets the next number after
+        the highest previous one, so it never takes over the cluster and schema of a group that left.
+    """
+    if not previous or not previous.keys() & groups.keys():
+        return dict(groups)
+    taken = {n for gid, n in previous.items() if gid in groups}
+    next_number = max(previous.values()) + 1
+    numbered = {}
+    for gid, g in groups.items():
+        number = previous.get(gid)
+        if number is None:
+            while next_number in taken:
+                next_number += 1
+            number = next_number
+            taken.add(number)
+        numbered[gid] = replace(g, ordinal=number)
+    return numbered
+
+
+def save_roster(groups: dict, filename: str):
+    """Save the ingested roster, to diff the next one against it"""
+    with open(filename, 'w') as f:
+        json.dump([{'group_id': g.group_id, 'ordinal': g.ordinal, 'name': g.name, 'members': list(g.members)}
+                   for g in groups.values()], f, indent=1)
+
+
+def load_roster(filename: str) -> dict:
+    """:return: the roster saved by save_roster(). Empty if the file does not exist"""
+    try:
+        with open(filename) as f:
+            return {g['group_id']: RosterGroup(g['group_id'], g['ordinal'], tuple(g['members']), g.get('name', ''))
+                    for g in json.load(f)}
+    except FileNotFoundError:
+        return {}
+
+
+@dataclass
+class RosterDiff:
+    added: list = field(default_factory=list)       # RosterGroup
+    removed: list = field(default_factory=list)     # RosterGroup (of the previous roster)
+    changed: list = field(default_factory=list)     # (old RosterGroup, new RosterGroup)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def changed_group_names(self) -> set:
+        """The workspace groups that need provisioning. A renumbered group touches its old and new name."""
+        names = {g.group_name for g in self.added + self.removed}
+        for old, new in self.changed:
+            names |= {old.group_name, new.group_name}
+        return names
+
+    def renumbered(self) -> list:
+        """:return: the (old, new) groups whose workspace name changed"""
+        return [(old, new) for old, new in self.changed if old.ordinal != new.ordinal]
+
+
+def diff_rosters(old: dict, new: dict) -> RosterDiff:
+    """Compare two rosters by Moodle group id. Members are compared case-insensitively, ignoring their order."""
+    diff = RosterDiff()
+    for gid, g in new.items():
+        if gid not in old:
+            diff.added.append(g)
+        elif (old[gid].ordinal != g.ordinal
+              or {m.lower() for m in old[gid].members} != {m.lower() for m in g.members}):
+            diff.changed.append((old[gid], g))
+    diff.removed = [g for gid, g in old.items() if gid not in new]
+    return diff
+
+
+def format_diff(diff: RosterDiff) -> str:
+    if not diff:
+        return "The roster did not change."
+    lines = [f"+ {g.group_name} (Moodle {g.group_id}): {', '.join(g.members)}" for g in diff.added]
+    lines += [f"- {g.group_name} (Moodle {g.group_id})" for g in diff.removed]
+    for old, new in diff.changed:
+        before, after = {m.lower() for m in old.members}, {m.lower() for m in new.members}
+        text = f"~ {new.group_name} (Moodle {new.group_id}):"
+        if old.ordinal != new.ordinal:
+            text += f" was {old.group_name}"
+        text += "".join(f" +{m}" for m in sorted(after - before)) + "".join(f" -{m}" for m in sorted(before - after))
+        lines.append(text)
+    return "\n".join(lines)
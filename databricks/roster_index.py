@@ -0,0 +1,197 @@
+"""
+Local index of the roster: group -> members, cluster, schema and service principal.
+
+The tables live in the uptime DB (database/db_operations.py). They are filled from the Moodle roster
+(index_roster) and from the workspace (index_workspace, bind_clusters), and give indexed lookups:
+
+    group_for_cluster(cluster_name="cluster_07")   -> "group_07"
+    members_of_cluster(cluster_id="0101-...")     -> ["a@x.com", "b@x.com"]
+    cluster_for_group("group_07")                 -> ClusterBinding
+
+When the index is not bound to a DB (e.g. a CLI run without the uptime DB) or does not know the
+object, the lookups fall back to the naming convention: group_NN uses cluster_NN, schema_NN and sp_NN.
+"""
+import re
+
+from .database.db_operations import (StudentGroup, GroupMember, ClusterBinding, GroupSchema,
+                                     GroupServicePrincipal, initialize_production_db, create_tables)
+from .roster import load_roster, number_groups, read_roster
+
+# the naming convention of the student objects, shared by all the tools
+STUDENT_GROUP_RE = re.compile(r"^group_(\d{1,3})$")
+STUDENT_CLUSTER_RE = re.compile(r"^cluster_(\d{1,3})$")
+
+
+def convention_cluster(group_name: str) -> str | None:
+    m = STUDENT_GROUP_RE.match(group_name)
+    return f"cluster_{m.group(1)}" if m else None
+
+
+def convention_group(cluster_name: str) -> str | None:
+    m = STUDENT_CLUSTER_RE.match(cluster_name or '')
+    return f"group_{m.group(1)}" if m else None
+
+
+def is_bound() -> bool:
+    """True if the roster tables are bound to a database"""
+    return StudentGroup._meta.database is not None
+
+
+def _ensure_group(group_name: str, moodle_id: str | None = None, ordinal: int | None = None) -> StudentGroup:
+    group, created = StudentGroup.get_or_create(group_name=group_name,
+                                                defaults={'moodle_id': moodle_id, 'ordinal': ordinal})
+    if not created and moodle_id is not None and (group.moodle_id, group.ordinal) != (moodle_id, ordinal):
+        group.moodle_id, group.ordinal = moodle_id, ordinal
+        group.save()
+    return group
+
+
+def _set_members(group: StudentGroup, emails):
+    emails = {e.lower() for e in emails}
+    current = {m.email for m in group.members}
+    if emails == current:
+        return
+    GroupMember.delete().where((GroupMember.group == group) & GroupMember.email.not_in(list(emails))).execute()
+    rows = [{'group': group.group_name, 'email': e} for e in sorted(emails - current)]
+    if rows:
+        GroupMember.insert_many(rows).execute()
+
+
+def _bind_cluster(group: StudentGroup, cluster_name: str, cluster_id: str | None = None):
+    binding = ClusterBinding.get_or_none(ClusterBinding.cluster_name == cluster_name)
+    if binding is None:
+        ClusterBinding.create(cluster_name=cluster_name, cluster_id=cluster_id, group=group)
+    elif binding.group_id != group.group_name or (cluster_id and binding.cluster_id != cluster_id):
+        binding.group = group
+        binding.cluster_id = cluster_id or binding.cluster_id
+        binding.save()
+
+
+def index_roster(groups: dict, catalog: str = ''):
+    """
+    Store the ingested Moodle roster (roster.read_roster()) with the conventional cluster, schema and SP names.
+    Groups that are not in the roster anymore are removed from the index.
+    """
+    db = StudentGroup._meta.database
+    with db.atomic():
+        names = set()
+        for g in groups.values():
+            number = g.group_name[len("group_"):]
+            group = _ensure_group(g.group_name, g.group_id, g.ordinal)
+            names.add(group.group_name)
+            _set_members(group, g.members)
+            _bind_cluster(group, f"cluster_{number}")
+            GroupSchema.get_or_create(catalog=catalog, schema_name=f"schema_{number}", defaults={'group': group})
+            GroupServicePrincipal.get_or_create(display_name=f"sp_{number}", defaults={'group': group})
+        stale = [s.group_name for s in StudentGroup.select(StudentGroup.group_name) if s.group_name not in names]
+        if stale:
+            for model in (GroupMember, ClusterBinding, GroupSchema, GroupServicePrincipal):
+                model.delete().where(model.group.in_(stale)).execute()
+            StudentGroup.delete().where(StudentGroup.group_name.in_(stale)).execute()
+
+
+def index_workspace(group_members: dict, clusters: list[dict], cluster_groups: dict | None = None,
+                    service_principals: list[dict] | None = None):
+    """
+    Store what the workspace has.
+    :param group_members: {group_NN: [member emails]} e.g. reconcile.LiveState.groups
+    :param clusters: the clusters/list response
+    :param cluster_groups: {cluster name: group name}, for clusters that do not follow the naming convention
+    :param service_principals: SCIM service principals (displayName, applicationId)
+    """
+    db = StudentGroup._meta.database
+    with db.atomic():
+        for group_name, emails in group_members.items():
+            _set_members(_ensure_group(group_name), emails)
+        bind_clusters(clusters, cluster_groups)
+        for sp in service_principals or []:
+            binding = GroupServicePrincipal.get_or_none(GroupServicePrincipal.display_name == sp.get('displayName'))
+            if binding and binding.application_id != sp.get('applicationId'):
+                binding.application_id = sp.get('applicationId')
+                binding.save()
+
+
+def bind_clusters(clusters: list[dict], cluster_groups: dict | None = None):
+    """Record the cluster ids of the group clusters (called by the poll with the list it already has)"""
+    cluster_groups = cluster_groups or {}
+    known = {b.cluster_name: b for b in ClusterBinding.select()}
+    for c in clusters:
+        binding = known.get(c['cluster_name'])
+        if binding is not None:
+            if binding.cluster_id != c['cluster_id']:
+                ClusterBinding.update(cluster_id=None).where(ClusterBinding.cluster_id == c['cluster_id']).execute()
+                binding.cluster_id = c['cluster_id']
+                binding.save()
+            continue
+        group_name = cluster_groups.get(c['cluster_name'])
+        if group_name is None:
+            group_name = convention_group(c['cluster_name'])
+            if group_name is None or StudentGroup.get_or_none(StudentGroup.group_name == group_name) is None:
+                continue
+        _bind_cluster(_ensure_group(group_name), c['cluster_name'], c['cluster_id'])
+
+
+def _binding(cluster_name: str | None, cluster_id: str | None) -> ClusterBinding | None:
+    if cluster_id:
+        binding = ClusterBinding.get_or_none(ClusterBinding.cluster_id == cluster_id)
+        if binding:
+            return binding
+    if cluster_name:
+        return ClusterBinding.get_or_none(ClusterBinding.cluster_name == cluster_name)
+    return None
+
+
+def open_index():
+    """Bind the roster index (and the uptime tables) to the uptime DB, once"""
+    if not is_bound():
+        create_tables(initialize_production_db())
+
+
+def group_numbers() -> dict:
+    """:return: dict {Moodle group id -> workspace number} of the indexed roster (see roster.number_groups())"""
+    if not is_bound():
+        return {}
+    return {g.moodle_id: g.ordinal for g in StudentGroup.select() if g.moodle_id and g.ordinal}
+
+
+def numbered_roster(filename: str, saved_roster: str | None = None) -> dict:
+    """
+    Read the Moodle roster with the group numbers of the last sync, so every tool gives group_NN (and cluster_NN,
+    schema_NN, sp_NN) to the same Moodle group. Call open_index() first.
+    :param saved_roster: json file of the last synced roster (roster.save_roster()). Default: the roster index
+    :return: dict {Moodle group id -> RosterGroup}
+    """
+    previous = {gid: g.ordinal for gid, g in load_roster(saved_roster).items()} if saved_roster else {}
+    return number_groups(read_roster(filename), previous or group_numbers())
+
+
+def group_for_cluster(cluster_name: str | None = None, cluster_id: str | None = None) -> str | None:
+    """:return: the group that owns the cluster, None if unknown"""
+    if is_bound():
+        binding = _binding(cluster_name, cluster_id)
+        if binding:
+            return binding.group_id
+    return convention_group(cluster_name)
+
+
+def cluster_for_group(group_name: str) -> ClusterBinding | None:
+    """:return: the cluster of the group (cluster_id may be None if the cluster was not seen yet)"""
+    if is_bound():
+        binding = ClusterBinding.get_or_none(ClusterBinding.group == group_name)
+        if binding:
+            return binding
+    name = convention_cluster(group_name)
+    return ClusterBinding(cluster_name=name, cluster_id=None, group=group_name) if name else None
+
+
+def members_of_group(group_name: str) -> list[str] | None:
+    """:return: the member emails, or None if the group is not in the index"""
+    if not is_bound() or StudentGroup.get_or_none(StudentGroup.group_name == group_name) is None:
+        return None
+    return [m.email for m in GroupMember.select().where(GroupMember.group == group_name).order_by(GroupMember.email)]
+
+
+def members_of_cluster(cluster_name: str | None = None, cluster_id: str | None = None) -> list[str] | None:
+    """:return: the emails of the owners of the cluster, or None if unknown"""
+    group_name = group_for_cluster(cluster_name, cluster_id)
+    return members_of_group(group_name) if group_name else None
@@ -1,14 +1,25 @@
 # script created by GPT to export all Databricks User's workspace files.
-# Files larger than 10 MB are not exported.
 #  Noam 2025-01-07
 #
+# Incremental: objects not modified since the last run (see manifest.json in the backup dir) are not exported again.
+# Resumable: after an interrupted run, run with --resume to continue it (see journal.jsonl in the backup dir).
+# run from the repo root:
+#   python -m databricks.scripts.export_dbr_workspaces [--backup-dir DIR] [--root /Users] [--workers 8]
 #
-import base64
+import argparse
 import os
-import requests
+import sys
 import dotenv
 import logging
 
+try:
+    from ..backup.workspace_backup import WorkspaceBackup
+    from ..backup.store import BackupStore
+except ImportError:
+    print("Error: This script should be run as a module.")
+    print("Please use: python -m databricks.scripts.export_dbr_workspaces [arguments]")
+    sys.exit(1)
+
 dotenv.load_dotenv()
 
 # Logger configuration
@@ -19,109 +30,42 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Configuration
-DATABRICKS_URL = os.getenv("DATABRICKS_HOST")
-TOKEN = os.getenv("DATABRICKS_TOKEN")
 ROOT_DIR = "/Users"
 BACKUP_DIR = "./databricks_94290_backup_2024w"
-MAX_FILE_SIZE_BYTES = 10 * 1024 * 1024  # 10 MB
-
-if not TOKEN:
-    raise ValueError("Environment variable DATABRICKS_TOKEN is not set")
-
-if not DATABRICKS_URL:
-    raise ValueError("Environment variable DATABRICKS_URL is not set")
-
-if not DATABRICKS_URL.startswith("http"):
-    DATABRICKS_URL = "https://" + DATABRICKS_URL
-
 
-headers = {"Authorization": f"Bearer {TOKEN}"}
-
-def list_workspace_objects(path):
-    """List all objects (files and directories) in the Databricks workspace at the given path."""
-    url = f"{DATABRICKS_URL}/api/2.0/workspace/list"
-    logger.debug(f"Listing workspace objects at path: {path}")
-    try:
-        response = requests.request(
-            "GET",
-            url,
-            headers=headers,
-            data=f'{{"path": "{path}"}}',  # Include data in the body. NON STANDARD!
-        )
-        response.raise_for_status()
-        return response.json().get("objects", [])
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error listing workspace objects at {path}: {e}")
-        raise # we must pass this error up
-
-def get_file_status(file_path):
-    """Get the status of a file in Workspace, including its size."""
-    url = f"{DATABRICKS_URL}/api/2.0/workspace/get-status"
-    try:
-        response = requests.get(url, headers=headers, params={"path": file_path})
-        if response.status_code == 404:
-            logger.warning(f"File {file_path} not found.")
-            return None
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error getting file status for {file_path}: {e}")
-        return None
-
-def export_notebook(notebook_path, local_path):
-    """Export a notebook from Databricks to the local filesystem."""
-    url = f"{DATABRICKS_URL}/api/2.0/workspace/export"
-    try:
-        # format can be SOURCE / JUPYTER / HTML / ...
-        response = requests.get(url, headers=headers, params={"path": notebook_path, "format": "SOURCE"})
-        response.raise_for_status()
-
-        payload = response.json()
-        raw_bytes = base64.b64decode(payload["content"])
-
-        os.makedirs(os.path.dirname(local_path), exist_ok=True)
-
-        #    if you want text (e.g. .py), decode to UTF-8:
-        if local_path.lower().endswith((".py", ".scala", ".sql")):
-            text = raw_bytes.decode("utf-8")
-            with open(local_path, "w", encoding="utf-8") as f:
-                f.write(text)
-        else:
-            # for binary formats (e.g. .dbc), write raw
-            with open(local_path, "wb") as f:
-                f.write(raw_bytes)
-
-        logger.info(f"Exported: {notebook_path} -> {local_path}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error exporting notebook {notebook_path}: {e}")
-
-def backup_workspace(path, local_dir):
-    """Recursively back up the Databricks workspace."""
-    objects = list_workspace_objects(path)
-    for obj in objects:
-        object_type = obj["object_type"]
-        object_path = obj["path"]
-        local_path = os.path.join(local_dir, os.path.relpath(object_path, ROOT_DIR))
-
-        if object_type == "DIRECTORY":
-            os.makedirs(local_path, exist_ok=True)
-            backup_workspace(object_path, local_dir)  # Recurse into the directory
-
-        elif object_type == "NOTEBOOK":
-            status = get_file_status(object_path)
-            if status:
-                if status.get("file_size", 0) <= MAX_FILE_SIZE_BYTES:
-                    export_notebook(object_path, local_path + ".py")
-                    #print(f"FAKE exporting {object_path}")
-                else:
-                    logger.warning(f"Skipping large file: {object_path} ({status['file_size']} bytes)")
-            else:
-                logger.warning(f"Skipping {object_path} - no status")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Back up the notebooks and files of the workspace")
+    parser.add_argument("--backup-dir", default=BACKUP_DIR, help="local backup folder")
+    parser.add_argument("--root", default=ROOT_DIR, help="workspace folder to back up")
+    parser.add_argument("--workers", type=int, default=8, help="number of concurrent API calls")
+    parser.add_argument("--resume", action="store_true", default=False,
+                        help="continue the last run if it was interrupted: retry only what failed or was not done")
+    parser.add_argument("--store", action="store_true", default=False,
+                        help="backup-dir is a deduplicated, compressed repository. Each run adds a snapshot "
+                             "(browse it with python -m databricks.backup.store)")
+    args = parser.parse_args()
+
+    DATABRICKS_URL = os.getenv("DATABRICKS_HOST")
+    TOKEN = os.getenv("DATABRICKS_TOKEN")
+    if not TOKEN:
+        raise ValueError("Environment variable DATABRICKS_TOKEN is not set")
+    if not DATABRICKS_URL:
+        raise ValueError("Environment variable DATABRICKS_HOST is not set")
+
     try:
-        os.makedirs(BACKUP_DIR, exist_ok=True)
-        backup_workspace(ROOT_DIR, BACKUP_DIR)
-        logger.info("Backup completed successfully.")
+        store = BackupStore(args.backup_dir) if args.store else None
+        backup = WorkspaceBackup(DATABRICKS_URL, TOKEN, args.backup_dir, max_workers=args.workers, logger=logger,
+                                 store=store)
+        summary = backup.run(args.root, resume=args.resume)
+        logger.info(f"Backup completed: {summary.objects} objects in {summary.listed_dirs} directories. "
+                    f"exported {summary.exported}, unchanged {summary.unchanged}, "
+                    f"deleted from workspace {summary.deleted}, failed {len(summary.failed)}, "
+                    f"inconsistent {len(summary.inconsistent)}"
+                    + (f". snapshot {summary.snapshot}" if summary.snapshot else ""))
+        if summary.failed or summary.inconsistent:
+            logger.error("Run again with --resume to retry the failures")
+            sys.exit(1)
     except Exception as e:
         logger.critical(f"Unexpected error: {e}")
+        sys.exit(2)
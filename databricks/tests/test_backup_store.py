@@ -0,0 +1,68 @@
+import os
+from unittest.mock import patch
+
+import pytest
+
+from databricks.backup import store as store_module
+from databricks.backup.store import BackupStore, CorruptBlobError
+
+STARTER = b"# starter notebook\n" * 200
+
+
+def entry(store, path, data):
+    return {'path': path, 'sha256': store.put(data), 'size': len(data), 'local_path': path.lstrip('/')}
+
+
+def test_same_content_is_stored_once_and_compressed(tmp_path):
+    store = BackupStore(str(tmp_path))
+    entries = [entry(store, f"/Users/s{i}@x.com/starter.py", STARTER) for i in range(50)]
+    store.create_snapshot(entries, '/Users', snapshot_id='s1')
+
+    assert len(store.index) == 1
+    packs = os.listdir(tmp_path / 'packs')
+    assert sum(os.path.getsize(tmp_path / 'packs' / p) for p in packs) < len(STARTER) / 10
+    # a new store instance sees the saved index
+    assert BackupStore(str(tmp_path)).get(entries[0]['sha256']) == STARTER
+
+
+@pytest.mark.parametrize('zstd_available', [True, False])
+def test_snapshot_list_diff_restore(tmp_path, zstd_available):
+    with patch.object(store_module, 'zstandard', store_module.zstandard if zstd_available else None):
+        store = BackupStore(str(tmp_path / 'repo'))
+        store.create_snapshot([entry(store, '/a.py', b'1'), entry(store, '/b.py', b'2')], snapshot_id='s1')
+        store.create_snapshot([entry(store, '/a.py', b'1'), entry(store, '/b.py', b'3'), entry(store, '/c.py', b'4')],
+                              snapshot_id='s2')
+
+        assert store.snapshots() == ['s1', 's2']
+        assert [e['path'] for e in store.list_snapshot('s2', prefix='/b')] == ['/b.py']
+        assert store.diff('s1', 's2') == {'added': ['/c.py'], 'removed': [], 'modified': ['/b.py']}
+        assert store.restore('s1', str(tmp_path / 'out')) == 2
+        assert (tmp_path / 'out' / 'b.py').read_bytes() == b'2'
+        assert {loc.codec for loc in store.index.values()} == {'zstd' if zstd_available else 'zlib'}
+
+
+def test_gc_removes_content_of_forgotten_snapshots(tmp_path):
+    store = BackupStore(str(tmp_path))
+    store.create_snapshot([entry(store, '/old.py', b'old' * 1000), entry(store, '/keep.py', b'keep')], snapshot_id='s1')
+    store.create_snapshot([entry(store, '/keep.py', b'keep')], snapshot_id='s2')
+
+    store.forget('s1')
+    result = store.gc()
+
+    assert result['blobs_removed'] == 1 and result['packs_rewritten'] == 1
+    assert store.restore('s2', str(tmp_path / 'out')) == 1
+    assert BackupStore(str(tmp_path)).get(store.list_snapshot('s2')[0]['sha256']) == b'keep'
+
+
+def test_corrupt_blob_is_detected(tmp_path):
+    store = BackupStore(str(tmp_path))
+    sha = store.put(b'content')
+    loc = store.index[sha]
+    with open(tmp_path / 'packs' / loc.pack, 'r+b') as f:
+        compressed = store_module.compress(b'CONTENT')[0]
+        f.seek(loc.offset)
+        f.write(compressed)
+        loc.length = len(compressed)
+
+    with pytest.raises(CorruptBlobError):
+        store.get(sha)
@@ -0,0 +1,98 @@
+import importlib
+import sys
+import threading
+import types
+from contextlib import contextmanager
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+
+UTILS = Path(__file__).resolve().parents[2] / "terraform" / "dbr" / "utils"
+
+ROWS = [
+    ("group_02", "orders", "MANAGED"),
+    ("group_01", "daily", "MATERIALIZED_VIEW"),
+    ("group_01", "raw", "EXTERNAL"),
+    ("group_02", "v_orders", "VIEW"),
+    ("group_01", "events", "STREAMING_TABLE"),
+]
+
+
+@pytest.fixture
+def cleanup(monkeypatch):
+    """cleanup_schemas.py is a standalone script: import it from terraform/dbr/utils, without the SQL connector"""
+    monkeypatch.syspath_prepend(str(UTILS))
+    monkeypatch.setitem(sys.modules, "databricks.sql", types.ModuleType("databricks.sql"))
+    for name in ("sql_pool", "cleanup_schemas"):
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    return importlib.import_module("cleanup_schemas")
+
+
+class FakePool:
+    """Every cursor records the statements it executes, in one shared list"""
+
+    def __init__(self, rows=()):
+        self.size = 4
+        self.executed = []
+        self._lock = threading.Lock()
+        self.rows = list(rows)
+
+    @contextmanager
+    def cursor(self):
+        cursor = MagicMock()
+
+        def execute(statement):
+            with self._lock:
+                self.executed.append(statement)
+        cursor.execute.side_effect = execute
+        cursor.fetchall.return_value = self.rows
+        yield cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def test_plan_drops_views_before_tables(cleanup):
+    cursor = MagicMock()
+    cursor.fetchall.return_value = ROWS
+    plan = cleanup.list_objects(cursor, "lab")
+
+    assert "NOT IN ('information_schema', 'default')" in cursor.execute.call_args.args[0]
+    assert [o["statement"] for o in plan] == [
+        "DROP MATERIALIZED VIEW IF EXISTS `lab`.`group_01`.`daily`",
+        "DROP VIEW IF EXISTS `lab`.`group_02`.`v_orders`",
+        "DROP TABLE IF EXISTS `lab`.`group_01`.`events`",
+        "DROP TABLE IF EXISTS `lab`.`group_01`.`raw`",
+        "DROP TABLE IF EXISTS `lab`.`group_02`.`orders`",
+    ]
+
+
+def test_drop_objects_finishes_the_views_before_any_table(cleanup):
+    cursor = MagicMock()
+    cursor.fetchall.return_value = ROWS
+    plan = cleanup.list_objects(cursor, "lab")
+    pool = FakePool()
+
+    results = cleanup.drop_objects(pool, plan)
+
+    assert [error for _, error in results] == [None] * len(ROWS)
+    assert sorted(pool.executed) == sorted(o["statement"] for o in plan)
+    first_table = min(i for i, s in enumerate(pool.executed) if s.startswith("DROP TABLE"))
+    assert all(s.startswith("DROP TABLE") for s in pool.executed[first_table:])
+
+
+def test_dry_run_executes_nothing_but_the_listing(cleanup, monkeypatch, tmp_path):
+    pool = FakePool(ROWS)
+    monkeypatch.setattr(cleanup, "ConnectionPool", lambda *args, **kwargs: pool)
+    plan_json = tmp_path / "plan.json"
+    monkeypatch.setattr(sys, "argv", ["cleanup_schemas.py", "--catalog", "lab", "--host", "h", "--sql-id", "s",
+                                      "--token", "t", "--dry-run", "--plan-json", str(plan_json)])
+
+    cleanup.main()
+
+    assert len(pool.executed) == 1 and pool.executed[0].startswith("SELECT table_schema")
+    assert plan_json.exists()
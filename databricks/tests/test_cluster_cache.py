@@ -0,0 +1,71 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+from databricks.DataBricksClusterOps import DataBricksClusterOps
+from databricks.resource_manager.cluster_cache import ClusterCache
+
+CLUSTERS = [
+    {'cluster_id': '1', 'cluster_name': 'cluster_01', 'state': 'RUNNING'},
+    {'cluster_id': '2', 'cluster_name': 'cluster_02', 'state': 'TERMINATED'},
+]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ClusterCache('https://test-host', ttl_seconds=60, cache_dir=str(tmp_path))
+
+
+@pytest.fixture
+def MockClusterApi():
+    with patch('databricks.DataBricksClusterOps.ClusterApi') as mock:
+        mock.return_value.list_clusters.return_value = {'clusters': [dict(c) for c in CLUSTERS]}
+        yield mock
+
+
+def test_listing_is_shared_between_instances(cache, MockClusterApi):
+    first = DataBricksClusterOps('https://test-host', 'token', cache=cache)
+    assert first.get_clusters() == CLUSTERS
+
+    # a second process (new instance, same cache file) does not re-list the fleet
+    second = DataBricksClusterOps('https://test-host', 'token',
+                                  cache=ClusterCache('https://test-host', ttl_seconds=60, cache_dir=str(cache.path.parent)))
+    assert second.get_clusters() == CLUSTERS
+    assert MockClusterApi.return_value.list_clusters.call_count == 1
+
+    # ... unless it asks for fresh state
+    second.get_clusters(max_age=0)
+    assert MockClusterApi.return_value.list_clusters.call_count == 2
+
+
+def test_expired_listing_is_refetched(cache, MockClusterApi):
+    ops = DataBricksClusterOps('https://test-host', 'token', cache=cache)
+    ops.get_clusters()
+    state = json.loads(cache.path.read_text())
+    state['fetched_at'] -= 61
+    cache.path.write_text(json.dumps(state))
+
+    ops.get_clusters()
+    assert MockClusterApi.return_value.list_clusters.call_count == 2
+
+
+def test_mutation_refreshes_only_the_changed_cluster(cache, MockClusterApi):
+    api = MockClusterApi.return_value
+    ops = DataBricksClusterOps('https://test-host', 'token', cache=cache)
+    ops.get_clusters()
+
+    ops.delete_cluster('cluster_01')  # terminate
+    api.get_cluster.return_value = {'cluster_id': '1', 'cluster_name': 'cluster_01', 'state': 'TERMINATING'}
+    clusters = {c['cluster_id']: c for c in ops.get_clusters()}
+
+    api.get_cluster.assert_called_once_with('1')
+    assert api.list_clusters.call_count == 1
+    assert clusters['1']['state'] == 'TERMINATING'
+
+    # the refreshed copy is in the shared file, so it is not fetched again
+    ops.get_clusters()
+    assert api.get_cluster.call_count == 1
+
+    ops.permanent_delete_cluster('2')
+    assert [c['cluster_id'] for c in ops.get_clusters()] == ['1']
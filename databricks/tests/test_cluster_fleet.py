@@ -0,0 +1,72 @@
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from databricks.DataBricksClusterOps import DataBricksClusterOps
+from databricks.cluster_fleet import create_cluster_fleet, format_fleet_report
+
+
+def make_client(existing=()):
+    """A fake workspace: created clusters are PENDING in the first list call, TERMINATED afterwards"""
+    client = MagicMock()
+    client.ClusterPermission = DataBricksClusterOps.ClusterPermission
+    client.cluster_spec.side_effect = DataBricksClusterOps.cluster_spec
+    clusters = {f"id-{n}": {'cluster_id': f"id-{n}", 'cluster_name': n, 'state': 'TERMINATED'} for n in existing}
+    list_calls = []
+
+    def create(spec):
+        if spec['cluster_name'] == 'cluster_03':
+            raise requests.HTTPError('400 Client Error')
+        cid = f"id-{spec['cluster_name']}"
+        clusters[cid] = {'cluster_id': cid, 'cluster_name': spec['cluster_name'], 'state': 'PENDING'}
+        return {'cluster_id': cid}
+
+    def get_clusters(max_age=None):
+        list_calls.append(max_age)
+        if len(list_calls) > 2:
+            for c in clusters.values():
+                c['state'] = 'TERMINATED'
+        return [dict(c) for c in clusters.values()]
+
+    client.create_cluster_from_spec.side_effect = create
+    client.get_clusters.side_effect = get_clusters
+    return client, list_calls
+
+
+@patch('databricks.cluster_fleet.time.sleep')
+def test_fleet_is_created_configured_and_tracked_with_list_calls(mock_sleep):
+    client, list_calls = make_client(existing=['cluster_01'])
+    names = ['cluster_01', 'cluster_02', 'cluster_03', 'cluster_04']
+
+    results = create_cluster_fleet(client, names, autotermination_minutes=22, poll_interval=1)
+
+    by_name = {r.name: r for r in results}
+    assert by_name['cluster_01'].skipped
+    assert by_name['cluster_03'].error and by_name['cluster_03'].cluster_id is None
+    for name in ('cluster_02', 'cluster_04'):
+        r = by_name[name]
+        assert r.error is None and r.state == 'TERMINATED'
+        assert [s for _, s in r.transitions] == ['PENDING', 'TERMINATED']
+    specs = [c.args[0] for c in client.create_cluster_from_spec.call_args_list]
+    assert all(s['autotermination_minutes'] == 22 for s in specs)
+    assert sorted(c.args[0] for c in client.terminate_cluster.call_args_list) == ['id-cluster_02', 'id-cluster_04']
+    assert client.pin_cluster.call_count == 2
+    assert sorted(c.kwargs['group_name'] for c in client.set_cluster_permission.call_args_list) == ['group_02', 'group_04']
+    # 1 list to find existing clusters + 2 tracking rounds. No per-cluster get.
+    assert list_calls == [0, 0, 0]
+    client.get_cluster.assert_not_called()
+    assert 'created 2, failed 1, skipped 1' in format_fleet_report(results)
+
+
+@patch('databricks.cluster_fleet.time.monotonic', side_effect=range(0, 10000, 100))
+@patch('databricks.cluster_fleet.time.sleep')
+def test_fleet_tracking_times_out(mock_sleep, mock_time):
+    client, _ = make_client()
+    created = []
+    client.create_cluster_from_spec.side_effect = lambda spec: created.append(spec) or {'cluster_id': 'id-1'}
+    client.get_clusters.side_effect = lambda max_age=None: [
+        {'cluster_id': 'id-1', 'cluster_name': s['cluster_name'], 'state': 'PENDING'} for s in created]
+
+    results = create_cluster_fleet(client, ['cluster_02'], timeout=250, poll_interval=1)
+
+    assert results[0].error.startswith('timeout')
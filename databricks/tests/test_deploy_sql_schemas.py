@@ -0,0 +1,115 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from databricks.deploy_sql_schemas import (GroupPrincipals, SchemaState, Statement, apply_plan, fetch_state,
+                                           plan_provisioning, schema_name, service_principals,
+                                           with_service_principals)
+
+FULL = {"USE SCHEMA", "CREATE TABLE", "SELECT", "MODIFY"}
+SP = {"USE SCHEMA", "CREATE TABLE", "SELECT"}
+
+
+def test_fetch_state_reads_everything_in_three_queries():
+    cursor = MagicMock()
+    cursor.fetchall.side_effect = [
+        [("schema_01",), ("Default",)],
+        [("schema_01", "Alice@x.com", "SELECT"), ("schema_01", "alice@x.com", "MODIFY")],
+        [("alice@x.com", "USE CATALOG")],
+    ]
+    state = fetch_state(cursor, "lab")
+    assert cursor.execute.call_count == 3
+    assert state.schemas == {"schema_01", "default"}
+    assert state.schema_grants == {("schema_01", "alice@x.com"): {"SELECT", "MODIFY"}}
+    assert state.catalog_grants == {"alice@x.com": {"USE CATALOG"}}
+
+
+def test_schema_name_follows_the_group_number():
+    assert schema_name("group_07") == "schema_07"
+    assert schema_name("group_123") == "schema_123"
+    with pytest.raises(ValueError):
+        schema_name("admins")
+
+
+def test_plan_grants_each_member_and_the_sp():
+    state = SchemaState(
+        schemas={"schema_01"},
+        schema_grants={("schema_01", "a@x.com"): FULL, ("schema_01", "sp-1"): SP},
+        catalog_grants={"a@x.com": {"USE CATALOG", "BROWSE"}, "sp-1": {"USE CATALOG"}})
+    groups = [GroupPrincipals("group_01", ("a@x.com",), "sp-1"),
+              GroupPrincipals("group_02", ("b@x.com", "c@x.com"), "sp-2")]
+    assert [s.sql for s in plan_provisioning("lab", groups, state)] == [
+        "CREATE SCHEMA IF NOT EXISTS `lab`.`schema_02`",
+        "GRANT USE CATALOG, BROWSE ON CATALOG `lab` TO `b@x.com`",
+        "GRANT USE SCHEMA, CREATE TABLE, SELECT, MODIFY ON SCHEMA `lab`.`schema_02` TO `b@x.com`",
+        "GRANT USE CATALOG, BROWSE ON CATALOG `lab` TO `c@x.com`",
+        "GRANT USE SCHEMA, CREATE TABLE, SELECT, MODIFY ON SCHEMA `lab`.`schema_02` TO `c@x.com`",
+        "GRANT USE CATALOG ON CATALOG `lab` TO `sp-2`",
+        "GRANT USE SCHEMA, CREATE TABLE, SELECT ON SCHEMA `lab`.`schema_02` TO `sp-2`",
+    ]
+
+
+def test_plan_diffs_the_privileges_per_principal():
+    state = SchemaState(
+        schemas={"schema_01"},
+        schema_grants={("schema_01", "a@x.com"): FULL, ("schema_01", "b@x.com"): {"SELECT"},
+                       ("schema_01", "sp-1"): {"ALL PRIVILEGES"}},
+        catalog_grants={"a@x.com": {"USE CATALOG", "BROWSE"}, "b@x.com": {"USE CATALOG"}, "sp-1": {"USE CATALOG"}})
+    # a new student joined the group, another one is missing a few privileges
+    groups = [GroupPrincipals("group_01", ("A@x.com", "b@x.com", "new@x.com"), "sp-1")]
+    assert [s.sql for s in plan_provisioning("lab", groups, state)] == [
+        "GRANT BROWSE ON CATALOG `lab` TO `b@x.com`",
+        "GRANT USE SCHEMA, CREATE TABLE, MODIFY ON SCHEMA `lab`.`schema_01` TO `b@x.com`",
+        "GRANT USE CATALOG, BROWSE ON CATALOG `lab` TO `new@x.com`",
+        "GRANT USE SCHEMA, CREATE TABLE, SELECT, MODIFY ON SCHEMA `lab`.`schema_01` TO `new@x.com`",
+    ]
+
+
+def test_provisioned_catalog_needs_nothing():
+    groups = [GroupPrincipals(f"group_{i:02d}", (f"s{i}@x.com",), f"sp-{i}") for i in range(1, 41)]
+    state = SchemaState(schemas={g.schema for g in groups},
+                        schema_grants={**{(g.schema, g.members[0]): FULL for g in groups},
+                                       **{(g.schema, g.sp_application_id): SP for g in groups}},
+                        catalog_grants={**{g.members[0]: {"USE CATALOG", "BROWSE"} for g in groups},
+                                        **{g.sp_application_id: {"USE CATALOG"} for g in groups}})
+    assert plan_provisioning("lab", groups, state) == []
+
+
+def test_groups_without_sp_are_granted_to_their_members():
+    groups = with_service_principals([GroupPrincipals("group_01", ("a@x.com",)),
+                                      GroupPrincipals("group_02", ("b@x.com",))], {"sp_01": "sp-1"})
+    assert [g.sp_application_id for g in groups] == ["sp-1", None]
+    plan = plan_provisioning("lab", groups[1:], SchemaState())
+    assert not any("None" in s.sql for s in plan)
+
+
+def test_service_principals_are_read_with_the_paged_scim_listing():
+    groups_api = MagicMock()
+    groups_api.iter_service_principals.return_value = iter(
+        [{"displayName": f"sp_{i:02}", "applicationId": f"sp-{i}"} for i in range(1, 151)])
+    sp_ids = service_principals(groups_api)
+    assert len(sp_ids) == 150 and sp_ids["sp_150"] == "sp-150"
+    assert groups_api.iter_service_principals.call_args.kwargs["filter_"] == 'displayName sw "sp_"'
+
+
+def test_apply_plan_skips_the_grants_of_a_failed_schema():
+    executed = []
+
+    def connect():
+        connection = MagicMock()
+        cursor = connection.cursor.return_value.__enter__.return_value
+
+        def execute(sql):
+            if "schema_02" in sql and sql.startswith("CREATE"):
+                raise RuntimeError("PERMISSION_DENIED")
+            executed.append(sql)
+        cursor.execute.side_effect = execute
+        return connection
+
+    groups = [GroupPrincipals("group_01", ("a@x.com",)), GroupPrincipals("group_02", ("b@x.com",))]
+    results = apply_plan(connect, plan_provisioning("lab", groups, SchemaState()), max_workers=2)
+    errors = [s.sql for s, e in results if e]
+    assert errors == ["CREATE SCHEMA IF NOT EXISTS `lab`.`schema_02`"]
+    assert not any("schema_02" in sql or "b@x.com" in sql for sql in executed)
+    assert len(executed) == 3   # group_01: schema, catalog grant, schema grant
+    assert all(isinstance(s, Statement) for s, _ in results)
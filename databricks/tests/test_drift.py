@@ -0,0 +1,96 @@
+import json
+from unittest.mock import MagicMock
+
+import requests
+
+from databricks.drift import detect_drift, format_report, load_state
+
+
+def instance(attributes, index_key=None):
+    return {"index_key": index_key, "attributes": attributes} if index_key is not None else {"attributes": attributes}
+
+
+STATE = {
+    "version": 4,
+    "resources": [
+        {"mode": "data", "type": "local_file", "name": "csv", "instances": [instance({"id": "x"})]},
+        {"mode": "managed", "type": "databricks_user", "name": "workspace_user", "instances": [
+            instance({"id": "u1", "user_name": "a@x.com", "active": True}, "a@x.com"),
+            instance({"id": "u2", "user_name": "gone@x.com", "active": True}, "gone@x.com")]},
+        {"mode": "managed", "type": "databricks_group", "name": "student_groups", "instances": [
+            instance({"id": "g1", "display_name": "group_01"}, "group_01")]},
+        {"mode": "managed", "type": "databricks_group_member", "name": "student_assignments", "instances": [
+            instance({"id": "g1|u1", "group_id": "g1", "member_id": "u1"}, "group_01_a@x.com"),
+            instance({"id": "g1|u2", "group_id": "g1", "member_id": "u2"}, "group_01_gone@x.com")]},
+        {"mode": "managed", "type": "databricks_cluster", "name": "clusters", "instances": [
+            instance({"id": "c1", "cluster_id": "c1", "cluster_name": "cluster_01", "spark_version": "15.4.x",
+                      "autotermination_minutes": 20, "autoscale": [{"min_workers": 1, "max_workers": 2}]}, "01")]},
+        {"mode": "managed", "type": "databricks_permissions", "name": "cluster_permissions", "instances": [
+            instance({"id": "/clusters/c1", "cluster_id": "c1",
+                      "access_control": [{"group_name": "group_01", "permission_level": "CAN_RESTART"}]}, "group_01"),
+            instance({"id": "/clusters/c9", "cluster_id": "c9",
+                      "access_control": [{"group_name": "group_09", "permission_level": "CAN_RESTART"}]}, "group_09")]},
+        {"mode": "managed", "type": "databricks_cluster_policy", "name": "personal_compute",
+         "instances": [instance({"id": "p1"})]},
+    ],
+}
+
+
+def make_apis():
+    groups_api, cluster_api = MagicMock(), MagicMock()
+    groups_api.iter_users.return_value = iter([{"id": "u1", "userName": "A@x.com", "active": True}])
+    groups_api.iter_groups.return_value = iter([{"id": "g1", "displayName": "group_01", "members": [{"value": "u1"}]}])
+    cluster_api.get_clusters.return_value = [
+        {"cluster_id": "c1", "cluster_name": "cluster_01", "spark_version": "15.4.x", "autotermination_minutes": 60,
+         "autoscale": {"min_workers": 1, "max_workers": 2}}]
+
+    def permissions(cluster_id):
+        if cluster_id == "c9":
+            raise requests.HTTPError(response=MagicMock(status_code=404))
+        return {"access_control_list": [
+            {"group_name": "group_01", "all_permissions": [{"permission_level": "CAN_ATTACH_TO", "inherited": False}]},
+            {"group_name": "admins", "all_permissions": [{"permission_level": "CAN_MANAGE", "inherited": True}]}]}
+    cluster_api.get_cluster_permission.side_effect = permissions
+    return groups_api, cluster_api
+
+
+def test_load_state_builds_addresses(tmp_path):
+    filename = tmp_path / "dev.tfstate"
+    filename.write_text(json.dumps(STATE))
+    resources = load_state(str(filename))
+    addresses = [r.address for r in resources]
+    assert 'databricks_user.workspace_user["a@x.com"]' in addresses
+    assert 'databricks_cluster_policy.personal_compute' in addresses
+    assert not any(r.type == "local_file" for r in resources)
+
+
+def test_drift_is_reported_per_resource(tmp_path):
+    filename = tmp_path / "dev.tfstate"
+    filename.write_text(json.dumps(STATE))
+    groups_api, cluster_api = make_apis()
+
+    report = detect_drift(load_state(str(filename)), groups_api, cluster_api)
+
+    drifts = {d.address: d for d in report.drifts}
+    assert set(drifts) == {
+        'databricks_user.workspace_user["gone@x.com"]',
+        'databricks_group_member.student_assignments["group_01_gone@x.com"]',
+        'databricks_cluster.clusters["01"]',
+        'databricks_permissions.cluster_permissions["group_01"]',
+        'databricks_permissions.cluster_permissions["group_09"]',
+    }
+    assert drifts['databricks_user.workspace_user["gone@x.com"]'].kind == 'missing'
+    assert drifts['databricks_cluster.clusters["01"]'].changes == [('autotermination_minutes', 20, 60)]
+    assert drifts['databricks_permissions.cluster_permissions["group_01"]'].changes == \
+        [('group_01', 'CAN_RESTART', 'CAN_ATTACH_TO')]
+    assert drifts['databricks_permissions.cluster_permissions["group_09"]'].kind == 'missing'
+    assert report.checked == {'databricks_user': 2, 'databricks_group': 1, 'databricks_group_member': 2,
+                              'databricks_cluster': 1, 'databricks_permissions': 2}
+    assert report.unchecked == {'databricks_cluster_policy': 1}
+
+    # one listing per type, one ACL read per cluster
+    cluster_api.get_clusters.assert_called_once_with(max_age=0)
+    groups_api.iter_groups.assert_called_once()
+    groups_api.iter_service_principals.assert_not_called()
+    assert cluster_api.get_cluster_permission.call_count == 2
+    assert "databricks_cluster_policy (1)" in format_report(report)
@@ -0,0 +1,85 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from databricks.fleet_ops import ClusterSelector, run_fleet_operation, operation_by_name, format_results
+
+CLUSTERS = [
+    {'cluster_id': 'a', 'cluster_name': 'cluster_01', 'state': 'TERMINATED', 'custom_tags': {'course': 'nlp'}},
+    {'cluster_id': 'b', 'cluster_name': 'cluster_02', 'state': 'RUNNING', 'custom_tags': {'course': 'nlp'}},
+    {'cluster_id': 'c', 'cluster_name': 'cluster_03', 'state': 'TERMINATED'},
+    {'cluster_id': 'd', 'cluster_name': 'admin cluster', 'state': 'TERMINATED'},
+]
+
+
+@pytest.fixture(autouse=True)
+def no_sleep():
+    with patch('databricks.fleet_ops.time.sleep') as sleep:
+        yield sleep
+
+
+def make_client():
+    client = MagicMock()
+    client.get_clusters.return_value = CLUSTERS
+    return client
+
+
+def test_selector_filters_by_name_state_and_tag():
+    selector = ClusterSelector.from_args(r'^cluster_\d{2}$', 'terminated', ['course=nlp'])
+    assert [c['cluster_id'] for c in CLUSTERS if selector.matches(c)] == ['a']
+    assert [c['cluster_id'] for c in CLUSTERS if ClusterSelector().matches(c)] == ['a', 'b', 'c', 'd']
+
+
+def test_transient_failures_are_retried_per_cluster():
+    client = make_client()
+    calls = []
+
+    def flaky(client, cluster):
+        calls.append(cluster['cluster_id'])
+        if cluster['cluster_id'] == 'b' and calls.count('b') < 3:
+            raise requests.ConnectionError('reset')
+        if cluster['cluster_id'] == 'c':
+            response = requests.Response()
+            response.status_code = 400
+            return response
+        if cluster['cluster_id'] == 'a' and calls.count('a') < 2:
+            response = requests.Response()
+            response.status_code = 503
+            return response
+
+    results = {r.cluster_id: r for r in run_fleet_operation(client, flaky, ClusterSelector(name_regex='^cluster_'),
+                                                            retries=2, progress=False)}
+
+    assert results['b'].status == 'ok' and results['b'].attempts == 3
+    # a 4xx would fail again: no retry
+    assert results['c'].status == 'failed' and results['c'].attempts == 1
+    assert results['a'].status == 'ok' and results['a'].attempts == 2
+    assert 'd' not in results
+    assert 'failed=1, ok=2' in format_results(list(results.values()))
+
+
+def test_checkpoint_resumes_and_is_removed_on_success(tmp_path):
+    ckpt = tmp_path / 'pin.json'
+    client = make_client()
+    client.pin_cluster.side_effect = lambda c: (_ for _ in ()).throw(RuntimeError('boom')) if c['cluster_id'] == 'c' else None
+    pin = operation_by_name('pin')
+
+    run_fleet_operation(client, pin, checkpoint=str(ckpt), retries=0, progress=False)
+    assert json.loads(ckpt.read_text()) == {'operation': 'pin', 'done': ['a', 'b', 'd']}
+
+    client.pin_cluster.reset_mock(side_effect=True)
+    results = run_fleet_operation(client, pin, checkpoint=str(ckpt), retries=0, progress=False)
+
+    assert [c.args[0]['cluster_id'] for c in client.pin_cluster.call_args_list] == ['c']
+    assert sorted(r.status for r in results) == ['done before', 'done before', 'done before', 'ok']
+    assert not ckpt.exists()
+
+
+def test_operation_by_name():
+    client = make_client()
+    operation_by_name('auto_termination', 22)(client, CLUSTERS[0])
+    client.update_auto_termination.assert_called_once_with(CLUSTERS[0], 22)
+    with pytest.raises(ValueError):
+        operation_by_name('auto_termination')
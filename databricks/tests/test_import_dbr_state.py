@@ -0,0 +1,92 @@
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+UTILS = Path(__file__).resolve().parents[2] / "terraform" / "dbr" / "utils"
+
+
+@pytest.fixture
+def importer(monkeypatch):
+    """import_dbr_state.py is a standalone script: import it from terraform/dbr/utils"""
+    monkeypatch.syspath_prepend(str(UTILS))
+    monkeypatch.delitem(sys.modules, "import_dbr_state", raising=False)
+    return importlib.import_module("import_dbr_state")
+
+
+WS = {
+    "users": [{"id": "u1", "userName": "a@x.com"}, {"id": "u2", "userName": "b@x.com"},
+              {"id": "u9", "userName": "admin@x.com"}],
+    "groups": [
+        {"id": "g1", "displayName": "group_01", "members": [{"value": "u1"}, {"value": "u2"}]},
+        {"id": "g2", "displayName": "group_02", "members": []},
+        {"id": "gm", "displayName": "all_student_groups", "members": [{"value": "g1"}]},
+        {"id": "ga", "displayName": "admins", "members": [{"value": "u9"}]},
+    ],
+    "sps": [{"id": "s1", "displayName": "sp_01", "applicationId": "app-1"}, {"id": "s9", "displayName": "other"}],
+    "clusters": [{"cluster_id": "c2", "cluster_name": "cluster_02"}, {"cluster_id": "c1", "cluster_name": "cluster_01"},
+                 {"cluster_id": "cx", "cluster_name": "admin cluster"}],
+    "cluster_acls": {"c1": [{"group_name": "group_01", "all_permissions": [{"permission_level": "CAN_RESTART"}]}],
+                     "c2": []},
+    "warehouses": [{"id": "w1", "name": "shared"}],
+    "schemas": [{"name": "schema_01"}, {"name": "default"}],
+}
+
+BASE = [
+    ('databricks_group_member.student_assignments["group_01_a@x.com"]', "g1|u1"),
+    ('databricks_group_member.student_assignments["group_01_b@x.com"]', "g1|u2"),
+    ('databricks_user.workspace_user["a@x.com"]', "u1"),
+    ('databricks_user.workspace_user["b@x.com"]', "u2"),
+    ('databricks_group.student_groups["group_01"]', "g1"),
+    ('databricks_group.student_groups["group_02"]', "g2"),
+    ("databricks_group.all_student_groups", "gm"),
+    ('databricks_group_member.all_students_group_assignment["group_01"]', "gm|g1"),
+    ('databricks_cluster.clusters["01"]', "c1"),
+]
+
+
+def test_import_blocks_without_uc(importer):
+    assert importer.import_blocks(WS) == BASE + [
+        ('databricks_permissions.cluster_permissions["group_01"]', "/clusters/c1"),
+        ('databricks_cluster.clusters["02"]', "c2"),
+    ]
+
+
+def test_import_blocks_with_uc(importer):
+    blocks = importer.import_blocks(WS, uc=True, catalog="lab", warehouse_name="shared")
+    assert blocks == BASE + [
+        ('module.uc_setup[0].databricks_permissions.cluster_permissions["01"]', "/clusters/c1"),
+        ('databricks_cluster.clusters["02"]', "c2"),
+        ('module.uc_setup[0].databricks_service_principal.group_sps["01"]', "s1"),
+        ("module.uc_setup[0].databricks_sql_endpoint.shared_warehouse", "w1"),
+        ("module.uc_setup[0].databricks_permissions.warehouse_usage", "/sql/warehouses/w1"),
+        ("module.uc_setup[0].databricks_grants.catalog_grants", "catalog/lab"),
+        ('module.uc_setup[0].databricks_schema.group_schemas["01"]', "lab.schema_01"),
+        ('module.uc_setup[0].databricks_grants.schema_grants["01"]', "schema/lab.schema_01"),
+    ]
+    assert importer.render(blocks[:1]).endswith(
+        'import {\n  to = databricks_group_member.student_assignments["group_01_a@x.com"]\n  id = "g1|u1"\n}\n')
+
+
+def fake_scim(resources, total=None, cap=50):
+    """A SCIM endpoint that returns at most `cap` resources per page, whatever count was asked"""
+    def get(path, startIndex, count, attributes):
+        page = resources[startIndex - 1:startIndex - 1 + min(count, cap)]
+        return {"Resources": page, "totalResults": len(resources) if total is None else total,
+                "itemsPerPage": len(page), "startIndex": startIndex}
+    return get
+
+
+def test_scim_pages_by_the_size_the_server_returns(importer):
+    reader = importer.WorkspaceReader("adb-1.azuredatabricks.net", "t")
+    users = [{"id": str(i)} for i in range(120)]
+    reader.get = fake_scim(users)
+    assert reader.scim("Users", "id", page_size=100) == users
+
+
+def test_scim_raises_when_the_total_does_not_match(importer):
+    reader = importer.WorkspaceReader("adb-1.azuredatabricks.net", "t")
+    reader.get = fake_scim([{"id": str(i)} for i in range(120)], total=130)   # 10 users deleted during the listing
+    with pytest.raises(RuntimeError, match="read 120 of 130"):
+        reader.scim("Users", "id", page_size=100)
@@ -0,0 +1,55 @@
+from unittest.mock import MagicMock, patch
+
+from databricks.library_tracker import LibraryTracker, library_key
+
+SPACY = {"pypi": {"package": "spacy"}}
+NLP = {"maven": {"coordinates": "com.johnsnowlabs.nlp:spark-nlp_2.12:5.1.2"}}
+
+
+def statuses(*rounds):
+    """each round: {cluster_id: {library key: status}}"""
+    specs = {library_key(SPACY): SPACY, library_key(NLP): NLP}
+    return [[{'cluster_id': cid, 'library_statuses': [{'library': specs[k], 'status': st, 'messages': ['oops'] if st == 'FAILED' else []}
+                                                      for k, st in libs.items()]}
+             for cid, libs in r.items()] for r in rounds]
+
+
+def make_client(rounds):
+    client = MagicMock()
+    client.get_clusters.return_value = [
+        {'cluster_id': 'a', 'cluster_name': 'cluster_01', 'state': 'RUNNING'},
+        {'cluster_id': 'b', 'cluster_name': 'cluster_02', 'state': 'RUNNING'},
+        {'cluster_id': 'c', 'cluster_name': 'cluster_03', 'state': 'TERMINATED'},
+    ]
+    client.get_all_library_statuses.side_effect = statuses(*rounds)
+    return client
+
+
+@patch('databricks.library_tracker.time.sleep')
+def test_wait_tracks_transitions_and_reports_failures(mock_sleep):
+    s, n = library_key(SPACY), library_key(NLP)
+    client = make_client([
+        {'a': {s: 'PENDING', n: 'PENDING'}, 'b': {s: 'PENDING', n: 'PENDING'}, 'c': {s: 'PENDING', n: 'PENDING'}},
+        {'a': {s: 'INSTALLING', n: 'PENDING'}, 'b': {s: 'PENDING', n: 'PENDING'}, 'c': {s: 'PENDING', n: 'PENDING'}},
+        {'a': {s: 'INSTALLING', n: 'PENDING'}, 'b': {s: 'PENDING', n: 'PENDING'}, 'c': {s: 'PENDING', n: 'PENDING'}},
+        {'a': {s: 'INSTALLED', n: 'INSTALLED'}, 'b': {s: 'INSTALLED', n: 'FAILED'}, 'c': {s: 'PENDING', n: 'PENDING'}},
+    ])
+    tracker = LibraryTracker(client, expected=[SPACY, NLP])
+
+    assert tracker.wait(min_interval=1, max_interval=10, backoff=2) is False
+
+    assert client.get_all_library_statuses.call_count == 4
+    # the interval is reset after a round with changes, and grows after a quiet round
+    assert [c.args[0] for c in mock_sleep.call_args_list] == [1, 1, 2]
+    assert [t[4] for t in tracker.transitions if t[1] == 'a' and t[2] == s] == ['PENDING', 'INSTALLING', 'INSTALLED']
+    report = tracker.failure_report()
+    assert 'cluster_02' in report and 'FAILED' in report and 'oops' in report
+    assert 'waiting for cluster start' in report   # cluster_03 is terminated
+
+
+def test_expected_library_missing_is_a_failure_after_the_grace_period():
+    client = make_client([{'a': {library_key(SPACY): 'INSTALLED'}}])
+    tracker = LibraryTracker(client, expected=[SPACY, NLP], cluster_ids={'a'}, report_grace=0)
+
+    assert tracker.wait() is False
+    assert [(c, lib, st.status) for c, lib, st in tracker.failures()] == [('a', library_key(NLP), 'NOT_REPORTED')]
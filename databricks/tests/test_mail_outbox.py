@@ -0,0 +1,91 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from peewee import SqliteDatabase
+
+from databricks.database.db_operations import OutboxMessage
+from databricks.resource_manager.mail_outbox import OutboxSender, enqueue_email
+
+
+@pytest.fixture()
+def outbox_db(tmp_path):
+    # a file DB: the background sender uses its own connection
+    db = SqliteDatabase(str(tmp_path / "outbox.db"))
+    OutboxMessage.bind(db)
+    db.create_tables([OutboxMessage])
+    yield db
+    db.close()
+    OutboxMessage.bind(None)
+
+
+class FakeTransport:
+    def __init__(self, fail_for=()):
+        self.fail_for = set(fail_for)
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def __call__(self, subject, body_html, to, cc):
+        if self.fail_for & set(to):
+            raise ConnectionError("mail service unavailable")
+        with self.lock:
+            self.sent.append((subject, tuple(to), tuple(cc)))
+
+
+def test_admin_cc_is_digested_and_failures_are_retried(outbox_db, monkeypatch):
+    monkeypatch.setenv('ADMIN_EMAIL', 'admin@x.com')
+    enqueue_email("cluster_01 warning", "<p>1</p>", ["a@x.com"])
+    enqueue_email("cluster_02 warning", "<p>2</p>", ["b@x.com"])
+    enqueue_email("crash", "<pre>trace</pre>", [], cc=['admin@x.com'])
+    transport = FakeTransport(fail_for={"b@x.com"})
+    sender = OutboxSender(send=transport, max_attempts=2)
+
+    assert sender.send_pending() == {'sent': 3, 'retry': 1, 'failed': 0}
+    sent = {s[0]: s for s in transport.sent}
+    assert sent["cluster_01 warning"] == ("cluster_01 warning", ("a@x.com",), ())
+    assert sent["crash"] == ("crash", (), ("admin@x.com",))
+    assert sent["Digest: 2 notices"][1] == ("admin@x.com",)
+
+    # the retry is not due yet
+    assert sender.send_pending() == {'sent': 0, 'retry': 0, 'failed': 0}
+    OutboxMessage.update(next_attempt=datetime.now() - timedelta(seconds=1)).execute()
+    assert sender.send_pending() == {'sent': 0, 'retry': 0, 'failed': 1}
+    failed = OutboxMessage.get(OutboxMessage.subject == "cluster_02 warning")
+    assert (failed.status, failed.attempts) == (OutboxMessage.FAILED, 2)
+    assert "unavailable" in failed.last_error
+
+
+def test_background_sender_drains_on_stop(outbox_db, monkeypatch):
+    monkeypatch.delenv('ADMIN_EMAIL', raising=False)
+    transport = FakeTransport()
+    sender = OutboxSender(send=transport).start(interval=60, linger=0)
+    for i in range(5):
+        enqueue_email(f"notice {i}", "<p></p>", [f"u{i}@x.com"])
+    assert enqueue_email("nobody", "<p></p>", []) is None
+
+    assert sender.stop(timeout=10) == 0
+    assert sorted(s[0] for s in transport.sent) == [f"notice {i}" for i in range(5)]
+    assert OutboxMessage.select().where(OutboxMessage.status == OutboxMessage.SENT).count() == 5
+
+
+def test_crash_report_is_sent_directly_when_the_outbox_cannot(outbox_db, monkeypatch):
+    from databricks import poll_clusters
+    from databricks.resource_manager import user_mail
+
+    monkeypatch.setenv('ADMIN_EMAIL', 'admin@x.com')
+    direct = []
+    monkeypatch.setattr(user_mail, "send_message", FakeTransport(fail_for={"admin@x.com"}))   # the mail service is down
+    monkeypatch.setattr(poll_clusters, "send_emails", lambda *args, **kwargs: direct.append((args, kwargs)))
+
+    poll_clusters.notify_crash("<pre>trace</pre>")
+
+    assert len(direct) == 1 and direct[0][1]["recipients"] == ["admin@x.com"]
+    # the queued copy is not sent again by the next run
+    assert OutboxMessage.select().where(OutboxMessage.status == OutboxMessage.PENDING).count() == 0
+
+    # the outbox works: no direct send
+    direct.clear()
+    transport = FakeTransport()
+    monkeypatch.setattr(user_mail, "send_message", transport)
+    poll_clusters.notify_crash("<pre>trace</pre>")
+    assert not direct and transport.sent == [("Poll clusters crashed!", ("admin@x.com",), ())]
@@ -0,0 +1,88 @@
+import smtplib
+
+import pytest
+
+from databricks.resource_manager import user_mail
+from databricks.resource_manager.mail_load_test import run
+from databricks.resource_manager.user_mail import (FileTransport, MailTransport, MemoryTransport, SmtpTransport,
+                                                   send_emails, set_transport, transport_from_env)
+
+
+class FakeSMTP:
+    opened = []
+
+    def __init__(self, host, port, timeout=None):
+        self.sent = []
+        self.closed = False
+        FakeSMTP.opened.append(self)
+
+    def send_message(self, msg):
+        if self.closed:
+            raise smtplib.SMTPServerDisconnected()
+        self.sent.append(msg)
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+def test_transport_is_selected_by_configuration(monkeypatch, tmp_path):
+    monkeypatch.setenv('MAIL_TRANSPORT', 'file')
+    monkeypatch.setenv('MAIL_DIR', str(tmp_path))
+    monkeypatch.setenv('MAIL_SENDER', 'lab@x.com')
+    transport = transport_from_env()
+    assert isinstance(transport, FileTransport)
+    eml = transport.send("hello", "<p>hi</p>", ["a@x.com"], ["admin@x.com"])
+    text = open(eml).read()
+    assert "From: lab@x.com" in text and "Cc: admin@x.com" in text
+
+    monkeypatch.setenv('MAIL_TRANSPORT', 'smtp')
+    with pytest.raises(EnvironmentError):
+        transport_from_env()
+    monkeypatch.setenv('MAIL_TRANSPORT', 'pigeon')
+    with pytest.raises(ValueError):
+        transport_from_env()
+
+    memory = MemoryTransport()
+    monkeypatch.setenv('ADMIN_EMAIL', 'admin@x.com')
+    set_transport(memory)
+    try:
+        send_emails("s", "<p>b</p>", ["a@x.com"], logger=None)
+    finally:
+        set_transport(None)
+    assert memory.messages == [("s", "<p>b</p>", ["a@x.com"], ["admin@x.com"])]
+
+    class NoSend(MailTransport):
+        name = 'incomplete'
+    with pytest.raises(TypeError):
+        NoSend()
+
+
+def test_smtp_connections_are_reused(monkeypatch):
+    FakeSMTP.opened = []
+    monkeypatch.setattr(user_mail.smtplib, 'SMTP', FakeSMTP)
+    transport = SmtpTransport("localhost", 2525, connections=2)
+    for i in range(5):
+        transport.send(f"m{i}", "<p></p>", ["a@x.com"], [])
+    assert transport.connections_opened == 1
+
+    # the server dropped the idle connection: it is reopened
+    FakeSMTP.opened[0].closed = True
+    transport.send("again", "<p></p>", ["a@x.com"], [])
+    assert transport.connections_opened == 2
+    transport.close()
+    assert all(s.closed for s in FakeSMTP.opened)
+
+    no_reuse = SmtpTransport("localhost", 2525, reuse=False)
+    for i in range(3):
+        no_reuse.send(f"m{i}", "<p></p>", ["a@x.com"], [])
+    assert no_reuse.connections_opened == 3
+
+
+def test_load_test_harness():
+    memory = MemoryTransport()
+    result = run(memory, messages=20, workers=4)
+    assert (len(result.latencies), result.digests, result.failed) == (21, 1, 0)
+    assert len(memory.messages) == 21
@@ -11,7 +11,7 @@ from peewee import SqliteDatabase
 from databricks.poll_clusters import main, check_update_running_clusters, get_emails_address
 
 # Import models and ORM helpers
-from databricks.database.db_operations import ClusterUptime, ClusterCumulativeUptime, ClusterInfo
+from databricks.database.db_operations import ClusterUptime, MODELS
 from databricks.resource_manager.cluster_uptime import get_or_create_cluster_record
 
 
@@ -27,25 +27,29 @@ def setup_teardown_db():
     and handles connection management.
     """
     # 1. BIND to the TEST_DB
-    ClusterUptime.bind(TEST_DB)
-    ClusterCumulativeUptime.bind(TEST_DB)
-    ClusterInfo.bind(TEST_DB)
+    for model in MODELS:
+        model.bind(TEST_DB)
 
     with TEST_DB.connection_context():
         # 2. CONNECT & CREATE
         # TEST_DB.connect() Already done in the context manager above
-        TEST_DB.create_tables([ClusterUptime, ClusterCumulativeUptime, ClusterInfo])
+        TEST_DB.create_tables(MODELS)
         yield
 
         # 3. TEARDOWN (Unbind and close)
-        TEST_DB.drop_tables([ClusterUptime, ClusterCumulativeUptime, ClusterInfo])
+        TEST_DB.drop_tables(MODELS)
     #TEST_DB.close()
 
     # 4. CRITICAL: Unbind models to clear the global class state completely
     # This restores the models to a fully unbound state.
-    ClusterUptime.bind( None)
-    ClusterCumulativeUptime.bind( None)
-    ClusterInfo.bind(None)
+    for model in MODELS:
+        model.bind(None)
+
+
+@pytest.fixture(autouse=True)
+def run_in_tmp_path(tmp_path, monkeypatch):
+    """main() writes clusters.json to the current directory"""
+    monkeypatch.chdir(tmp_path)
 
 
 # --- Test Utility Data ---
@@ -73,7 +77,7 @@ def get_mock_databricks_clusters(cluster_data):
 # --- The Complex Scenario Test ---
 
 
-@patch('databricks.poll_clusters.send_emails')
+@patch('databricks.poll_clusters.enqueue_email')
 @patch('databricks.poll_clusters.os')
 @patch('databricks.poll_clusters.DataBricksGroups')
 @patch('databricks.poll_clusters.DataBricksClusterOps')
@@ -0,0 +1,73 @@
+from unittest.mock import MagicMock
+
+from databricks.reconcile import Action, LiveState, plan_changes, apply_plan
+
+
+def make_live():
+    return LiveState(
+        users={'a@x.com': '1', 'b@x.com': '2', 'c@x.com': '3', 'gone@x.com': '4'},
+        groups={'group_01': {'a@x.com', 'b@x.com'}, 'group_02': {'c@x.com', 'gone@x.com'}},
+        master_members={'group_01', 'group_02'},
+        clusters={'cluster_01': 'id1', 'cluster_02': 'id2'},
+        cluster_access={'cluster_01': 'CAN_RESTART', 'cluster_02': 'CAN_ATTACH_TO'},
+    )
+
+
+def test_matching_workspace_needs_no_changes():
+    roster = {'group_01': ['a@x.com', 'B@x.com'], 'group_02': ['c@x.com', 'gone@x.com']}
+    live = make_live()
+    live.cluster_access['cluster_02'] = 'CAN_RESTART'
+
+    assert plan_changes(roster, live) == []
+
+
+def test_plan_contains_only_the_differences():
+    # b moved to group_02, 'gone' dropped the course, d joined, group_03 is new
+    roster = {'group_01': ['a@x.com'], 'group_02': ['c@x.com', 'b@x.com'], 'group_03': ['d@x.com']}
+
+    plan = plan_changes(roster, make_live(), prune_users=True)
+
+    assert set(plan) == {
+        Action('create_user', 'd@x.com'),
+        Action('remove_member', 'b@x.com', 'group_01'),
+        Action('add_member', 'b@x.com', 'group_02'),
+        Action('remove_member', 'gone@x.com', 'group_02'),
+        Action('set_permission', 'cluster_02', 'group_02'),
+        Action('create_group', 'group_03'),
+        Action('add_to_master', 'group_03', 'all_student_groups'),
+        Action('add_member', 'd@x.com', 'group_03'),
+        Action('create_cluster', 'cluster_03', 'group_03'),
+        Action('set_permission', 'cluster_03', 'group_03'),
+        Action('delete_user', 'gone@x.com'),
+    }
+    assert len(plan) == len(set(plan))
+
+
+def test_plan_can_be_restricted_to_changed_groups():
+    roster = {'group_01': ['a@x.com'], 'group_02': ['c@x.com', 'b@x.com']}
+
+    plan = plan_changes(roster, make_live(), only_groups={'group_01'})
+
+    assert plan == [Action('remove_member', 'b@x.com', 'group_01')]
+
+
+def test_restricted_plan_empties_a_removed_group():
+    # group_02 left the roster: the diff lists it, and its members are removed
+    roster = {'group_01': ['a@x.com', 'b@x.com']}
+
+    plan = plan_changes(roster, make_live(), only_groups={'group_02'})
+
+    assert plan == [Action('remove_member', 'c@x.com', 'group_02'), Action('remove_member', 'gone@x.com', 'group_02')]
+
+
+def test_apply_runs_phases_in_order():
+    groups_api, cluster_api = MagicMock(), MagicMock()
+    order = []
+    groups_api.create_users.side_effect = lambda users: order.append('create_user') or 1
+    groups_api.add_member_to_group.side_effect = lambda *a, **kw: order.append('add_member') or MagicMock(status_code=200)
+    plan = [Action('add_member', 'd@x.com', 'group_03'), Action('create_user', 'd@x.com')]
+
+    results = apply_plan(plan, groups_api, cluster_api, policy_id='', logger=MagicMock())
+
+    assert order == ['create_user', 'add_member']
+    assert all(err is None for _, err in results)
@@ -0,0 +1,75 @@
+from unittest.mock import patch, MagicMock
+
+import pytest
+import requests
+
+from databricks import resilience
+from databricks.resilience import resilient_request, call_with_retry, CircuitOpenError, RetryPolicy
+
+
+def response(status, headers=None):
+    r = MagicMock(status_code=status)
+    r.headers = headers or {}
+    return r
+
+
+@pytest.fixture(autouse=True)
+def clean_breakers():
+    resilience._breakers.clear()
+    with patch('databricks.resilience.time.sleep') as sleep:
+        yield sleep
+    resilience._breakers.clear()
+
+
+@patch('databricks.resilience.requests.request')
+def test_idempotent_call_is_retried_and_honors_retry_after(mock_request, clean_breakers):
+    mock_request.side_effect = [response(503), response(429, {'Retry-After': '3'}), response(200)]
+
+    r = resilient_request('GET', 'https://host/api/2.0/permissions/clusters/0626-112719-jy3n8ws2')
+
+    assert r.status_code == 200
+    assert mock_request.call_count == 3
+    assert clean_breakers.call_args_list[-1].args[0] == 3
+
+
+@patch('databricks.resilience.requests.request')
+def test_non_idempotent_call_is_not_retried_on_5xx(mock_request):
+    mock_request.side_effect = [response(500), response(201)]
+
+    r = resilient_request('POST', 'https://host/api/2.0/preview/scim/v2/Users', data='{}')
+
+    assert r.status_code == 500
+    assert mock_request.call_count == 1
+
+
+@patch('databricks.resilience.requests.request')
+def test_breaker_opens_after_repeated_failures(mock_request):
+    mock_request.return_value = response(503)
+    policy = RetryPolicy(max_attempts=1)
+    url = 'https://host/api/2.0/clusters/get'
+
+    for _ in range(5):
+        assert resilient_request('GET', url, policy=policy).status_code == 503
+    with pytest.raises(CircuitOpenError):
+        resilient_request('GET', url, policy=policy)
+    assert mock_request.call_count == 5
+
+    # other endpoints are not affected
+    assert resilient_request('GET', 'https://host/api/2.0/clusters/list', policy=policy).status_code == 503
+
+
+def test_call_with_retry_raises_non_retryable_errors_immediately():
+    error = requests.HTTPError('400 Client Error', response=response(400))
+    func = MagicMock(side_effect=[error])
+
+    with pytest.raises(requests.HTTPError):
+        call_with_retry(func, '/api/2.0/clusters/get')
+    assert func.call_count == 1
+
+    func = MagicMock(side_effect=[requests.ConnectionError('reset'), {'clusters': []}])
+    assert call_with_retry(func, '/api/2.0/clusters/list') == {'clusters': []}
+
+
+def test_cli_client_leaves_the_retries_to_call_with_retry():
+    client = resilience.cli_api_client('https://host/', 'token')
+    assert client.session.get_adapter('https://host/api/2.0/clusters/list').max_retries.total == 0
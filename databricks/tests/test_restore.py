@@ -0,0 +1,79 @@
+import json
+from email.parser import BytesParser
+from unittest.mock import MagicMock, patch
+
+from databricks.backup.restore import WorkspaceRestore, items_from_directory, items_from_snapshot
+from databricks.backup.store import BackupStore
+
+
+def make_backup(tmp_path):
+    (tmp_path / 'teacher' / 'starter' / 'data').mkdir(parents=True)
+    (tmp_path / 'teacher' / 'starter' / 'hw1.py').write_bytes(b'# Databricks notebook source\nprint(1)')
+    (tmp_path / 'teacher' / 'starter' / 'helper.py').write_bytes(b'def f(): pass')   # a file, not a notebook
+    (tmp_path / 'teacher' / 'starter' / 'data' / 'x.csv').write_bytes(b'a,b')
+    (tmp_path / 'teacher' / 'other.sql').write_bytes(b'-- Databricks notebook source\nselect 1')
+    return tmp_path
+
+
+class FakeWorkspace:
+    def __init__(self, existing=()):
+        self.objects = dict.fromkeys(existing, b'old')
+        self.mkdirs = []
+
+    @staticmethod
+    def parse_multipart(headers, data) -> dict:
+        raw = data.read()
+        data.seek(0)
+        assert data.read() == raw and len(data) == len(raw)   # rewindable for a retry, with a known length
+        message = BytesParser().parsebytes(f"Content-Type: {headers['Content-Type']}\r\n\r\n".encode() + raw)
+        return {part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+                for part in message.get_payload()}
+
+    def request(self, method, url, idempotent=None, headers=None, data=None):
+        response = MagicMock(status_code=200, text='')
+        if url.endswith('/mkdirs'):
+            self.mkdirs.append(json.loads(data)['path'])
+            return response
+        form = self.parse_multipart(headers, data)
+        path = form['path'].decode()
+        if path in self.objects and form['overwrite'] != b'true':
+            response.status_code, response.text = 400, '{"error_code": "RESOURCE_ALREADY_EXISTS"}'
+        else:
+            language = form['language'].decode() if 'language' in form else None
+            self.objects[path] = (form['format'].decode(), language, form['content'])
+        return response
+
+
+def test_seed_group_folders_from_a_directory_backup(tmp_path):
+    items = items_from_directory(str(make_backup(tmp_path)), prefix='teacher/starter')
+    ws = FakeWorkspace(existing=['/Groups/group_02/hw1'])
+
+    with patch('databricks.backup.restore.resilient_request', side_effect=ws.request):
+        results = WorkspaceRestore('https://host', 'token', max_workers=4).run(
+            items, ['/Groups/group_01', '/Groups/group_02'], prefix='teacher/starter', policy='skip')
+
+    assert sorted(ws.mkdirs) == ['/Groups/group_01/data', '/Groups/group_02/data']
+    assert ws.objects['/Groups/group_01/hw1'] == ('SOURCE', 'PYTHON', b'# Databricks notebook source\nprint(1)')
+    assert ws.objects['/Groups/group_01/helper.py'][:2] == ('AUTO', None)
+    assert ws.objects['/Groups/group_02/hw1'] == b'old'
+    statuses = {r.path: r.status for r in results}
+    assert statuses['/Groups/group_02/hw1'] == 'skipped'
+    assert sum(s == 'imported' for s in statuses.values()) == 5
+    assert '/Groups/group_01/other' not in ws.objects
+
+
+def test_restore_from_snapshot_overwrites(tmp_path):
+    store = BackupStore(str(tmp_path))
+    entries = [{'path': '/Users/a@x.com/hw1', 'local_path': 'a@x.com/hw1.py', 'sha256': store.put(b'print(1)'), 'size': 8},
+               {'path': '/Users/a@x.com/x.py', 'local_path': 'a@x.com/x.py', 'sha256': store.put(b'x = 1'), 'size': 5}]
+    sid = store.create_snapshot(entries, '/Users')
+    ws = FakeWorkspace(existing=['/Users/a@x.com/hw1'])
+
+    with patch('databricks.backup.restore.resilient_request', side_effect=ws.request):
+        results = WorkspaceRestore('https://host', 'token').run(
+            items_from_snapshot(store, sid, prefix='a@x.com'), ['/Users/a@x.com'], prefix='a@x.com', policy='overwrite')
+
+    assert [r.status for r in results] == ['imported', 'imported']
+    assert ws.objects['/Users/a@x.com/hw1'] == ('SOURCE', 'PYTHON', b'print(1)')
+    assert ws.objects['/Users/a@x.com/x.py'][:2] == ('AUTO', None)
+    assert ws.mkdirs == ['/Users/a@x.com']
@@ -0,0 +1,44 @@
+from unittest.mock import MagicMock
+
+import requests
+
+from databricks.DataBricksClusterOps import DataBricksClusterOps
+from databricks.restore_cluster_permissions import desired_cluster_permissions, reconcile_cluster_permissions
+
+
+def acl(group_name, level, inherited=False):
+    return {'access_control_list': [
+        {'group_name': 'admins', 'all_permissions': [{'permission_level': 'CAN_MANAGE', 'inherited': True}]},
+        {'group_name': group_name, 'all_permissions': [{'permission_level': level, 'inherited': inherited}]},
+    ]}
+
+
+def test_only_differing_clusters_are_written():
+    clusters = [
+        {'cluster_id': 'a', 'cluster_name': 'cluster_01'},  # already ok
+        {'cluster_id': 'b', 'cluster_name': 'cluster_02'},  # revoked by the poll
+        {'cluster_id': 'c', 'cluster_name': 'cluster_03'},  # API error
+        {'cluster_id': 'd', 'cluster_name': 'admin cluster'},  # not a student cluster
+    ]
+    current = {'a': acl('group_01', 'CAN_RESTART'), 'b': acl('group_02', 'CAN_ATTACH_TO')}
+
+    def get_cluster_permission(cluster_id):
+        if cluster_id == 'c':
+            raise requests.HTTPError('503 Server Error')
+        return current[cluster_id]
+
+    client = MagicMock()
+    client.ClusterPermission = DataBricksClusterOps.ClusterPermission
+    client.permission_level = DataBricksClusterOps.permission_level
+    client.get_cluster_permission.side_effect = get_cluster_permission
+
+    desired = desired_cluster_permissions(clusters)
+    summary = reconcile_cluster_permissions(client, desired, MagicMock())
+
+    assert desired == {'a': ('group_01', 'CAN_RESTART'), 'b': ('group_02', 'CAN_RESTART'),
+                       'c': ('group_03', 'CAN_RESTART')}
+    assert summary['changed'] == ['b']
+    assert summary['unchanged'] == ['a']
+    assert [cid for cid, _ in summary['failed']] == ['c']
+    client.set_cluster_permission.assert_called_once_with(
+        'b', group_name='group_02', permission=DataBricksClusterOps.ClusterPermission.RESTART)
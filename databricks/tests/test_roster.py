@@ -0,0 +1,104 @@
+import io
+
+import pytest
+
+from databricks.MoodleFileParser import MoodleFileParser
+from databricks.roster import (RosterError, RosterReader, diff_rosters, format_diff, load_roster, number_groups,
+                              read_roster, save_roster)
+
+HEADER = "Group ID,Group Name,Group Size,Member 1 Username,Member 1 Email,Member 2 Email,Member 3 Email,Member 4 Email\n"
+
+
+def roster_file(tmp_path, text, name="groups.csv"):
+    filename = tmp_path / name
+    filename.write_text(text, encoding="utf-8-sig")
+    return str(filename)
+
+
+def test_groups_are_keyed_by_group_id_and_numbered_by_position(tmp_path):
+    filename = roster_file(tmp_path, HEADER +
+                           "501,Team A,2,a,a@x.com,b@x.com,,\n"
+                           "\n"
+                           "502,Empty,0,,,,,\n"
+                           "503,Team C,4,c,c@x.com,d@x.com,e@x.com,f@x.com\n")
+    groups = read_roster(filename)
+
+    assert list(groups) == ["501", "503"]
+    assert groups["503"].members == ("c@x.com", "d@x.com", "e@x.com", "f@x.com")
+    assert groups["503"].group_name == "group_02"
+    assert groups["501"].name == "Team A"
+    assert MoodleFileParser.parse_moodle_csv(filename) == {1: ["a@x.com", "b@x.com"],
+                                                           2: ["c@x.com", "d@x.com", "e@x.com", "f@x.com"]}
+
+
+def test_sep_preamble_and_invalid_rows(tmp_path):
+    text = ("sep=;\n" + HEADER.replace(",", ";") +
+            "1;A;1;a;a@x.com;;;\n"
+            "1;dup;1;b;b@x.com;;;\n"
+            "2;bad;1;c;not-an-email;;;\n"
+            "3;again;1;a;A@x.com;;;\n"
+            ";noid;1;d;d@x.com;;;\n"
+            "4;ok;1;e;e@x.com;;;\n")
+    reader = RosterReader(io.StringIO(text))
+    groups = list(reader)
+
+    assert [(g.group_id, g.ordinal) for g in groups] == [("1", 1), ("4", 2)]
+    assert len(reader.errors) == 4
+    with pytest.raises(RosterError):
+        list(RosterReader(io.StringIO(text), strict=True))
+
+
+def test_header_is_validated():
+    with pytest.raises(RosterError):
+        RosterReader(io.StringIO("user1, user2\na@x.com,b@x.com\n"))
+    with pytest.raises(RosterError):
+        RosterReader(io.StringIO("Group ID,Group Name\n1,A\n"))
+
+
+def test_diff_against_the_previous_roster(tmp_path):
+    old = read_roster(roster_file(tmp_path, HEADER +
+                                  "1,A,2,a,a@x.com,b@x.com,,\n"
+                                  "2,B,1,c,c@x.com,,,\n"
+                                  "3,C,1,d,d@x.com,,,\n", "old.csv"))
+    save_roster(old, str(tmp_path / "roster.json"))
+    assert load_roster(str(tmp_path / "roster.json")) == old
+    assert load_roster(str(tmp_path / "missing.json")) == {}
+    assert not diff_rosters(old, old)
+
+    # b moved from A to C, B left the course, D is new
+    new = read_roster(roster_file(tmp_path, HEADER +
+                                  "1,A,1,a,A@x.com,,,\n"
+                                  "3,C,2,d,d@x.com,b@x.com,,\n"
+                                  "4,D,1,e,e@x.com,,,\n", "new.csv"))
+    diff = diff_rosters(load_roster(str(tmp_path / "roster.json")), new)
+
+    assert [g.group_id for g in diff.added] == ["4"]
+    assert [g.group_id for g in diff.removed] == ["2"]
+    assert [(o.group_id, n.group_id) for o, n in diff.changed] == [("1", "1"), ("3", "3")]
+    # C is now the 2nd group: both its old and new workspace names are touched
+    assert diff.changed_group_names() == {"group_01", "group_02", "group_03"}
+    assert "~ group_02 (Moodle 3): was group_03 +b@x.com" in format_diff(diff)
+
+
+def test_groups_keep_their_number_across_syncs(tmp_path):
+    old = read_roster(roster_file(tmp_path, HEADER +
+                                  "1,A,1,a,a@x.com,,,\n"
+                                  "2,B,1,b,b@x.com,,,\n"
+                                  "3,C,1,c,c@x.com,,,\n", "old.csv"))
+    assert number_groups(old, {}) == old   # first sync: by position
+    previous = {gid: g.ordinal for gid, g in old.items()}
+
+    # B left the course, D joined: C stays group_03, D does not take group_02 (B's cluster and schema)
+    new = number_groups(read_roster(roster_file(tmp_path, HEADER +
+                                                "1,A,1,a,a@x.com,,,\n"
+                                                "3,C,1,c,c@x.com,,,\n"
+                                                "4,D,1,d,d@x.com,,,\n", "new.csv")), previous)
+    assert {gid: g.group_name for gid, g in new.items()} == {"1": "group_01", "3": "group_03", "4": "group_04"}
+
+    diff = diff_rosters(old, new)
+    assert not diff.renumbered()
+    assert diff.changed_group_names() == {"group_02", "group_04"}
+    # without the previous numbers, C would be renumbered
+    assert [(o.group_name, n.group_name) for o, n in diff_rosters(old, read_roster(roster_file(
+        tmp_path, HEADER + "1,A,1,a,a@x.com,,,\n3,C,1,c,c@x.com,,,\n", "pos.csv"))).renumbered()] == \
+        [("group_03", "group_02")]
@@ -0,0 +1,128 @@
+import pytest
+from peewee import SqliteDatabase
+
+from databricks.database.db_operations import MODELS, ClusterBinding, GroupMember, StudentGroup
+from databricks.MoodleFileParser import MoodleFileParser
+from databricks.deploy_sql_schemas import groups_from_moodle
+from databricks.reconcile import roster_from_moodle
+from databricks.roster import RosterGroup, read_roster
+from databricks.roster_index import (bind_clusters, cluster_for_group, group_for_cluster, group_numbers, index_roster,
+                                     numbered_roster,
+                                     index_workspace, members_of_cluster, members_of_group)
+from databricks.restore_cluster_permissions import desired_cluster_permissions
+
+TEST_DB = SqliteDatabase(':memory:')
+
+
+@pytest.fixture()
+def roster_db():
+    for model in MODELS:
+        model.bind(TEST_DB)
+    with TEST_DB.connection_context():
+        TEST_DB.create_tables(MODELS)
+        yield
+        TEST_DB.drop_tables(MODELS)
+    for model in MODELS:
+        model.bind(None)
+
+
+def roster(*groups):
+    return {g.group_id: g for g in groups}
+
+
+def test_lookups_fall_back_to_the_naming_convention():
+    assert group_for_cluster("cluster_07") == "group_07"
+    assert group_for_cluster("my cluster") is None
+    assert cluster_for_group("group_07").cluster_name == "cluster_07"
+    assert members_of_cluster("cluster_07") is None
+
+
+def test_roster_and_workspace_are_indexed(roster_db):
+    index_roster(roster(RosterGroup("501", 1, ("A@x.com", "b@x.com")), RosterGroup("502", 2, ("c@x.com",))))
+    assert members_of_group("group_01") == ["a@x.com", "b@x.com"]
+    assert cluster_for_group("group_02").cluster_id is None
+
+    # the poll records the cluster ids; a renamed cluster can be bound explicitly
+    bind_clusters([{'cluster_name': 'cluster_01', 'cluster_id': 'c1'},
+                   {'cluster_name': 'cluster_09', 'cluster_id': 'c9'},
+                   {'cluster_name': 'spare', 'cluster_id': 'c2'}], cluster_groups={'spare': 'group_02'})
+    assert members_of_cluster(cluster_id="c1") == ["a@x.com", "b@x.com"]
+    assert group_for_cluster("spare", "c2") == "group_02"
+    assert ClusterBinding.get_or_none(ClusterBinding.cluster_id == "c9") is None
+    assert desired_cluster_permissions([{'cluster_name': 'spare', 'cluster_id': 'c2'}]) == \
+        {'c2': ('group_02', 'CAN_RESTART')}
+
+    index_workspace({"group_01": {"a@x.com", "d@x.com"}}, [])
+    assert members_of_group("group_01") == ["a@x.com", "d@x.com"]
+
+    # group 502 left the course
+    index_roster(roster(RosterGroup("501", 1, ("a@x.com",))))
+    assert [g.group_name for g in StudentGroup.select()] == ["group_01"]
+    assert GroupMember.select().count() == 1
+    assert group_for_cluster("spare", "c2") is None
+
+
+def test_group_numbers_of_the_indexed_roster(roster_db):
+    index_roster(roster(RosterGroup("501", 1, ("a@x.com",)), RosterGroup("503", 3, ("c@x.com",))))
+    assert group_numbers() == {"501": 1, "503": 3}
+    assert StudentGroup.get_by_id("group_03").moodle_id == "503"
+
+
+HEADER = "Group ID,Group Name,Member 1 Email,Member 2 Email\n"
+
+
+def test_every_tool_numbers_the_groups_like_the_last_sync(roster_db, tmp_path):
+    first = tmp_path / "first.csv"
+    first.write_text(HEADER + "501,A,a@x.com,\n502,B,b@x.com,\n503,C,c@x.com,\n")
+    index_roster(numbered_roster(str(first)))   # the first sync: by position
+
+    # B left the course, D joined
+    later = tmp_path / "later.csv"
+    later.write_text(HEADER + "501,A,a@x.com,\n503,C,c@x.com,\n504,D,d@x.com,\n")
+    expected = {"group_01": ["a@x.com"], "group_03": ["c@x.com"], "group_04": ["d@x.com"]}
+
+    assert {g.group_name: list(g.members) for g in numbered_roster(str(later)).values()} == expected
+    assert roster_from_moodle(str(later)) == expected
+    assert MoodleFileParser.parse_moodle_csv(str(later)) == {1: ["a@x.com"], 3: ["c@x.com"], 4: ["d@x.com"]}
+    assert {g.group: list(g.members) for g in groups_from_moodle(str(later))} == expected
+
+    # a new course has no group in common with the index: numbered by position
+    other = tmp_path / "other.csv"
+    other.write_text(HEADER + "901,X,x@x.com,\n")
+    assert [g.group_name for g in numbered_roster(str(other)).values()] == ["group_01"]
+
+
+def test_saved_roster_numbers_come_first(roster_db, tmp_path):
+    from databricks.roster import save_roster
+
+    csv = tmp_path / "groups.csv"
+    csv.write_text(HEADER + "501,A,a@x.com,\n503,C,c@x.com,\n")
+    saved = {g.group_id: g for g in [RosterGroup("501", 5, ("a@x.com",)), RosterGroup("503", 7, ("c@x.com",))]}
+    save_roster(saved, str(tmp_path / "roster.json"))
+    assert [g.ordinal for g in numbered_roster(str(csv), str(tmp_path / "roster.json")).values()] == [5, 7]
+    assert [g.ordinal for g in read_roster(str(csv)).values()] == [1, 2]
+
+
+def test_cluster_allocation_reads_the_owners_from_the_index(roster_db, capsys):
+    from unittest.mock import MagicMock
+    from databricks.resource_manager import stats
+
+    index_roster(roster(RosterGroup("501", 1, ("a@x.com", "b@x.com")), RosterGroup("502", 2, ("c@x.com",))))
+    bind_clusters([{'cluster_name': 'cluster_01', 'cluster_id': 'id1'}, {'cluster_name': 'big data', 'cluster_id': 'id9'}],
+                  cluster_groups={'big data': 'group_02'})
+    cluster_api, groups_api = MagicMock(), MagicMock()
+    cluster_api.get_clusters.return_value = [{'cluster_name': n, 'cluster_id': i} for n, i in
+                                             [('big data', 'id9'), ('cluster_01', 'id1'), ('admin', 'id0')]]
+    cluster_api.get_cluster_permission.side_effect = lambda cid: {'access_control_list': [
+        {'group_name': {'id1': 'group_01', 'id9': 'group_02'}[cid],
+         'all_permissions': [{'permission_level': 'CAN_RESTART', 'inherited': False}]}]}
+
+    stats.print_user_allocation_clusters(groups_api, cluster_api, MagicMock())
+
+    groups_api.get_group_members.assert_not_called()
+    assert sorted(c.args[0] for c in cluster_api.get_cluster_permission.call_args_list) == ['id1', 'id9']
+    assert capsys.readouterr().out.splitlines() == [
+        "cluster_01,\tgroup_01, CAN_RESTART,\t a : b",
+        "admin,\t    , ,\t ",
+        "big data,\tgroup_02, CAN_RESTART,\t c",
+    ]
@@ -0,0 +1,64 @@
+from unittest.mock import patch, MagicMock
+
+from databricks.DataBricksGroups import DataBricksGroups
+
+ALL_USERS = [{'id': str(i), 'userName': f'u{i}@example.com'} for i in range(1, 251)]
+
+
+def fake_request(method, url, headers, params):
+    """Mimic the SCIM paging of the workspace: startIndex is 1-based."""
+    start, count = params['startIndex'], params['count']
+    response = MagicMock(status_code=200)
+    response.json.return_value = {
+        'totalResults': len(ALL_USERS),
+        'startIndex': start,
+        'itemsPerPage': count,
+        'Resources': ALL_USERS[start - 1: start - 1 + count],
+    }
+    return response
+
+
+@patch('databricks.resilience.requests.request', side_effect=fake_request)
+def test_iter_users_pages_through_all_users(mock_get):
+    api = DataBricksGroups(host='https://test-host', token='test-token')
+
+    users = list(api.iter_users(attributes='userName,id', page_size=100, prefetch=2))
+
+    assert users == ALL_USERS
+    assert mock_get.call_count == 3
+    start_indexes = sorted(c.kwargs['params']['startIndex'] for c in mock_get.call_args_list)
+    assert start_indexes == [1, 101, 201]
+    assert all(c.kwargs['params']['attributes'] == 'userName,id' for c in mock_get.call_args_list)
+    assert mock_get.call_args.args[1].endswith('/scim/v2/Users')
+
+
+@patch('databricks.resilience.requests.request', side_effect=fake_request)
+def test_iter_scim_passes_filter_and_stops_early(mock_get):
+    api = DataBricksGroups(host='https://test-host', token='test-token')
+
+    first = next(api.iter_groups(filter_='displayName sw "group_"', page_size=10))
+
+    assert first == ALL_USERS[0]
+    assert mock_get.call_args_list[0].kwargs['params']['filter'] == 'displayName sw "group_"'
+    assert mock_get.call_args_list[0].args[1].endswith('/scim/v2/Groups')
+
+
+def test_capped_and_short_pages_do_not_skip_objects():
+    calls = []
+
+    def capped_request(method, url, headers, params):
+        # the server returns at most 40 objects, and a short page at 81
+        start = params['startIndex']
+        calls.append(start)
+        count = 15 if start == 81 else min(params['count'], 40)
+        response = MagicMock(status_code=200)
+        response.json.return_value = {'totalResults': len(ALL_USERS), 'startIndex': start,
+                                      'itemsPerPage': count, 'Resources': ALL_USERS[start - 1: start - 1 + count]}
+        return response
+
+    with patch('databricks.resilience.requests.request', side_effect=capped_request):
+        api = DataBricksGroups(host='https://test-host', token='test-token')
+        users = list(api.iter_users(page_size=100, prefetch=2))
+
+    assert users == ALL_USERS
+    assert 96 in calls
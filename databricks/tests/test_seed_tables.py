@@ -0,0 +1,144 @@
+import importlib
+import json
+import sys
+import threading
+import types
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+
+UTILS = Path(__file__).resolve().parents[2] / "terraform" / "dbr" / "utils"
+
+
+class FakeConnection:
+    def __init__(self, opened):
+        self.cursors = 0
+        self.closed = False
+        opened.append(self)
+
+    def cursor(self):
+        self.cursors += 1
+        cursor = MagicMock()
+        cursor.__enter__.return_value = cursor
+        return cursor
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def utils(monkeypatch):
+    """seed_tables.py and sql_pool.py are standalone scripts: import them from terraform/dbr/utils, with a fake connector"""
+    opened = []
+    sql = types.ModuleType("databricks.sql")
+    sql.connect = lambda **kwargs: FakeConnection(opened)
+    monkeypatch.syspath_prepend(str(UTILS))
+    monkeypatch.setitem(sys.modules, "databricks.sql", sql)
+    for name in ("sql_pool", "seed_tables"):
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    return types.SimpleNamespace(pool=importlib.import_module("sql_pool"),
+                                 seed=importlib.import_module("seed_tables"), opened=opened)
+
+
+def test_run_parallel_reuses_the_pool_connections_and_returns_the_errors(utils):
+    barrier = threading.Barrier(2, timeout=5)
+
+    def work(cursor, item):
+        if item < 2:
+            barrier.wait()   # both connections are busy at the same time
+        if item == 5:
+            raise RuntimeError("TABLE_OR_VIEW_NOT_FOUND")
+        return item * 10
+
+    with utils.pool.ConnectionPool("https://adb-1.azuredatabricks.net/", "/sql/1.0/warehouses/x", "t", size=2) as pool:
+        results = utils.pool.run_parallel(pool, work, list(range(8)))
+        assert pool.server_hostname == "adb-1.azuredatabricks.net"
+
+    assert [item for item, *_ in results] == list(range(8))
+    assert [result for _, result, error, _ in results if not error] == [0, 10, 20, 30, 40, 60, 70]
+    errors = [(item, str(error)) for item, _, error, _ in results if error]
+    assert errors == [(5, "TABLE_OR_VIEW_NOT_FOUND")]
+    assert len(utils.opened) == 2
+    assert sum(c.cursors for c in utils.opened) == 8
+    assert all(c.closed for c in utils.opened)
+
+
+def test_a_failed_connect_does_not_use_up_the_pool(utils, monkeypatch):
+    calls = []
+
+    def connect(**kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            raise ConnectionError("warehouse starting")
+        return FakeConnection(utils.opened)
+    monkeypatch.setattr(utils.pool.sql, "connect", connect)
+
+    pool = utils.pool.ConnectionPool("h", "p", "t", size=1)
+    with pytest.raises(ConnectionError):
+        with pool.cursor():
+            pass
+    with pool.cursor() as cursor:
+        assert cursor is not None
+    assert len(utils.opened) == 1
+
+
+def executed(cursor):
+    return [c.args for c in cursor.execute.call_args_list]
+
+
+def test_rows_are_inserted_in_batches_below_the_parameter_limit(utils):
+    dataset = {"table": "t", "columns": {"id": "INT", "name": "STRING", "score": "DOUBLE"}}
+    rows = [[i, f"n{i}", i / 2] for i in range(200)]
+    cursor = MagicMock()
+    cursor.fetchone.return_value = (0,)
+
+    assert utils.seed.seed_dataset(cursor, "`c`.`s`.`t`", dataset, rows) == 200
+
+    inserts = [args for args in executed(cursor) if args[0].startswith("INSERT")]
+    assert [len(params) for _, params in inserts] == [249, 249, 102]   # 83 rows of 3 columns per statement
+    assert all(sql.count("?") == len(params) for sql, params in inserts)
+    assert [v for _, params in inserts for v in params] == [v for row in rows for v in row]
+
+
+def test_seeding_modes(utils):
+    dataset = {"table": "t", "columns": {"id": "INT"}}
+    cursor = MagicMock()
+    cursor.fetchone.return_value = (3,)
+    assert utils.seed.seed_dataset(cursor, "`c`.`s`.`t`", dataset, [[1]]) == 0   # if_empty: already seeded
+    assert [args[0] for args in executed(cursor)] == [
+        "CREATE TABLE IF NOT EXISTS `c`.`s`.`t` (`id` INT) USING DELTA", "SELECT COUNT(*) FROM `c`.`s`.`t`"]
+
+    cursor = MagicMock()
+    assert utils.seed.seed_dataset(cursor, "`c`.`s`.`t`", dict(dataset, mode="replace"), [[1], [2]]) == 2
+    assert executed(cursor) == [("CREATE OR REPLACE TABLE `c`.`s`.`t` (`id` INT) USING DELTA",),
+                                ("INSERT INTO `c`.`s`.`t` VALUES (?), (?)", [1, 2])]
+    cursor.fetchone.assert_not_called()
+
+
+def test_datasets_are_loaded_from_json_csv_and_parquet(utils, tmp_path, monkeypatch):
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "flights.csv").write_text("delay,origin,late,n\n1.5,TLV,true,3\n,JFK,no,\n")
+    columns = {"origin": "STRING", "delay": "DOUBLE", "late": "BOOLEAN", "n": "INT"}
+    (tmp_path / "datasets.json").write_text(json.dumps([
+        {"table": "inline", "columns": {"id": "INT"}, "rows": [[1], [2]]},
+        {"table": "flights", "columns": columns, "source": "data/flights.csv"},
+        {"table": "events", "columns": {"id": "INT", "kind": "STRING"}, "source": "data/events.parquet"},
+    ]))
+
+    parquet = types.ModuleType("pyarrow.parquet")
+    tables = {"id": [1, 2], "kind": ["a", "b"]}
+    parquet.read_table = MagicMock(return_value=types.SimpleNamespace(
+        column=lambda c: types.SimpleNamespace(to_pylist=lambda: tables[c])))
+    monkeypatch.setitem(sys.modules, "pyarrow", types.ModuleType("pyarrow"))
+    monkeypatch.setitem(sys.modules, "pyarrow.parquet", parquet)
+
+    loaded = utils.seed.load_datasets(str(tmp_path / "datasets.json"))
+
+    assert [rows for _, rows in loaded] == [
+        [[1], [2]],
+        [["TLV", 1.5, True, 3], ["JFK", None, False, None]],
+        [[1, "a"], [2, "b"]],
+    ]
+    assert parquet.read_table.call_args.kwargs["columns"] == ["id", "kind"]
+    assert [d["table"] for d, _ in utils.seed.load_datasets(None)] == ["test_data"]
@@ -0,0 +1,31 @@
+from datetime import date, datetime, timedelta
+
+from databricks.resource_manager.usage_simulator import generate_schedule, ground_truth, simulate
+
+
+def test_single_session_is_accounted_within_one_poll_interval():
+    day = date(2025, 11, 2)
+    on = datetime(2025, 11, 2, 10, 3)
+    schedule = {'sim-1': [(on, on + timedelta(hours=1))]}
+    interval = timedelta(minutes=15)
+
+    result = simulate(schedule, day, 2, interval)
+
+    assert [d.day for d in result.days] == [day, day + timedelta(days=1)]
+    first, second = result.days
+    assert first.truth_seconds == 3600
+    assert abs(first.error_seconds) <= interval.total_seconds()
+    assert second.truth_seconds == 0 and second.accounted_seconds == 0
+    assert first.polls == 24 * 4
+
+
+def test_generated_schedule_stays_inside_the_period():
+    first_day = date(2025, 11, 2)
+    schedule = generate_schedule(20, first_day, 7, seed=3)
+    period_end = datetime(2025, 11, 9)
+
+    assert len(schedule) == 20
+    for sessions in schedule.values():
+        for (start, end), nxt in zip(sessions, sessions[1:] + [(period_end, period_end)]):
+            assert start < end <= nxt[0]
+    assert sum(ground_truth(schedule, first_day + timedelta(days=d)) for d in range(7)) > 0
@@ -0,0 +1,161 @@
+import copy
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from databricks.backup.store import BackupStore
+from databricks.backup.workspace_backup import WorkspaceBackup
+
+TREE = {
+    '/Users': [{'object_type': 'DIRECTORY', 'path': '/Users/a@x.com'},
+               {'object_type': 'DIRECTORY', 'path': '/Users/b@x.com'}],
+    '/Users/a@x.com': [{'object_type': 'NOTEBOOK', 'path': '/Users/a@x.com/hw1', 'language': 'PYTHON',
+                        'object_id': 1, 'modified_at': 100},
+                       {'object_type': 'DIRECTORY', 'path': '/Users/a@x.com/data'}],
+    '/Users/a@x.com/data': [{'object_type': 'FILE', 'path': '/Users/a@x.com/data/x.csv', 'object_id': 2,
+                             'modified_at': 100}],
+    '/Users/b@x.com': [{'object_type': 'NOTEBOOK', 'path': '/Users/b@x.com/q', 'language': 'SQL',
+                        'object_id': 3, 'modified_at': 100}],
+}
+CONTENT = {'/Users/a@x.com/hw1': b'print(1)', '/Users/a@x.com/data/x.csv': b'a,b\n1,2\n', '/Users/b@x.com/q': b'select 1'}
+
+
+@pytest.fixture(autouse=True)
+def workspace():
+    """the tests edit the workspace"""
+    saved = copy.deepcopy((TREE, CONTENT))
+    yield
+    TREE.clear(), CONTENT.clear()
+    TREE.update(saved[0]), CONTENT.update(saved[1])
+
+
+def fake_request(method, url, headers, params, stream=False):
+    response = MagicMock(status_code=200)
+    response.__enter__.return_value = response
+    if url.endswith('/workspace/list'):
+        response.json.return_value = {'objects': TREE.get(params['path'], [])}
+    else:
+        assert stream and params['direct_download'] == 'true'
+        content = CONTENT[params['path']]
+        response.headers = {'Content-Length': str(len(content))}
+        response.iter_content.side_effect = lambda chunk_size: (content[i:i + chunk_size] for i in range(0, len(content), chunk_size))
+    return response
+
+
+@patch('databricks.backup.workspace_backup.resilient_request', side_effect=fake_request)
+def test_backup_is_incremental(mock_request, tmp_path):
+    summary = WorkspaceBackup('https://host', 'token', str(tmp_path), max_workers=4).run('/Users')
+
+    assert (summary.listed_dirs, summary.objects, summary.exported) == (4, 3, 3)
+    assert (tmp_path / 'a@x.com' / 'hw1.py').read_bytes() == b'print(1)'
+    assert (tmp_path / 'b@x.com' / 'q.sql').read_bytes() == b'select 1'
+    assert (tmp_path / 'a@x.com' / 'data' / 'x.csv').read_bytes() == b'a,b\n1,2\n'
+    manifest = {e['path']: e for e in json.loads((tmp_path / 'manifest.json').read_text())['objects']}
+    assert manifest['/Users/a@x.com/hw1']['size'] == 8 and len(manifest['/Users/a@x.com/hw1']['sha256']) == 64
+
+    # second run: only the modified notebook is exported, and deletions are noticed
+    TREE['/Users/b@x.com'] = []
+    TREE['/Users/a@x.com'][0] = dict(TREE['/Users/a@x.com'][0], modified_at=200)
+    CONTENT['/Users/a@x.com/hw1'] = b'print(2)'
+    mock_request.reset_mock()
+
+    summary = WorkspaceBackup('https://host', 'token', str(tmp_path)).run('/Users')
+
+    assert (summary.exported, summary.unchanged, summary.deleted, summary.failed) == (1, 1, 1, [])
+    exports = [c.kwargs['params']['path'] for c in mock_request.call_args_list if c.args[1].endswith('/export')]
+    assert exports == ['/Users/a@x.com/hw1']
+    assert (tmp_path / 'a@x.com' / 'hw1.py').read_bytes() == b'print(2)'
+
+
+@patch('databricks.backup.workspace_backup.resilient_request', side_effect=fake_request)
+def test_backup_to_store_creates_snapshots(mock_request, tmp_path):
+    store = BackupStore(str(tmp_path))
+    first = WorkspaceBackup('https://host', 'token', '', store=store).run('/Users/a@x.com')
+    CONTENT['/Users/a@x.com/data/x.csv'] = b'changed'
+    TREE['/Users/a@x.com/data'][0] = dict(TREE['/Users/a@x.com/data'][0], modified_at=300)
+    second = WorkspaceBackup('https://host', 'token', '', store=store).run('/Users/a@x.com')
+
+    assert (first.exported, second.exported, second.unchanged) == (2, 1, 1)
+    assert store.diff(first.snapshot, second.snapshot)['modified'] == ['/Users/a@x.com/data/x.csv']
+    assert not (tmp_path / 'hw1.py').exists()
+
+
+@patch('databricks.backup.workspace_backup.resilient_request', side_effect=fake_request)
+def test_large_files_are_streamed_and_sizes_checked(mock_request, tmp_path):
+    CONTENT['/Users/a@x.com/hw1'] = b'x' * (12 * 1024 * 1024)   # over the 10MB limit of the json export
+    TREE['/Users/a@x.com/data'][0]['size'] = 999                 # the listing disagrees with the download
+
+    summary = WorkspaceBackup('https://host', 'token', str(tmp_path)).run('/Users/a@x.com')
+
+    assert (tmp_path / 'hw1.py').stat().st_size == 12 * 1024 * 1024
+    assert [path for path, _ in summary.failed] == []
+    # Content-Length wins over the listed size. A short download is an error
+    CONTENT['/Users/b@x.com/q'] = b'select 1'
+    original = fake_request
+
+    def short_download(*args, **kwargs):
+        response = original(*args, **kwargs)
+        if kwargs['params'].get('direct_download'):
+            response.headers = {'Content-Length': '100'}
+        return response
+
+    mock_request.side_effect = short_download
+    summary = WorkspaceBackup('https://host', 'token', str(tmp_path / 'b')).run('/Users/b@x.com')
+    assert [path for path, _ in summary.failed] == ['/Users/b@x.com/q']
+    assert not (tmp_path / 'b' / 'q.sql').exists()
+    assert not (tmp_path / 'b' / 'q.sql.part').exists()
+
+    # the same short download is not stored either
+    store = BackupStore(str(tmp_path / 'store'))
+    summary = WorkspaceBackup('https://host', 'token', '', store=store).run('/Users/b@x.com')
+    assert [path for path, _ in summary.failed] == ['/Users/b@x.com/q']
+    assert store.index == {}
+
+
+@patch('databricks.backup.workspace_backup.resilient_request')
+def test_gzip_content_length_counts_the_bytes_on_the_wire(mock_request, tmp_path):
+    def gzipped(*args, **kwargs):
+        response = fake_request(*args, **kwargs)
+        if kwargs['params'].get('direct_download'):
+            # iter_content() yields the decoded content, Content-Length is the compressed size
+            response.headers = {'Content-Length': '5', 'Content-Encoding': 'gzip'}
+            response.raw.tell.return_value = 5
+        return response
+
+    mock_request.side_effect = gzipped
+    summary = WorkspaceBackup('https://host', 'token', str(tmp_path)).run('/Users/b@x.com')
+    assert summary.failed == []
+    assert (tmp_path / 'q.sql').read_bytes() == b'select 1'
+
+
+@patch('databricks.backup.workspace_backup.resilient_request')
+def test_interrupted_backup_resumes_where_it_stopped(mock_request, tmp_path):
+    def token_expires(method, url, headers, params, stream=False):
+        if params['path'] in ('/Users/b@x.com', '/Users/a@x.com/data/x.csv'):
+            raise requests.ConnectionError('token expired')
+        return fake_request(method, url, headers, params, stream)
+
+    mock_request.side_effect = token_expires
+    with pytest.raises(requests.ConnectionError):
+        WorkspaceBackup('https://host', 'token', str(tmp_path), max_workers=1).run('/Users')
+
+    mock_request.reset_mock(side_effect=True)
+    mock_request.side_effect = fake_request
+    summary = WorkspaceBackup('https://host', 'token', str(tmp_path)).run('/Users', resume=True)
+
+    assert summary.resumed and summary.failed == [] and summary.inconsistent == []
+    listed = [c.kwargs['params']['path'] for c in mock_request.call_args_list if c.args[1].endswith('/list')]
+    assert '/Users/b@x.com' in listed and '/Users' not in listed and '/Users/a@x.com' not in listed
+    assert (tmp_path / 'b@x.com' / 'q.sql').read_bytes() == b'select 1'
+    assert json.loads((tmp_path / 'journal.jsonl').read_text().splitlines()[-1])['event'] == 'done'
+
+
+@patch('databricks.backup.workspace_backup.resilient_request', side_effect=fake_request)
+def test_consistency_check_finds_missing_copies(mock_request, tmp_path):
+    WorkspaceBackup('https://host', 'token', str(tmp_path)).run('/Users/b@x.com')
+    (tmp_path / 'q.sql').write_bytes(b'truncated')
+
+    backup = WorkspaceBackup('https://host', 'token', str(tmp_path))
+    assert backup.verify('/Users/b@x.com') == ['/Users/b@x.com/q']
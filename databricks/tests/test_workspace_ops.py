@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from databricks.DataBricksWorkspaceOps import build_tree_index, select_folders, delete_folders, delete_user_folders
+
+DAY_MS = 86400 * 1000
+NOW = 1_800_000_000
+
+
+def obj(path, kind, size=None, modified_at=None):
+    return SimpleNamespace(path=path, object_type=SimpleNamespace(name=kind), size=size, modified_at=modified_at)
+
+
+TREE = {
+    '/Users': [obj('/Users/a@x.com', 'DIRECTORY'), obj('/Users/b@x.com', 'DIRECTORY'), obj('/Users/keep@x.com', 'DIRECTORY')],
+    '/Users/a@x.com': [obj('/Users/a@x.com/hw', 'DIRECTORY'), obj('/Users/a@x.com/nb', 'NOTEBOOK', modified_at=NOW * 1000)],
+    '/Users/a@x.com/hw': [obj('/Users/a@x.com/hw/data.csv', 'FILE', size=100, modified_at=(NOW - 5) * 1000)],
+    '/Users/b@x.com': [obj('/Users/b@x.com/nb', 'NOTEBOOK', modified_at=NOW * 1000 - 90 * DAY_MS)],
+    '/Users/keep@x.com': [],
+}
+
+
+def make_client():
+    w = MagicMock()
+    w.workspace.list.side_effect = lambda path, recursive: iter(TREE[path])
+    return w
+
+
+def test_index_totals_each_user_folder():
+    index = build_tree_index(make_client(), max_workers=4)
+
+    a = index['/Users/a@x.com']
+    assert (a.folders, a.objects, a.size, a.last_modified) == (1, 2, 100, NOW * 1000)
+    assert index['/Users/keep@x.com'].objects == 0
+    assert set(index) == {'/Users/a@x.com', '/Users/b@x.com', '/Users/keep@x.com'}
+
+
+def test_selection_honors_exclusions_and_inactivity():
+    index = build_tree_index(make_client())
+
+    assert select_folders(index, ['keep@x.com']) == ['/Users/a@x.com', '/Users/b@x.com']
+    assert select_folders(index, ['keep@x.com'], inactive_days=30, now=NOW) == ['/Users/b@x.com']
+
+
+@patch('databricks.DataBricksWorkspaceOps.time.sleep')
+def test_delete_is_rate_limited_and_reports_failures(mock_sleep):
+    w = make_client()
+    w.workspace.delete.side_effect = lambda path, recursive: (_ for _ in ()).throw(Exception('Folder is protected')) \
+        if 'b@' in path else None
+
+    results = delete_folders(w, ['/Users/a@x.com', '/Users/b@x.com', '/Users/c@x.com'], max_workers=2, rate=2)
+
+    assert sorted(results) == [('/Users/a@x.com', 'deleted', ''), ('/Users/b@x.com', 'failed', 'Folder is protected'),
+                               ('/Users/c@x.com', 'deleted', '')]
+    assert mock_sleep.call_count >= 1
+
+
+def test_dry_run_deletes_nothing():
+    w = make_client()
+
+    results = delete_user_folders('token', 'host', ['keep@x.com'], dry_run=True, w=w)
+
+    assert [(f, s) for f, s, _ in results] == [('/Users/a@x.com', 'dry-run'), ('/Users/b@x.com', 'dry-run')]
+    w.workspace.delete.assert_not_called()
@@ -1,15 +1,27 @@
 # Custom script to extract email adddresses from a CSV exported from moodle, then manually decimated
+#
+# NOTE: Terraform numbers the groups by their row in users.csv (group_01 is the first row). The python tools
+# (databricks/roster_index.py numbered_roster) keep the number of a Moodle group after another group left the
+# course, so after such a change this numbering does not match theirs: the same group_NN may be other students.
 import csv
+import os
+import sys
+
+# the roster parser is shared with the python ops (databricks/roster.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'databricks'))
+from roster import RosterReader
+
 
 def convert_csv(input_file, output_file):
   """
-  Converts a CSV file with user emails in specific format to a new CSV with 
-  columns "user1", "user2", etc.
+  Converts a CSV file with user emails in specific format to a new CSV with
+  columns "user1", "user2", etc. (one column per 'Member N Email' column of the input)
   the CSV is generated by exporting Moodle Group using Moodle 2024
 
   Args:
     input_file: Path to the input CSV file.
     output_file: Path to the output CSV file.
+  :return: the number of groups written
   """
 
   def generate_output_headers(N: int):
@@ -18,43 +30,32 @@ def convert_csv(input_file, output_file):
     # Join the list into a single string with commas
     return ", ".join(users)
 
-  max_users_in_group = 4
-  with open(input_file, 'r', newline='') as infile, open(output_file, 'w', newline='') as outfile:
-
-    first_line = infile.readline()
-    if not first_line.startswith('sep='):
-      input_file.seek(0)
-
-    reader = csv.DictReader(infile)
+  with open(input_file, 'r', newline='', encoding='utf-8-sig') as infile, open(output_file, 'w', newline='') as outfile:
+    reader = RosterReader(infile)
+    max_users_in_group = reader.max_members
 
     # write needed column headers
     outfile.write(generate_output_headers(max_users_in_group))
     outfile.write('\n')
     writer = csv.writer(outfile)
 
-    #print(reader.fieldnames)
-    for row in reader:
-      # Extract email addresses from member columns
-      users = [] # i.e. group members
-      for i in range(max_users_in_group):
-        col_name = f'Member {i+1} Email'
-        member_email = row.get(col_name) # might not exist
-        if member_email is None:
-          users.append(f'')
-        else: users.append(row[col_name])
-
-      # Write user emails to a new row
-      if any((u for u in users)): # skip empty rows
-        print(users)
-        writer.writerow(users)
+    count = 0
+    for group in reader:  # empty groups are skipped
+      users = list(group.members) + [''] * (max_users_in_group - len(group.members))
+      print(group.group_name, users)
+      writer.writerow(users)
+      count += 1
+
+  for error in reader.errors:
+    print(f"skipped: {error}")
+  return count
 
 if __name__ == '__main__':
-  import sys
   if len(sys.argv) != 2:
     print(f"usage: {sys.argv[0]} input_moodle_group.csv")
     exit(0)
   input_file = sys.argv[1]
-  
+
   output_file = 'users.csv'  # Replace with your desired output file path
   convert_csv(input_file, output_file)
-  print(f'Converted CSV file saved to: {output_file}')
\ No newline at end of file
+  print(f'Converted CSV file saved to: {output_file}')
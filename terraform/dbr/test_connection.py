@@ -1,61 +1,81 @@
+import argparse
+import concurrent.futures
+import json
 import os
+import sys
 import time
 import requests
 import uuid
+from dataclasses import dataclass
 from dotenv import load_dotenv
 
+# Usage:
+#   python test_connection.py                       # one group, from the .env file (students use this)
+#   python test_connection.py --fleet all_groups.json [--workers 16]
+#       every group of 'terraform output -json sp_credentials_and_env_vars', concurrently,
+#       with a pass/fail matrix and the latency of every step.
+
 # Load the same .env file used by the Flask app
 load_dotenv()
 
 # Colors for terminal output
 GREEN = "\033[92m"
 RED = "\033[91m"
+YELLOW = "\033[93m"
 RESET = "\033[0m"
 
-def test_step(name, func):
-    print(f"Testing {name}...", end=" ", flush=True)
-    try:
-        func()
-        print(f"{GREEN}PASS{RESET}")
-    except Exception as e:
-        print(f"{RED}FAIL{RESET}")
-        print(f"   Error: {e}")
+HTTP_TIMEOUT = 15  # seconds - socket-level HTTP timeout (unrelated to Databricks wait_timeout in the payload)
 
-def run_tests():
-    config = {
-        "host": os.getenv("DATABRICKS_HOST"),
-        "id": os.getenv("DATABRICKS_CLIENT_ID"),
-        "secret": os.getenv("DATABRICKS_CLIENT_SECRET"),
-        "cluster_id": os.getenv("DATABRICKS_CLUSTER_ID"),
-        "sql_id": os.getenv("DATABRICKS_SQL_ID"),
-        "catalog": os.getenv("DATABRICKS_CATALOG"),
-        "schema": os.getenv("DATABRICKS_SCHEMA")
-    }
+CONFIG_VARS = {
+    "host": "DATABRICKS_HOST",
+    "id": "DATABRICKS_CLIENT_ID",
+    "secret": "DATABRICKS_CLIENT_SECRET",
+    "cluster_id": "DATABRICKS_CLUSTER_ID",
+    "sql_id": "DATABRICKS_SQL_ID",
+    "catalog": "DATABRICKS_CATALOG",
+    "schema": "DATABRICKS_SCHEMA",
+}
 
-    if any( v is None for v in config.values()):
-        print(f"{RED}Missing Environment Variables:{RESET}")
-        for k, v in config.items():
-            if v is None:
-                print(f" - {k}")
-        raise ValueError("Environment incomplete")
-    
+# latency histogram buckets (upper bounds, seconds)
+BUCKETS = (0.5, 1, 2, 5, 10, 30)
+
+
+@dataclass
+class StepResult:
+    step: str
+    status: str         # PASS / FAIL / SKIP
+    seconds: float | None = None    # None: the step did not run
+    error: str = ""
+
+
+def make_config(variables):
+    """:param variables: os.environ, or the dict of one group in all_groups.json (same variable names)"""
+    return {k: variables.get(v) for k, v in CONFIG_VARS.items()}
+
+
+def make_steps(config, log=print):
+    """
+    :param log: where the details (elapsed time, caller...) are printed. Fleet mode passes a no-op.
+    :return: list of (name, function). The first one (OAuth) gets the token that the others need.
+    """
     token_container = {}
+    headers = {}
 
-    HTTP_TIMEOUT = 15  # seconds - socket-level HTTP timeout (unrelated to Databricks wait_timeout in the payload)
     # 1. Test OAuth Handshake
     def test_oauth():
         url = f"{config['host']}/oidc/v1/token"
         data = {"grant_type": "client_credentials", "scope": "all-apis"}
         resp = requests.post(url, data=data, auth=(config['id'], config['secret']), timeout=HTTP_TIMEOUT)
-        print("Elapsed (s):", resp.elapsed.total_seconds())
+        log("Elapsed (s):", resp.elapsed.total_seconds())
         resp.raise_for_status()
         token_container['token'] = resp.json().get("access_token")
-    
+        headers["Authorization"] = f"Bearer {token_container['token']}"
+
     # 2. Test Cluster Access
     def test_cluster():
         url = f"{config['host']}/api/2.0/clusters/get?cluster_id={config['cluster_id']}"
         resp = requests.get(url, headers=headers, timeout=HTTP_TIMEOUT)
-        print("Elapsed (s):", resp.elapsed.total_seconds())
+        log("Elapsed (s):", resp.elapsed.total_seconds())
         resp.raise_for_status()
 
     # 3. Test SQL Warehouse & Permissions (Create/Drop)
@@ -63,15 +83,15 @@ def run_tests():
         # First check Warehouse existence
         url = f"{config['host']}/api/2.0/sql/warehouses/{config['sql_id']}"
         resp = requests.get(url, headers=headers, timeout=HTTP_TIMEOUT)
-        print("Elapsed (s):", resp.elapsed.total_seconds())
+        log("Elapsed (s):", resp.elapsed.total_seconds())
         resp.raise_for_status()
 
         # Try to CREATE and then DROP a table to prove write permissions
         sql_url = f"{config['host']}/api/2.0/sql/statements"
-        
+
         # Unique table name to avoid collisions if multiple people run this
         test_table = f"test_conn_{uuid.uuid4().hex[:8]}"
-        
+
         # CREATE
         create_query = {
             "warehouse_id": config['sql_id'],
@@ -79,12 +99,12 @@ def run_tests():
             "wait_timeout": "15s"
         }
         resp = requests.post(sql_url, headers=headers, json=create_query, timeout=20)
-        print("Elapsed (s):", resp.elapsed.total_seconds())
+        log("Elapsed (s):", resp.elapsed.total_seconds())
         resp.raise_for_status()
         if resp.json().get('status', {}).get('state') == 'FAILED':
              raise Exception("CREATE TABLE Failed: " + str(resp.json().get('status', {}).get('error')))
 
-        print(f"{GREEN}Successfully created table {test_table}{RESET}")
+        log(f"{GREEN}Successfully created table {test_table}{RESET}")
         # DROP
         drop_query = {
             "warehouse_id": config['sql_id'],
@@ -94,7 +114,7 @@ def run_tests():
         resp = requests.post(sql_url, headers=headers, json=drop_query, timeout=20)
         resp.raise_for_status()
         if resp.json().get('status', {}).get('state') == 'FAILED':
-             print(f"{RED}Warning: Failed to cleanup table {test_table}{RESET}")
+             print(f"{RED}Warning: Failed to cleanup table {config['catalog']}.{config['schema']}.{test_table}{RESET}")
 
     # 4. Test Forbidden Access (Schema Isolation)
     def test_forbidden():
@@ -103,9 +123,9 @@ def run_tests():
         # first, see who really calls the query: the user in the PC (probably with admin grants), or the SP
         me_url = f"{config['host']}/api/2.0/preview/scim/v2/Me"
         me = requests.get(me_url, headers=headers, timeout=15)
-        print("Elapsed (s):", me.elapsed.total_seconds())
+        log("Elapsed (s):", me.elapsed.total_seconds())
         me.raise_for_status()
-        print("Caller:", me.json().get("userName"), "id:", me.json().get("id"))
+        log("Caller:", me.json().get("userName"), "id:", me.json().get("id"))
 
         # If current schema is schema_01, we try schema_02, otherwise we try schema_01.
         forbidden_schema = "schema_01" if config['schema'] != "schema_01" else "schema_02"
@@ -117,7 +137,7 @@ def run_tests():
             "wait_timeout": "0s"  # return immediately with PENDING; we poll below for the terminal state
         }
         resp = requests.post(sql_url, headers=headers, json=query_data, timeout=15)
-        print("Elapsed (s):", resp.elapsed.total_seconds())
+        log("Elapsed (s):", resp.elapsed.total_seconds())
 
         if resp.status_code in [403, 401]:
             return  # Expected: permission denied at the HTTP level
@@ -137,7 +157,7 @@ def run_tests():
                     f"{config['host']}/api/2.0/sql/statements/{stmt_id}",
                     headers=headers, timeout=15
                 ).json()
-                print("Elapsed (s):", resp.elapsed.total_seconds())
+                log("Elapsed (s):", resp.elapsed.total_seconds())
                 status = det.get("status", {})
 
         state = status.get("state")
@@ -154,18 +174,149 @@ def run_tests():
             raise Exception(f"Statement ended in unexpected state '{state}' for {forbidden_schema}.")
 
     # --- OAuth always runs first (token required for all other tests) ---
-    test_step("OAuth Authentication", test_oauth)
-    if 'token' not in token_container:
-        print(f"{RED}Cannot proceed with other tests without a valid token.{RESET}")
-        return
-    headers = {"Authorization": f"Bearer {token_container['token']}"}
-
     # --- Comment out any tests you don't want to run ---
-    test_step("Cluster Access",             test_cluster)
-    test_step("SQL Warehouse Read/Write",   test_sql_permissions)
-    test_step("Forbidden Schema Access",    test_forbidden)
+    return [
+        ("OAuth Authentication",       test_oauth),
+        ("Cluster Access",             test_cluster),
+        ("SQL Warehouse Read/Write",   test_sql_permissions),
+        ("Forbidden Schema Access",    test_forbidden),
+    ]
+
+
+def run_steps(steps, on_start=None, on_result=None):
+    """Run the steps in order. If the first one (OAuth) fails, the others are skipped. :return: list of StepResult"""
+    results = []
+    for name, func in steps:
+        if results and results[0].status != "PASS":
+            results.append(StepResult(name, "SKIP", error="no OAuth token"))
+            continue
+        if on_start:
+            on_start(name)
+        start = time.monotonic()
+        try:
+            func()
+            results.append(StepResult(name, "PASS", time.monotonic() - start))
+        except Exception as e:
+            results.append(StepResult(name, "FAIL", time.monotonic() - start, str(e)))
+        if on_result:
+            on_result(results[-1])
+    return results
+
+
+def run_tests():
+    config = make_config(os.environ)
+
+    if any( v is None for v in config.values()):
+        print(f"{RED}Missing Environment Variables:{RESET}")
+        for k, v in config.items():
+            if v is None:
+                print(f" - {CONFIG_VARS[k]}")
+        raise ValueError("Environment incomplete")
+
+    def on_result(r):
+        if r.status == "PASS":
+            print(f"{GREEN}PASS{RESET}")
+        else:
+            print(f"{RED}FAIL{RESET}")
+            print(f"   Error: {r.error}")
+            if r.step == "OAuth Authentication":
+                print(f"{RED}Cannot proceed with other tests without a valid token.{RESET}")
+
+    results = run_steps(make_steps(config), on_start=lambda name: print(f"Testing {name}...", end=" ", flush=True),
+                        on_result=on_result)
+    return all(r.status == "PASS" for r in results)
+
+
+def run_fleet(groups_data, max_workers=16):
+    """
+    Run the steps of every group concurrently (the steps of one group run in order).
+    :return: dict {group id -> list of StepResult}
+    """
+    def check(item):
+        group_id, variables = item
+        config = make_config(variables)
+        missing = [CONFIG_VARS[k] for k, v in config.items() if v is None]
+        steps = make_steps(config, log=lambda *args: None)
+        if missing:
+            return group_id, ([StepResult(steps[0][0], "FAIL", error=f"missing {', '.join(missing)}")]
+                              + [StepResult(name, "SKIP", error="incomplete config") for name, _ in steps[1:]])
+        return group_id, run_steps(steps)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(executor.map(check, sorted(groups_data.items())))
+
+
+def format_matrix(fleet_results):
+    """One row per step, one column per group (fleet_results must not be empty)"""
+    steps = [r.step for r in next(iter(fleet_results.values()))]
+    colors = {"PASS": GREEN, "FAIL": RED, "SKIP": YELLOW}
+    width = max(len(s) for s in steps)
+    column = max(4, max(len(str(g)) for g in fleet_results))   # group ids like 'group_01' are wider than a status
+    lines = [" " * (width + 2) + " ".join(f"{g:>{column}}" for g in fleet_results)]
+    for i, step in enumerate(steps):
+        cells = []
+        for results in fleet_results.values():
+            status = results[i].status
+            cells.append(f"{colors[status]}{status:>{column}}{RESET}")
+        lines.append(f"{step:<{width}}  " + " ".join(cells))
+    return "\n".join(lines)
+
+
+def format_latencies(fleet_results):
+    """
+    One histogram line per step: count per bucket, then p50 / p95 / max, over the groups that ran the step
+    (fleet_results must not be empty)
+    """
+    def label(i):
+        low = BUCKETS[i - 1] if i else 0
+        return f"<{BUCKETS[i]}s" if i < len(BUCKETS) else f">={low}s"
+
+    steps = [r.step for r in next(iter(fleet_results.values()))]
+    width = max(len(s) for s in steps)
+    lines = [f"{'':<{width}}  " + " ".join(f"{label(i):>6}" for i in range(len(BUCKETS) + 1)) + "     p50    p95    max"]
+    for i, step in enumerate(steps):
+        seconds = sorted(results[i].seconds for results in fleet_results.values() if results[i].seconds is not None)
+        if not seconds:
+            continue
+        counts = [0] * (len(BUCKETS) + 1)
+        for s in seconds:
+            counts[next((b for b, bound in enumerate(BUCKETS) if s < bound), len(BUCKETS))] += 1
+        p50 = seconds[len(seconds) // 2]
+        p95 = seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))]
+        lines.append(f"{step:<{width}}  " + " ".join(f"{c:>6}" for c in counts)
+                     + f"  {p50:6.2f} {p95:6.2f} {seconds[-1]:6.2f}")
+    return "\n".join(lines)
+
+
+def format_failures(fleet_results):
+    return "\n".join(f"[{group_id}] {r.step}: {r.error}" for group_id, results in fleet_results.items()
+                     for r in results if r.status == "FAIL")
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate the credentials and permissions of a group (or of all groups)")
+    parser.add_argument("--fleet", metavar="ALL_GROUPS_JSON", help="check every group in this file, concurrently")
+    parser.add_argument("--workers", type=int, default=16, help="with --fleet: groups checked concurrently")
+    args = parser.parse_args()
+
     print("--- Databricks Permission Validator ---")
-    run_tests()
+    if args.fleet:
+        with open(args.fleet) as f:
+            groups_data = json.load(f)
+        if not groups_data:
+            sys.exit(f"no groups in file {args.fleet} (is 'terraform output' empty?)")
+        start = time.monotonic()
+        fleet_results = run_fleet(groups_data, args.workers)
+        print(format_matrix(fleet_results))
+        print()
+        print(format_latencies(fleet_results))
+        failures = format_failures(fleet_results)
+        if failures:
+            print(f"\n{RED}Failures:{RESET}\n{failures}")
+        ok = not failures
+        print(f"\n{len(fleet_results)} groups checked in {time.monotonic() - start:.1f}s")
+    else:
+        ok = run_tests()
     print("---------------------------------------")
+    if not ok:
+        sys.exit(1)
@@ -1,41 +1,87 @@
 # gemini 2026-01-23 05:07
-import os
+# Drop all the tables and views in the schemas of a catalog.
+#
+# The objects of the whole catalog are found with one information_schema query, and dropped concurrently
+# over a pool of SQL warehouse connections: first the views (they depend on the tables), then the tables.
+#
+#   python utils/cleanup_schemas.py --catalog 94290_dev --dry-run --plan-json plan.json
+#   python utils/cleanup_schemas.py --catalog 94290_dev --connections 8
 import argparse
-import requests # Still needed for other potential uses, though not directly for SP OAuth now
-from databricks import sql
-
-# Removed get_oauth_token function as SP authentication is no longer supported
-
-def get_connection(host, sql_warehouse_id, auth_token):
-    """Establishes a connection to the Databricks SQL Warehouse using a token."""
-    http_path = f"/sql/1.0/warehouses/{sql_warehouse_id}"
-    return sql.connect(
-        server_hostname=host,
-        http_path=http_path,
-        access_token=auth_token
-    )
-
-def list_schemas(cursor, catalog):
-    """Returns a list of schema names in the given catalog, excluding system schemas."""
-    cursor.execute(f"SHOW SCHEMAS IN `{catalog}`")
-    system_schemas = ["information_schema", "default"] # Schemas to exclude from cleanup
-    return [row.databaseName for row in cursor.fetchall() if row.databaseName not in system_schemas]
-
-def list_objects_in_schema(cursor, catalog, schema):
-    """Returns a list of table/view names in the given schema."""
-    cursor.execute(f"SHOW TABLES IN `{catalog}`.`{schema}`")
-    # The 'tableName' column contains the name of the table/view
-    return [f"`{catalog}`.`{schema}`.`{row.tableName}`" for row in cursor.fetchall()]
+import json
+import os
+import time
+
+from sql_pool import ConnectionPool, run_parallel
+
+SYSTEM_SCHEMAS = ("information_schema", "default")  # Schemas to exclude from cleanup
+
+# information_schema.tables.table_type -> (phase, DROP statement). Lower phases are dropped first.
+DROP_STATEMENTS = {
+    "VIEW": (0, "DROP VIEW IF EXISTS"),
+    "MATERIALIZED_VIEW": (0, "DROP MATERIALIZED VIEW IF EXISTS"),
+    "STREAMING_TABLE": (1, "DROP TABLE IF EXISTS"),
+    "MANAGED": (1, "DROP TABLE IF EXISTS"),
+    "EXTERNAL": (1, "DROP TABLE IF EXISTS"),   # NOTE: the data files of an external table are not deleted
+}
+DEFAULT_DROP = (1, "DROP TABLE IF EXISTS")
+
+
+def list_objects(cursor, catalog):
+    """
+    All the tables and views of the catalog, in one query.
+    :return: list of dict(schema, name, type, full_name, phase, statement), in drop order
+    """
+    excluded = ", ".join(f"'{s}'" for s in SYSTEM_SCHEMAS)
+    cursor.execute(f"SELECT table_schema, table_name, table_type FROM `{catalog}`.information_schema.tables "
+                   f"WHERE table_schema NOT IN ({excluded})")
+    plan = []
+    for schema, name, table_type in cursor.fetchall():
+        full_name = f"`{catalog}`.`{schema}`.`{name}`"
+        phase, drop = DROP_STATEMENTS.get(table_type, DEFAULT_DROP)
+        plan.append({"schema": schema, "name": name, "type": table_type, "full_name": full_name,
+                     "phase": phase, "statement": f"{drop} {full_name}"})
+    return sorted(plan, key=lambda o: (o["phase"], o["schema"], o["name"]))
+
+
+def format_plan(plan):
+    counts = {}
+    for obj in plan:
+        counts[obj["type"]] = counts.get(obj["type"], 0) + 1
+    lines = [f"  - {obj['type']:18} {obj['full_name']}" for obj in plan]
+    lines.append("  " + ", ".join(f"{t}: {n}" for t, n in sorted(counts.items())))
+    return "\n".join(lines)
+
+
+def drop_objects(pool, plan):
+    """
+    Drop the objects concurrently, one phase after the other (views before tables).
+    :return: list of (object, error), error is None for the dropped ones
+    """
+    def drop(cursor, obj):
+        cursor.execute(obj["statement"])
+
+    results = []
+    for phase in sorted({o["phase"] for o in plan}):
+        for obj, _, error, seconds in run_parallel(pool, drop, [o for o in plan if o["phase"] == phase]):
+            if error:
+                print(f"  ERROR deleting {obj['full_name']}: {error}")
+            else:
+                print(f"  DELETED: {obj['full_name']} ({seconds:.1f}s)")
+            results.append((obj, error))
+    return results
+
 
 def main():
     parser = argparse.ArgumentParser(description="Clean all tables and views from schemas in a Databricks catalog.")
     parser.add_argument("--catalog", required=True, help="The name of the catalog to clean.")
     parser.add_argument("--host", help="Databricks host URL (e.g., adb-....azuredatabricks.net). Defaults to DATABRICKS_HOST env var.")
     parser.add_argument("--sql-id", help="Databricks SQL Warehouse ID. Defaults to DATABRICKS_SQL_ID env var.")
-    # Removed --client-id and --client-secret arguments
     parser.add_argument("--token", help="Databricks Personal Access Token. Defaults to DATABRICKS_TOKEN env var.")
     parser.add_argument("--yes", action="store_true", help="Skip confirmation prompt and proceed with deletion.")
-    
+    parser.add_argument("--dry-run", action="store_true", help="Only print (and save) the plan, do not delete anything.")
+    parser.add_argument("--plan-json", help="Write the deletion plan to this json file.")
+    parser.add_argument("--connections", type=int, default=4, help="Number of concurrent SQL warehouse connections.")
+
     args = parser.parse_args()
 
     # Get connection details from args or environment variables
@@ -43,69 +89,55 @@ def main():
     sql_id = args.sql_id or os.getenv("DATABRICKS_SQL_ID")
     token = args.token or os.getenv("DATABRICKS_TOKEN")
 
-
-    # Removed client_id and client_secret env var checks
-
     if not all([host, sql_id]):
         print("Error: --host and --sql-id arguments (or their corresponding environment variables) are required.")
         return
 
     print("--- Databricks Schema Cleanup ---")
-    
-    auth_token = token
-    if not auth_token:
+
+    if not token:
         print("Error: A Personal Access Token is required. Provide it via --token or DATABRICKS_TOKEN environment variable.")
         return
 
-    objects_to_delete = []
-    try:
-        # Use the obtained token for connection
-        with get_connection(host.replace("https://", ""), sql_id, auth_token) as connection:
-            with connection.cursor() as cursor:
-                print(f"Fetching schemas from catalog '{args.catalog}' using SQL Warehouse '{sql_id}'...")
-                schemas = list_schemas(cursor, args.catalog)
-                print(f"Found {len(schemas)} schemas.")
-
-                for schema in schemas:
-                    print(f"  Fetching objects from schema '{schema}'...")
-                    objects_in_schema = list_objects_in_schema(cursor, args.catalog, schema)
-                    if objects_in_schema:
-                        objects_to_delete.extend(objects_in_schema)
-    except Exception as e:
-        if "SQL endpoint" in str(e) and "not found" in str(e):
-            print(f"\nWarning: SQL Warehouse '{sql_id}' not found. Assuming no objects to clean up.")
-            return # Exit gracefully if warehouse is gone
-        else:
+    with ConnectionPool(host, f"/sql/1.0/warehouses/{sql_id}", token, size=args.connections) as pool:
+        try:
+            print(f"Fetching tables and views from catalog '{args.catalog}' using SQL Warehouse '{sql_id}'...")
+            with pool.cursor() as cursor:
+                plan = list_objects(cursor, args.catalog)
+        except Exception as e:
+            if "SQL endpoint" in str(e) and "not found" in str(e):
+                print(f"\nWarning: SQL Warehouse '{sql_id}' not found. Assuming no objects to clean up.")
+                return  # Exit gracefully if warehouse is gone
             print(f"\nError connecting to Databricks or fetching objects: {e}")
             return
 
-    if not objects_to_delete:
-        print("\nNo tables or views found in any schema. Nothing to do.")
-        return
+        if args.plan_json:
+            with open(args.plan_json, "w") as f:
+                json.dump({"catalog": args.catalog, "objects": plan}, f, indent=2)
+            print(f"Plan written to {args.plan_json}")
 
-    print("\nThe following tables/views will be permanently deleted:")
-    for obj_name in objects_to_delete:
-        print(f"  - {obj_name}")
+        if not plan:
+            print("\nNo tables or views found in any schema. Nothing to do.")
+            return
 
-    if not args.yes:
-        confirm = input("\nAre you sure you want to proceed? Type 'yes' to confirm: ")
-        if confirm.lower() != 'yes':
-            print("Aborted by user.")
+        print(f"\nThe following {len(plan)} tables/views will be permanently deleted:")
+        print(format_plan(plan))
+        if args.dry_run:
+            print("\nDry run: nothing was deleted.")
             return
 
-    print("\nStarting deletion...")
-    try:
-        with get_connection(host.replace("https://", ""), sql_id, auth_token) as connection:
-            with connection.cursor() as cursor:
-                for obj_name in objects_to_delete:
-                    try:
-                        cursor.execute(f"DROP TABLE IF EXISTS {obj_name}")
-                        print(f"  DELETED: {obj_name}")
-                    except Exception as e:
-                        print(f"  ERROR deleting {obj_name}: {e}")
-                print("Cleanup complete.")
-    except Exception as e:
-        print(f"\nAn error occurred during deletion: {e}")
+        if not args.yes:
+            confirm = input("\nAre you sure you want to proceed? Type 'yes' to confirm: ")
+            if confirm.lower() != 'yes':
+                print("Aborted by user.")
+                return
+
+        print(f"\nStarting deletion with {args.connections} connections...")
+        start = time.monotonic()
+        results = drop_objects(pool, plan)
+        failed = sum(1 for _, error in results if error)
+        print(f"Cleanup complete: {len(results) - failed} deleted, {failed} failed, in {time.monotonic() - start:.1f}s")
+
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,10 @@
 # Import the existing Databricks resources into Terraform
-# [NC 2025-04-23] 
+# [NC 2025-04-23]
 
 # Sometimes, the TF state is not in sync with the actual resources in Databricks.
-# This script will import the existing Databricks resources into Terraform.
-# It will create a new Terraform state file with the imported resources.
+# This script writes Terraform 1.5+ `import {}` blocks for the existing Databricks resources,
+# so ONE `terraform plan` / `terraform apply` imports the whole workspace,
+# instead of running hundreds of `terraform import` commands one by one.
 
 """
 How to use this script:
@@ -13,77 +14,214 @@ As GPT said:
 terraform import only succeeds when both of these are true:
 
 The resource’s address (for example
-databricks_user.workspace_user["group_01_michal.kfir@campus.technion.ac.il"])
+databricks_user.workspace_user["michal.kfir@campus.technion.ac.il"])
 is present in your configuration ( *.tf files ).
 
 You supply the correct remote-side ID (the SCIM ID).
-If either side is missing, Terraform prints “Configuration for import target does not exist” 
+If either side is missing, Terraform prints “Configuration for import target does not exist”
 
 Make sure the configuration knows about all users:
-  create a CSV contains every [group_name,member_name] pair that Databricks already has
+  the CSV of the groups must contain every [group_name,member_name] pair that Databricks already has
 
-  run 
+  run (from terraform/dbr)
+    python utils/import_dbr_state.py                  # writes imports.tf
+    python utils/import_dbr_state.py --uc --catalog 94290_dev --warehouse-name <name>
+                                                      # enable_unified_catalog_isolation = true
     tf init
-    tf plan
-
-  If everything is covered you should see a + (create) line for each missing user. Do not apply – we are going to import them instead.
+    tf plan        # shows "will be imported" for every block. Review, then
+    tf apply
+    rm imports.tf  # the import blocks are not needed after the apply
+
+What is imported (by naming convention, see main.tf group_configs):
+  users that are members of a student group (group_NN), the student groups and all_student_groups,
+  the group memberships, the clusters cluster_NN and their permissions.
+  With --uc: the service principals sp_NN, the shared SQL warehouse, the schemas schema_NN and the grants.
 """
 
+import argparse
+import concurrent.futures
 import os
+import re
+
 import requests
 
-# dry_run = False
-# if dry_run:
-#     print("This is a dry run. No changes will be made to the Terraform state.")
-
-# read the Databricks token and URL from environment
-DATABRICKS_TOKEN = os.environ.get("TF_VAR_databricks_token")
-if not DATABRICKS_TOKEN:
-    raise ValueError("DATABRICKS_TOKEN environment variable is not set")
-if not DATABRICKS_TOKEN.startswith("dapi"):
-    raise ValueError("DATABRICKS_TOKEN environment variable is not a Databricks token")
-
-# read the Databricks URL from environment
-host_name = os.environ.get("TF_VAR_databricks_host")
-if not host_name:
-    raise ValueError("DATABRICKS_host environment variable is not set")
-
-DATABRICKS_URL = f"https://{host_name}/api/2.0/preview/scim/v2/"
-
-# Get all users
-msg = f"{DATABRICKS_URL}Users"
-headers={"Authorization": f"Bearer {DATABRICKS_TOKEN}"}
-print(f"Getting users from {msg}")
-response = requests.get(f"{DATABRICKS_URL}Users", headers={"Authorization": f"Bearer {DATABRICKS_TOKEN}"})
-users = response.json()["Resources"]
-
-# create TF commands to import existing users
-for user in users:
-    user_id = user["id"]
-    user_name = user["userName"]
-    #group_id = user["groups"][0]["value"] if user["groups"] else None
-    #group_name = user["groups"][0]["display"] if user["groups"] else None
-    #user_to_group[user_name] = group_name
-
-    tf_addr = f'databricks_user.workspace_user["{user_name}"]'
-    print(f'terraform import {tf_addr} {user_id}')
-
-
-# # Get all groups
-# response = requests.get(f"{DATABRICKS_URL}Groups", headers={"Authorization": f"Bearer {DATABRICKS_TOKEN}"})
-# groups = response.json()["Resources"]
-
-# # Import each group into Terraform
-# for group in groups:
-#     group_id = group["id"]
-#     group_name = group["displayName"]
-#     if dry_run:
-#         print(f"Would import group {group_name} with ID {group_id}")
-#     else:
-#         # Check if the group name is valid for Terraform
-#         if not group_name.isidentifier():
-#             print(f"Group name {group_name} is not a valid Terraform identifier. Skipping import.")
-#             continue
-#         # Import the group into Terraform
-#         # Note: The group name must be a valid Terraform identifier
-#         subprocess.run(["terraform", "import", f"databricks_group.{group_name}", group_id])
+STUDENT_GROUP_RE = re.compile(r"^group_(\d{2})$")
+CLUSTER_RE = re.compile(r"^cluster_(\d{2})$")
+SP_RE = re.compile(r"^sp_(\d{2})$")
+SCHEMA_RE = re.compile(r"^schema_(\d{2})$")
+MASTER_GROUP = "all_student_groups"
+UC_MODULE = "module.uc_setup[0]"
+
+
+class WorkspaceReader:
+    """Read-only REST calls, with one shared session (connection reuse across threads)"""
+
+    def __init__(self, host, token, max_workers=8):
+        self.base = f"https://{host.replace('https://', '').rstrip('/')}"
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {token}"
+        self.max_workers = max_workers
+
+    def get(self, path, **params):
+        response = self.session.get(f"{self.base}{path}", params=params, timeout=60)
+        response.raise_for_status()
+        return response.json()
+
+    def scim(self, resource, attributes, page_size=100):
+        """
+        All the resources of a SCIM endpoint. After the first page, the other pages are fetched concurrently.
+        The server may cap the page size below page_size: the pages are strided by the size it returned (itemsPerPage).
+        """
+        path = f"/api/2.0/preview/scim/v2/{resource}"
+        first = self.get(path, startIndex=1, count=page_size, attributes=attributes)
+        out = list(first.get("Resources", []))
+        total = int(first.get("totalResults", 0))
+        stride = int(first.get("itemsPerPage") or len(out))
+        starts = range(1 + len(out), total + 1, stride) if out else []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for page in executor.map(lambda s: self.get(path, startIndex=s, count=stride, attributes=attributes),
+                                     starts):
+                out.extend(page.get("Resources", []))
+        if len(out) != total:
+            # objects were added or removed during the listing, or a page came back short: do not import a partial list
+            raise RuntimeError(f"SCIM {resource}: read {len(out)} of {total} resources. Run again")
+        return out
+
+    def clusters(self):
+        return self.get("/api/2.0/clusters/list").get("clusters", [])
+
+    def warehouses(self):
+        return self.get("/api/2.0/sql/warehouses").get("warehouses", [])
+
+    def cluster_acl(self, cluster_id):
+        return self.get(f"/api/2.0/permissions/clusters/{cluster_id}").get("access_control_list", [])
+
+    def schemas(self, catalog):
+        return self.get("/api/2.1/unity-catalog/schemas", catalog_name=catalog).get("schemas", [])
+
+
+def fetch_workspace(reader, catalog=None):
+    """Everything the import blocks need. The listings run concurrently, then the cluster ACLs concurrently."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=reader.max_workers) as executor:
+        futures = {
+            "users": executor.submit(reader.scim, "Users", "id,userName"),
+            "groups": executor.submit(reader.scim, "Groups", "id,displayName,members"),
+            "sps": executor.submit(reader.scim, "ServicePrincipals", "id,displayName,applicationId"),
+            "clusters": executor.submit(reader.clusters),
+            "warehouses": executor.submit(reader.warehouses),
+        }
+        if catalog:
+            futures["schemas"] = executor.submit(reader.schemas, catalog)
+        ws = {k: f.result() for k, f in futures.items()}
+
+        student_clusters = [c for c in ws["clusters"] if CLUSTER_RE.match(c.get("cluster_name", ""))]
+        acls = executor.map(lambda c: reader.cluster_acl(c["cluster_id"]), student_clusters)
+        ws["cluster_acls"] = {c["cluster_id"]: acl for c, acl in zip(student_clusters, acls)}
+    return ws
+
+
+def import_blocks(ws, uc=False, catalog=None, warehouse_name=None):
+    """:return: list of (terraform address, import id)"""
+    blocks = []
+    users = {u["id"]: u["userName"] for u in ws["users"]}
+    groups = {g["displayName"]: g for g in ws["groups"]}
+    student_groups = {name: g for name, g in groups.items() if STUDENT_GROUP_RE.match(name)}
+
+    # users and memberships (only the students: the admins are not in the configuration)
+    members = set()
+    for name, g in sorted(student_groups.items()):
+        for m in g.get("members", []):
+            if m["value"] in users:
+                email = users[m["value"]]
+                members.add((email, m["value"]))
+                blocks.append((f'databricks_group_member.student_assignments["{name}_{email}"]', f'{g["id"]}|{m["value"]}'))
+    for email, user_id in sorted(members):
+        blocks.append((f'databricks_user.workspace_user["{email}"]', user_id))
+
+    # groups
+    for name, g in sorted(student_groups.items()):
+        blocks.append((f'databricks_group.student_groups["{name}"]', g["id"]))
+    master = groups.get(MASTER_GROUP)
+    if master:
+        blocks.append(("databricks_group.all_student_groups", master["id"]))
+        master_members = {m["value"] for m in master.get("members", [])}
+        for name, g in sorted(student_groups.items()):
+            if g["id"] in master_members:
+                blocks.append((f'databricks_group_member.all_students_group_assignment["{name}"]', f'{master["id"]}|{g["id"]}'))
+
+    # clusters and their permissions
+    for c in sorted(ws["clusters"], key=lambda c: c.get("cluster_name", "")):
+        match = CLUSTER_RE.match(c.get("cluster_name", ""))
+        if not match:
+            continue
+        key = match.group(1)
+        blocks.append((f'databricks_cluster.clusters["{key}"]', c["cluster_id"]))
+        group_name = f"group_{key}"
+        if any(a.get("group_name") == group_name for a in ws["cluster_acls"].get(c["cluster_id"], [])):
+            address = (f'{UC_MODULE}.databricks_permissions.cluster_permissions["{key}"]' if uc
+                       else f'databricks_permissions.cluster_permissions["{group_name}"]')
+            blocks.append((address, f'/clusters/{c["cluster_id"]}'))
+
+    if not uc:
+        return blocks
+
+    # unified catalog module
+    for sp in sorted(ws["sps"], key=lambda s: s.get("displayName", "")):
+        match = SP_RE.match(sp.get("displayName", ""))
+        if match:
+            blocks.append((f'{UC_MODULE}.databricks_service_principal.group_sps["{match.group(1)}"]', sp["id"]))
+    warehouse = next((w for w in ws["warehouses"] if w["name"] == warehouse_name), None)
+    if warehouse:
+        blocks.append((f"{UC_MODULE}.databricks_sql_endpoint.shared_warehouse", warehouse["id"]))
+        blocks.append((f"{UC_MODULE}.databricks_permissions.warehouse_usage", f'/sql/warehouses/{warehouse["id"]}'))
+    if catalog:
+        blocks.append((f"{UC_MODULE}.databricks_grants.catalog_grants", f"catalog/{catalog}"))
+        for s in sorted(ws.get("schemas", []), key=lambda s: s["name"]):
+            match = SCHEMA_RE.match(s["name"])
+            if match:
+                key = match.group(1)
+                blocks.append((f'{UC_MODULE}.databricks_schema.group_schemas["{key}"]', f'{catalog}.{s["name"]}'))
+                blocks.append((f'{UC_MODULE}.databricks_grants.schema_grants["{key}"]', f'schema/{catalog}.{s["name"]}'))
+    return blocks
+
+
+def render(blocks):
+    out = ["# Generated by utils/import_dbr_state.py. Run 'terraform plan', then 'terraform apply', then delete this file.\n"]
+    for address, import_id in blocks:
+        out.append(f'import {{\n  to = {address}\n  id = "{import_id}"\n}}\n')
+    return "\n".join(out)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write terraform import blocks for the existing Databricks resources")
+    parser.add_argument("--out", default="imports.tf", help="the file to write (in the terraform folder)")
+    parser.add_argument("--uc", action="store_true", help="also the unified catalog module (enable_unified_catalog_isolation = true)")
+    parser.add_argument("--catalog", help="with --uc: the catalog of the group schemas (var.catalog_name)")
+    parser.add_argument("--warehouse-name", help="with --uc: the shared SQL warehouse (var.sql_warehouse_name)")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent REST calls")
+    args = parser.parse_args()
+
+    # read the Databricks token and URL from environment
+    DATABRICKS_TOKEN = os.environ.get("TF_VAR_databricks_token")
+    if not DATABRICKS_TOKEN:
+        raise ValueError("TF_VAR_databricks_token environment variable is not set")
+    if not DATABRICKS_TOKEN.startswith("dapi"):
+        raise ValueError("TF_VAR_databricks_token environment variable is not a Databricks token")
+    host_name = os.environ.get("TF_VAR_databricks_host")
+    if not host_name:
+        raise ValueError("TF_VAR_databricks_host environment variable is not set")
+
+    reader = WorkspaceReader(host_name, DATABRICKS_TOKEN, max_workers=args.workers)
+    print(f"Reading the workspace {reader.base}")
+    ws = fetch_workspace(reader, catalog=args.catalog if args.uc else None)
+    blocks = import_blocks(ws, uc=args.uc, catalog=args.catalog, warehouse_name=args.warehouse_name)
+    with open(args.out, "w") as f:
+        f.write(render(blocks))
+
+    counts = {}
+    for address, _ in blocks:
+        kind = address.split("[")[0]
+        counts[kind] = counts.get(kind, 0) + 1
+    for kind, n in sorted(counts.items()):
+        print(f"  {n:4}  {kind}")
+    print(f"Wrote {len(blocks)} import blocks to {args.out}. Now run: terraform plan")
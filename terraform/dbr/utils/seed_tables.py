@@ -1,34 +1,111 @@
+import argparse
+import csv
 import json
 import os
 import sys
-from databricks import sql
+import time
 
-# This script seeds the 'test_data' table in each student group's schema.
-# Usage: 
-#   1. pip install databricks-sql-connector
+from sql_pool import ConnectionPool, run_parallel
+
+# This script seeds tables in each student group's schema.
+# The groups are seeded in parallel, over a small pool of SQL warehouse connections.
+# Usage:
+#   1. pip install databricks-sql-connector  (and pyarrow, for Parquet datasets)
 #   2. terraform output -json sp_credentials_and_env_vars > all_groups.json
-#   3. python3 utils/seed_tables.py
+#   3. python3 utils/seed_tables.py [--datasets utils/datasets.json] [--connections 4]
+#
+# A datasets file is a json list of table definitions. Each table gets its rows inline, or from a CSV/Parquet file
+# (path relative to the datasets file):
+#   [{"table": "test_data", "columns": {"id": "INT", "description": "STRING"},
+#     "rows": [[1, "Hello World from Admin Script"]]},
+#    {"table": "flights", "columns": {"origin": "STRING", "delay": "DOUBLE"}, "source": "data/flights.csv"}]
+# "mode": "if_empty" (default) inserts only into an empty table, "replace" recreates the table.
 
-def seed_tables():
-    json_input = "all_groups.json"
-    
-    if not os.path.exists(json_input):
-        print(f"Error: {json_input} not found.")
-        print("Run: terraform output -json sp_credentials_and_env_vars > all_groups.json")
-        sys.exit(1)
+DEFAULT_DATASETS = [
+    {"table": "test_data", "columns": {"id": "INT", "description": "STRING"},
+     "rows": [[1, "Hello World from Admin Script"]]},
+]
 
-    with open(json_input, "r") as f:
-        groups_data = json.load(f)
+# parameters per INSERT statement. Rows are inserted in multi-row batches below this limit.
+MAX_PARAMS_PER_STATEMENT = 250
 
-    # We need a valid connection configuration.
-    # We can pick the first group's config to find the HOST and SQL_ID.
-    # Authentication will use your local Databricks CLI profile (or env vars).
-    # Ensure you are logged in via 'databricks auth login' or have env vars set.
-    
-    first_group = list(groups_data.values())[0]
-    server_hostname = first_group["DATABRICKS_HOST"].replace("https://", "").replace("/", "")
-    http_path = f"/sql/1.0/warehouses/{first_group['DATABRICKS_SQL_ID']}"
-    
+NUMERIC_TYPES = ("INT", "BIGINT", "SMALLINT", "TINYINT")
+FLOAT_TYPES = ("DOUBLE", "FLOAT", "DECIMAL")
+
+
+def convert(value, sql_type):
+    """CSV values are strings: convert them to the column type. Empty -> NULL"""
+    if value is None or value == "":
+        return None
+    base = sql_type.upper().split("(")[0]
+    if base in NUMERIC_TYPES:
+        return int(value)
+    if base in FLOAT_TYPES:
+        return float(value)
+    if base == "BOOLEAN":
+        return str(value).lower() in ("1", "true", "yes")
+    return value
+
+
+def load_rows(dataset, base_dir):
+    """:return: the rows of the dataset, as lists in the order of its columns"""
+    columns = list(dataset["columns"])
+    if "rows" in dataset:
+        return dataset["rows"]
+    source = os.path.join(base_dir, dataset["source"])
+    if source.lower().endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ModuleNotFoundError:
+            sys.exit(f"{source}: reading Parquet needs 'pip install pyarrow'")
+        table = pq.read_table(source, columns=columns)
+        return [list(r) for r in zip(*[table.column(c).to_pylist() for c in columns])]
+    with open(source, newline="", encoding="utf-8") as f:
+        return [[convert(r[c], dataset["columns"][c]) for c in columns] for r in csv.DictReader(f)]
+
+
+def load_datasets(filename):
+    """:return: list of (dataset, rows)"""
+    if filename is None:
+        return [(d, d["rows"]) for d in DEFAULT_DATASETS]
+    with open(filename) as f:
+        datasets = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(filename))
+    return [(d, load_rows(d, base_dir)) for d in datasets]
+
+
+def seed_dataset(cursor, full_name, dataset, rows):
+    """Create the table and bulk insert the rows. :return: number of rows inserted"""
+    columns_sql = ", ".join(f"`{c}` {t}" for c, t in dataset["columns"].items())
+    if dataset.get("mode", "if_empty") == "replace":
+        cursor.execute(f"CREATE OR REPLACE TABLE {full_name} ({columns_sql}) USING DELTA")
+    else:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {full_name} ({columns_sql}) USING DELTA")
+        cursor.execute(f"SELECT COUNT(*) FROM {full_name}")
+        if cursor.fetchone()[0] > 0:
+            return 0   # already seeded (idempotent)
+
+    ncols = len(dataset["columns"])
+    batch = max(1, MAX_PARAMS_PER_STATEMENT // ncols)
+    row_sql = "(" + ", ".join(["?"] * ncols) + ")"
+    for i in range(0, len(rows), batch):
+        chunk = rows[i:i + batch]
+        cursor.execute(f"INSERT INTO {full_name} VALUES " + ", ".join([row_sql] * len(chunk)),
+                       [v for row in chunk for v in row])
+    return len(rows)
+
+
+def seed_group(cursor, item):
+    """All the datasets of one group, on one connection. :return: {table: rows inserted}"""
+    (group_id, config), datasets = item
+    inserted = {}
+    for dataset, rows in datasets:
+        full_name = f"`{config['DATABRICKS_CATALOG']}`.`{config['DATABRICKS_SCHEMA']}`.`{dataset['table']}`"
+        inserted[dataset["table"]] = seed_dataset(cursor, full_name, dataset, rows)
+    return inserted
+
+
+def get_access_token():
     # Check for Access Token (from env or manual input)
     access_token = os.getenv("DATABRICKS_TOKEN")
     if not access_token:
@@ -48,48 +125,47 @@ def seed_tables():
         except Exception as e:
             print(f"   Failed to get Azure token: {e}")
             sys.exit("Please set DATABRICKS_TOKEN environment variable.")
+    return access_token
+
+
+def seed_tables(datasets_file=None, connections=4, json_input="all_groups.json"):
+    if not os.path.exists(json_input):
+        print(f"Error: {json_input} not found.")
+        print("Run: terraform output -json sp_credentials_and_env_vars > all_groups.json")
+        sys.exit(1)
+
+    with open(json_input, "r") as f:
+        groups_data = json.load(f)
+    datasets = load_datasets(datasets_file)
+    print(f"{len(datasets)} datasets, {sum(len(r) for _, r in datasets)} rows per group, {len(groups_data)} groups")
+
+    # All the groups use the same warehouse: take the HOST and SQL_ID from the first one.
+    first_group = list(groups_data.values())[0]
+    http_path = f"/sql/1.0/warehouses/{first_group['DATABRICKS_SQL_ID']}"
+    print(f"Connecting to {first_group['DATABRICKS_HOST']} (Warehouse: {first_group['DATABRICKS_SQL_ID']}) "
+          f"with {connections} connections...")
+
+    start = time.monotonic()
+    with ConnectionPool(first_group["DATABRICKS_HOST"], http_path, get_access_token(), size=connections) as pool:
+        results = run_parallel(pool, seed_group, [(g, datasets) for g in groups_data.items()])
+
+    failed = 0
+    for ((group_id, _), _), inserted, error, seconds in results:
+        if error:
+            failed += 1
+            print(f"[{group_id}] ❌ {seconds:6.2f}s  Error: {error}")
+        else:
+            summary = ", ".join(f"{t}: {n} rows" if n else f"{t}: already seeded" for t, n in inserted.items())
+            print(f"[{group_id}] ✅ {seconds:6.2f}s  {summary}")
+    print(f"Seeded {len(results) - failed} groups, {failed} failed, in {time.monotonic() - start:.1f}s")
+    return failed == 0
 
-    print(f"Connecting to {server_hostname} (Warehouse: {first_group['DATABRICKS_SQL_ID']})...")
-
-    try:
-        with sql.connect(
-            server_hostname=server_hostname,
-            http_path=http_path,
-            access_token=access_token
-        ) as connection:
-            
-            with connection.cursor() as cursor:
-                for group_id, config in groups_data.items():
-                    catalog = config["DATABRICKS_CATALOG"]
-                    schema = config["DATABRICKS_SCHEMA"]
-                    table_full_name = f"{catalog}.{schema}.test_data"
-                    
-                    print(f"[{group_id}] Seeding {table_full_name}...", end=" ", flush=True)
-                    
-                    try:
-                        # 1. Create Table
-                        cursor.execute(f"""
-                            CREATE TABLE IF NOT EXISTS {table_full_name} (
-                                id INT,
-                                description STRING
-                            ) USING DELTA
-                        """)
-                        
-                        # 2. Insert Data (Idempotent)
-                        cursor.execute(f"""
-                            INSERT INTO {table_full_name}
-                            SELECT 1, 'Hello World from Admin Script'
-                            WHERE NOT EXISTS (
-                                SELECT 1 FROM {table_full_name} WHERE id = 1
-                            )
-                        """)
-                        print("✅")
-                        
-                    except Exception as e:
-                        print(f"❌ Error: {e}")
-
-    except Exception as e:
-        print(f"Connection Failed: {e}")
 
 if __name__ == "__main__":
-    seed_tables()
+    parser = argparse.ArgumentParser(description="Create and fill tables in the schema of every group")
+    parser.add_argument("--datasets", help="json file with the table definitions (default: one test_data row)")
+    parser.add_argument("--connections", type=int, default=4, help="number of SQL warehouse connections")
+    parser.add_argument("--groups", default="all_groups.json", help="output of 'terraform output -json sp_credentials_and_env_vars'")
+    args = parser.parse_args()
+    if not seed_tables(args.datasets, args.connections, args.groups):
+        sys.exit(1)
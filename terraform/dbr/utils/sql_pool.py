@@ -0,0 +1,87 @@
+# A small pool of SQL warehouse connections, shared by the utils scripts (seed_tables.py, cleanup_schemas.py).
+# Each worker thread borrows a connection for a unit of work (e.g. one group), so N units run on
+# 'size' connections concurrently instead of one after the other on a single cursor.
+import concurrent.futures
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from databricks import sql
+
+
+class ConnectionPool:
+
+    def __init__(self, server_hostname, http_path, access_token, size=4):
+        self.server_hostname = server_hostname.replace("https://", "").rstrip("/")
+        self.http_path = http_path
+        self.access_token = access_token
+        self.size = size
+        self._idle = queue.Queue()
+        self._all = []
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = sql.connect(server_hostname=self.server_hostname, http_path=self.http_path,
+                                 access_token=self.access_token)
+        with self._lock:
+            self._all.append(connection)
+        return connection
+
+    @contextmanager
+    def cursor(self):
+        """Borrow a connection (opened lazily, at most 'size' of them) and yield a cursor"""
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                may_open = self._opened < self.size
+                self._opened += may_open
+            if may_open:
+                try:
+                    connection = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                connection = self._idle.get()
+        try:
+            with connection.cursor() as cursor:
+                yield cursor
+        finally:
+            self._idle.put(connection)
+
+    def close(self):
+        for connection in self._all:
+            try:
+                connection.close()
+            except Exception as e:
+                print(f"   closing a connection failed: {e}")
+        self._all.clear()
+        self._opened = 0
+        self._idle = queue.Queue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run_parallel(pool, func, items):
+    """
+    Run func(cursor, item) for every item, on the pool connections.
+    :return: list of (item, result, error, seconds), in the order of items
+    """
+    def run(item):
+        start = time.monotonic()
+        try:
+            with pool.cursor() as cursor:
+                return item, func(cursor, item), None, time.monotonic() - start
+        except Exception as e:
+            return item, None, e, time.monotonic() - start
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=pool.size) as executor:
+        return list(executor.map(run, items))